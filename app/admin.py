@@ -1,6 +1,7 @@
 from django.contrib import admin
 
 from app import models
+from app.services import leaderboard, match_queue
 
 
 @admin.register(models.Agent)
@@ -10,6 +11,13 @@ class AgentAdmin(admin.ModelAdmin):
     search_fields = ("name", "id", "owner")
     ordering = ("game__name", "name")
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        leaderboard.update_agent(obj)
+
+        if change and "active" in form.changed_data and not obj.active:
+            match_queue.cancel_agent_matches(obj)
+
 
 @admin.register(models.Season)
 class SeasonAdmin(admin.ModelAdmin):
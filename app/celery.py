@@ -1,7 +1,8 @@
 from celery import Celery
 from celery.schedules import crontab
-from celery.signals import setup_logging
+from celery.signals import celeryd_init, setup_logging
 from dotenv import load_dotenv
+from kombu.exceptions import ChannelError
 
 
 load_dotenv()
@@ -25,12 +26,26 @@ app.conf.beat_schedule = {
     },
     "automated_manager": {
         "task": "app.tasks.automated_manager",
-        "schedule": 10.0,
+        # Transitions are scheduled for when they are due, so this is only a
+        # safety net, and where new seasons and tournaments get created
+        "schedule": 60.0,
     },
     "metrics_logger": {
         "task": "app.tasks.metrics_logger",
         "schedule": 5.0,
     },
+    "refresh_site_stats": {
+        "task": "app.tasks.refresh_site_stats",
+        "schedule": 15.0,
+    },
+    "refresh_season_summaries": {
+        "task": "app.tasks.refresh_season_summaries",
+        "schedule": crontab(minute="*/5"),  # Every 5th minute
+    },
+    "archive_seasons": {
+        "task": "app.tasks.archive_seasons",
+        "schedule": crontab(minute=0),  # Every hour
+    },
     "regenerate_queue": {
         "task": "app.tasks.regenerate_queue",
         "schedule": crontab(minute="*/5"),  # Every 5th minute
@@ -47,4 +62,43 @@ def config_loggers(*args, **kwargs):
     dictConfig(settings.LOGGING)
 
 
+@celeryd_init.connect
+def config_concurrency(conf, options, **kwargs):
+    """
+    Sizes workers that consume a single queue with the concurrency set for
+    that queue, unless `--concurrency` was given
+    """
+    from django.conf import settings
+
+    queues = options.get("queues") or []
+    if isinstance(queues, str):
+        queues = queues.split(",")
+
+    if options.get("concurrency") or len(queues) != 1:
+        return
+
+    concurrency = settings.CELERY_QUEUE_CONCURRENCY.get(queues[0])
+    if concurrency:
+        conf.worker_concurrency = concurrency
+
+
+def queue_depths():
+    """
+    Returns how many messages are waiting on each queue
+    """
+    from django.conf import settings
+
+    depths = {}
+    with app.connection_for_read() as connection:
+        channel = connection.default_channel
+        for queue in settings.CELERY_QUEUES:
+            try:
+                depths[queue] = channel.queue_declare(queue, passive=True).message_count
+            except ChannelError:
+                # Redis only has a queue while it has messages
+                depths[queue] = 0
+
+    return depths
+
+
 app.autodiscover_tasks()
@@ -3,3 +3,6 @@ TEN_MINUTES = ONE_MINUTE * 10
 THIRTY_MINUTES = ONE_MINUTE * 30
 ONE_HOUR = ONE_MINUTE * 60
 ONE_DAY = ONE_HOUR * 24
+
+# Rows per INSERT on bulk_create
+BULK_BATCH_SIZE = 1000
@@ -3,7 +3,8 @@ from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist
 
-from . import models, utils
+from . import models, season_resolver, services, utils
+from .services import leaderboard, match_queue, ratings
 
 
 class NewUserForm(UserCreationForm):
@@ -97,18 +98,23 @@ class AgentForm(forms.ModelForm):
             agent.owner = self.user
 
         game_id = self.data["game_id"]
+        is_new = agent._state.adding
         agent.file_hash = utils.hash_file(agent.file)
         agent.game = models.Game.objects.get(id=game_id)
 
         if commit:
             agent.save()
-            if not agent.ratings.filter(
-                season__active=True, season__main=True
-            ).exists():
-                season = models.Season.objects.filter(active=True, main=True).first()
-                if season:
-                    models.AgentRatings.objects.create(
-                        season=season, agent=agent, game=agent.game
-                    )
+            season_id = season_resolver.current_id()
+            if season_id:
+                ratings.provision_ratings(season_id, [(agent.id, agent.game_id)])
+
+            leaderboard.update_agent(agent)
+
+            if is_new and agent.active:
+                services.join_open_tournaments(agent)
+
+            deactivated = "active" in self.changed_data and not agent.active
+            if not is_new and deactivated:
+                match_queue.cancel_agent_matches(agent)
 
         return agent
@@ -0,0 +1,77 @@
+"""
+Request scoped loader for the current season ratings of agents.
+
+While a loader is active, every agent loaded from the database registers
+itself on it. The first time one of them needs its ratings, the ratings of
+all the registered agents are fetched with a single query, so looping over
+agents on a template costs one query instead of one per agent.
+"""
+import contextvars
+from contextlib import contextmanager
+
+from django.apps import apps
+
+from app import season_resolver
+
+
+_current_loader = contextvars.ContextVar("ratings_loader", default=None)
+
+
+class AgentRatingsLoader:
+    def __init__(self):
+        self._pending = set()
+        self._ratings = {}
+
+    def register(self, agent_id):
+        if agent_id not in self._ratings:
+            self._pending.add(agent_id)
+
+    def get(self, agent_id):
+        """
+        Returns the current season ratings of `agent_id`, or None if it has
+        none. Loads the ratings of every pending agent if needed. A miss is
+        only answered from the batch once, since the ratings can be created
+        later on the same request.
+        """
+        if agent_id not in self._ratings:
+            self._pending.add(agent_id)
+            self._load()
+
+        ratings = self._ratings[agent_id]
+        if ratings is None:
+            del self._ratings[agent_id]
+
+        return ratings
+
+    def _load(self):
+        AgentRatings = apps.get_model("app", "AgentRatings")
+
+        agent_ids = self._pending
+        self._pending = set()
+
+        ratings = {
+            rating.agent_id: rating
+            for rating in AgentRatings.objects.filter(
+                agent_id__in=agent_ids, season_id=season_resolver.current_id()
+            )
+        }
+
+        for agent_id in agent_ids:
+            self._ratings[agent_id] = ratings.get(agent_id)
+
+
+def get_loader():
+    return _current_loader.get()
+
+
+@contextmanager
+def ratings_loader():
+    """
+    Activates a loader for the duration of the block. Used by the middleware
+    for each request, but also useful on tasks that go through many agents.
+    """
+    token = _current_loader.set(AgentRatingsLoader())
+    try:
+        yield _current_loader.get()
+    finally:
+        _current_loader.reset(token)
@@ -0,0 +1,67 @@
+import uuid
+from time import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django_redis import get_redis_connection
+
+from app import models
+
+
+class Command(BaseCommand):
+    help = (
+        "Times Tournament.create_matches for tournaments of different sizes. "
+        "Everything is created inside a transaction that is rolled back, and "
+        "the matches are queued on a throwaway queue."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--agents", nargs="+", type=int, default=[10, 100, 500], dest="sizes"
+        )
+        parser.add_argument(
+            "--mode",
+            default="TRIPLE_ROUND_ROBIN",
+            choices=[mode for mode, _ in models.Tournament.MODES],
+        )
+
+    def handle(self, *args, **options):
+        for n_agents in options["sizes"]:
+            self._benchmark(n_agents, options["mode"])
+
+    def _benchmark(self, n_agents, mode):
+        prefix = f"benchmark_{uuid.uuid4().hex[:8]}"
+        queue_key = f"{prefix}_match_queue"
+
+        with transaction.atomic(), override_settings(MATCH_QUEUE_KEY=queue_key):
+            owner = User.objects.create(username=prefix)
+            game = models.Game.objects.create(name=prefix)
+            season = models.Season.objects.create(name=prefix, active=False)
+            tournament = models.Tournament.objects.create(
+                name=prefix, game=game, season=season, mode=mode
+            )
+            agents = models.Agent.objects.bulk_create(
+                [
+                    models.Agent(name=f"{prefix}_{i}", owner=owner, game=game)
+                    for i in range(n_agents)
+                ]
+            )
+            tournament.participants.set(agents)
+
+            with CaptureQueriesContext(connection) as context:
+                t_start = time()
+                tournament.create_matches()
+                duration = time() - t_start
+
+            n_matches = models.Match.objects.filter(tournament=tournament).count()
+            transaction.set_rollback(True)
+
+        # The queue has per agent indexes and a tombstone set next to it
+        redis = get_redis_connection("default")
+        redis.delete(queue_key, *redis.scan_iter(f"{queue_key}:*"))
+
+        self.stdout.write(
+            f"{mode} {n_agents=} {n_matches=} queries={len(context)} {duration=:.3f}s"
+        )
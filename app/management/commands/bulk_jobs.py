@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app.services import bulk_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Lists, starts or resumes bulk jobs. Jobs run on the celery bulk "
+        f"queue. Job types: {', '.join(bulk_jobs.JOBS)}"
+    )
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest="action", required=True)
+
+        subparsers.add_parser("list")
+
+        start = subparsers.add_parser("start")
+        start.add_argument("job_type", choices=list(bulk_jobs.JOBS))
+        start.add_argument(
+            "--param",
+            action="append",
+            default=[],
+            help="Job parameter as key=value, e.g. season_id=<id>",
+        )
+        start.add_argument(
+            "--chunk-size", type=int, default=bulk_jobs.DEFAULT_CHUNK_SIZE
+        )
+
+        resume = subparsers.add_parser("resume")
+        resume.add_argument("job_id")
+
+    def handle(self, *args, **options):
+        if options["action"] == "start":
+            params = dict(param.split("=", 1) for param in options["param"])
+            job_id = bulk_jobs.start(
+                options["job_type"], params, chunk_size=options["chunk_size"]
+            )
+            self.stdout.write(f"started {options['job_type']} job {job_id}")
+            return
+
+        if options["action"] == "resume":
+            if bulk_jobs.progress(options["job_id"]) is None:
+                raise CommandError(f"job {options['job_id']} doesn't exist")
+
+            bulk_jobs.resume(options["job_id"])
+            self.stdout.write(f"resumed job {options['job_id']}")
+            return
+
+        for job in bulk_jobs.all_jobs():
+            status = "stalled" if job["stalled"] else job["status"]
+            eta = f" eta {job['eta']:%Y-%m-%d %H:%M:%S}" if job["eta"] else ""
+            self.stdout.write(
+                f"{job['id']} {job['type']} {status} "
+                f"{job['processed']}/{job['total']} ({job['percent']:.1f}%){eta}"
+            )
@@ -0,0 +1,114 @@
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from app.services import pairings
+from app.services.elo import compute_updated_ratings
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulates tournaments between agents with known true ratings and "
+        "compares how fast the elo of the agents converges with adaptive and "
+        "round robin pairings. Reports the rating error, in elo points, and the "
+        "rank correlation with the true ratings against the number of matches "
+        "played. Nothing touches the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--agents", type=int, default=32)
+        parser.add_argument("--matches", type=int, default=2000)
+        parser.add_argument("--report-every", type=int, default=200)
+        parser.add_argument(
+            "--spread",
+            type=float,
+            default=200,
+            help="Standard deviation of the true ratings",
+        )
+        parser.add_argument("--runs", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        checkpoints = list(
+            range(
+                options["report_every"], options["matches"] + 1, options["report_every"]
+            )
+        )
+        errors = {"ADAPTIVE": [], "ROUND_ROBIN": []}
+
+        for run in range(options["runs"]):
+            rng = np.random.default_rng(options["seed"] + run)
+            true_elos = rng.normal(1500, options["spread"], options["agents"])
+
+            for mode in errors:
+                errors[mode].append(
+                    self._simulate(
+                        mode, true_elos, options["matches"], checkpoints, rng
+                    )
+                )
+
+        self.stdout.write(
+            f"{'':>8} {'rating error':>25} {'rank correlation':>25}\n"
+            f"{'matches':>8} {'adaptive':>12} {'round robin':>12} "
+            f"{'adaptive':>12} {'round robin':>12}"
+        )
+        adaptive = np.mean(errors["ADAPTIVE"], axis=0)
+        round_robin = np.mean(errors["ROUND_ROBIN"], axis=0)
+        for n_matches, adaptive_row, round_robin_row in zip(
+            checkpoints, adaptive, round_robin
+        ):
+            self.stdout.write(
+                f"{n_matches:>8} {adaptive_row[0]:>12.1f} {round_robin_row[0]:>12.1f} "
+                f"{adaptive_row[1]:>12.3f} {round_robin_row[1]:>12.3f}"
+            )
+
+    def _simulate(self, mode, true_elos, n_matches, checkpoints, rng):
+        """
+        Plays `n_matches` between agents of `true_elos`, starting from the
+        initial rating, and returns the rating error and rank correlation at
+        each checkpoint
+        """
+        n_agents = len(true_elos)
+        elos = np.full(n_agents, 1500.0)
+        games_played = np.zeros(n_agents)
+        times_played = np.zeros((n_agents, n_agents))
+        true_expected = pairings.expected_scores(true_elos)
+
+        schedule = pairings.round_robin(range(n_agents), n_cycles=2)
+        errors = []
+        played = 0
+
+        while played < n_matches:
+            if mode == "ADAPTIVE":
+                pairs = pairings.adaptive_pairings(elos, games_played, times_played)
+            else:
+                pairs = schedule[(played // (n_agents // 2)) % len(schedule)]
+
+            for player1, player2 in pairs:
+                result = float(rng.random() < true_expected[player1, player2])
+                updated = compute_updated_ratings(
+                    {player1: elos[player1], player2: elos[player2]},
+                    {(player1, player2): result},
+                )
+                elos[player1], elos[player2] = updated[player1], updated[player2]
+
+                games_played[[player1, player2]] += 1
+                times_played[player1, player2] += 1
+                times_played[player2, player1] += 1
+
+                played += 1
+                if played in checkpoints:
+                    errors.append(self._error(elos, true_elos))
+                if played == n_matches:
+                    break
+
+        return errors
+
+    def _error(self, elos, true_elos):
+        # Elo is only defined up to an offset, so both sides are centered
+        # before comparing
+        difference = (elos - elos.mean()) - (true_elos - true_elos.mean())
+        rank_correlation = np.corrcoef(
+            np.argsort(np.argsort(elos)), np.argsort(np.argsort(true_elos))
+        )[0, 1]
+
+        return np.sqrt(np.mean(difference**2)), rank_correlation
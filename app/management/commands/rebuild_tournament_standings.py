@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from app import models
+from app.services import standings
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the tournament standings from the matches. Rebuilds all tournaments if no id is given."
+
+    def add_arguments(self, parser):
+        parser.add_argument("tournament_ids", nargs="*", type=str)
+
+    def handle(self, *args, **options):
+        if not options["tournament_ids"]:
+            standings.rebuild_all()
+            return
+
+        for tournament_id in options["tournament_ids"]:
+            standings.rebuild(models.Tournament.objects.get(id=tournament_id))
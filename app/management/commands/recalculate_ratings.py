@@ -1,11 +1,14 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
 from app import models
 from app.services import recalculate_ratings_for_season
 
 
 class Command(BaseCommand):
-    help = "Recalculatings ratings for a season from the played matches"
+    help = (
+        "Recalculatings ratings for a season from the played matches. Runs "
+        "async as a bulk job, see the bulk_jobs command to follow it"
+    )
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -15,4 +18,8 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         season_id = options.get("season_id")
         season = models.Season.objects.get(id=season_id)
-        recalculate_ratings_for_season(season)
+        try:
+            job_id = recalculate_ratings_for_season(season)
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f"started job {job_id}")
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from app.services import match_counters
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the per minute match counters from the database. Use it after a redis outage."
+
+    def handle(self, *args, **options):
+        match_counters.reconcile()
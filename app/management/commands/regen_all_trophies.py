@@ -4,7 +4,11 @@ from app.services.trophy import regen_all_trophies
 
 
 class Command(BaseCommand):
-    help = "Recreate trophies for all tournaments. Runs async using celery"
+    help = (
+        "Recreate trophies for all tournaments. Runs async as a bulk job, see "
+        "the bulk_jobs command to follow it"
+    )
 
     def handle(self, *args, **options):
-        regen_all_trophies()
+        job_id = regen_all_trophies()
+        self.stdout.write(f"started job {job_id}")
@@ -235,6 +235,27 @@ def register_replay_being_overwritten(game_name):
     )
 
 
+def register_tournaments_update(duration, n_tournaments):
+    push_metric(
+        {
+            "fields": {"value": duration, "n_tournaments": n_tournaments},
+            "measurement": "tournaments_update",
+            "time": timezone.now().isoformat(),
+        }
+    )
+
+
+def register_task_lock(task_name, wait, acquired):
+    push_metric(
+        {
+            "fields": {"wait": wait, "skipped": int(not acquired)},
+            "measurement": "task_lock",
+            "tags": {"task": task_name},
+            "time": timezone.now().isoformat(),
+        }
+    )
+
+
 def process_urls_into_tags(url):
     processed_url = re.sub(
         "[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", "<pk>", url
@@ -9,6 +9,7 @@ from django.utils.deprecation import MiddlewareMixin
 from tld import get_tld
 from tld.exceptions import TldBadUrl, TldDomainNotFound, TldIOError
 
+from . import loaders
 from .metrics import process_urls_into_tags, push_metric
 
 
@@ -118,3 +119,17 @@ class InfluxDBRequestMiddleware(MiddlewareMixin):
                 # Never fail a request because pushing the metrics failed. Just
                 # log a failure
                 logger.exception(err, extra={"request": request})
+
+
+class RatingsLoaderMiddleware:
+    """
+    Activates a ratings loader for each request, so agents rendered on the
+    same page have their ratings fetched together.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with loaders.ratings_loader():
+            return self.get_response(request)
@@ -0,0 +1,123 @@
+# Generated by Django 4.0.7 on 2026-10-19 16:44
+
+import uuid
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def _tally(matches, player_field, win_result, lose_result):
+    return (
+        matches.values("tournament_id", player_field)
+        .annotate(
+            wins=Count("id", filter=Q(result=win_result)),
+            loses=Count("id", filter=Q(result=lose_result)),
+            draws=Count("id", filter=Q(result=Decimal("0.5"))),
+        )
+        .values_list("tournament_id", player_field, "wins", "loses", "draws")
+    )
+
+
+def fill_standings(apps, schema_editor):
+    """
+    Fills the standings of the tournaments that already have results, so
+    running ones go on from there and finished ones can be ranked
+    """
+    Match = apps.get_model("app", "Match")
+    TournamentStanding = apps.get_model("app", "TournamentStanding")
+
+    matches = Match.objects.filter(
+        tournament__isnull=False, ran=True, result__in=[0, Decimal("0.5"), 1]
+    )
+
+    totals = {}
+    for rows in (
+        _tally(matches, "player1_id", 1, 0),
+        _tally(matches, "player2_id", 0, 1),
+    ):
+        for tournament_id, agent_id, wins, loses, draws in rows.iterator():
+            total = totals.setdefault((tournament_id, agent_id), [0, 0, 0])
+            total[0] += wins
+            total[1] += loses
+            total[2] += draws
+
+    TournamentStanding.objects.bulk_create(
+        (
+            TournamentStanding(
+                tournament_id=tournament_id,
+                agent_id=agent_id,
+                score=wins + Decimal("0.5") * draws,
+                wins=wins,
+                loses=loses,
+                draws=draws,
+            )
+            for (tournament_id, agent_id), (wins, loses, draws) in totals.items()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0084_auto_20220509_0101"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TournamentStanding",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "score",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=10),
+                ),
+                ("wins", models.IntegerField(default=0)),
+                ("loses", models.IntegerField(default=0)),
+                ("draws", models.IntegerField(default=0)),
+                (
+                    "agent",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="tournament_standings",
+                        to="app.agent",
+                    ),
+                ),
+                (
+                    "tournament",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="standings",
+                        to="app.tournament",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="tournamentstanding",
+            index=models.Index(fields=["agent"], name="app_tournam_agent_i_191ce1_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="tournamentstanding",
+            index=models.Index(
+                fields=["tournament"], name="app_tournam_tournam_d40381_idx"
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="tournamentstanding",
+            unique_together={("tournament", "agent")},
+        ),
+        migrations.RunPython(fill_standings, migrations.RunPython.noop),
+    ]
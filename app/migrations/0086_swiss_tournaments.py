@@ -0,0 +1,37 @@
+# Generated by Django 4.0.7 on 2026-10-19 16:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0085_tournament_standings"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="match",
+            name="round",
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="tournament",
+            name="rounds",
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AlterField(
+            model_name="tournament",
+            name="mode",
+            field=models.CharField(
+                choices=[
+                    ("ROUND_ROBIN", "Round Robin"),
+                    ("DOUBLE_ROUND_ROBIN", "Double Round Robin"),
+                    ("TRIPLE_ROUND_ROBIN", "Triple Round Robin"),
+                    ("TIMED", "Timed"),
+                    ("SWISS", "Swiss"),
+                ],
+                max_length=64,
+            ),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.0.7 on 2026-10-19 16:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0086_swiss_tournaments"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tournament",
+            name="best_of",
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name="tournament",
+            name="bracket",
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AlterField(
+            model_name="tournament",
+            name="mode",
+            field=models.CharField(
+                choices=[
+                    ("ROUND_ROBIN", "Round Robin"),
+                    ("DOUBLE_ROUND_ROBIN", "Double Round Robin"),
+                    ("TRIPLE_ROUND_ROBIN", "Triple Round Robin"),
+                    ("TIMED", "Timed"),
+                    ("SWISS", "Swiss"),
+                    ("KNOCKOUT", "Knockout"),
+                ],
+                max_length=64,
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.0.7 on 2026-10-19 17:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0087_knockout_tournaments"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tournament",
+            name="queue_order",
+            field=models.CharField(
+                choices=[("ROUNDS", "Rounds"), ("SPREAD", "Spread")],
+                default="ROUNDS",
+                max_length=64,
+            ),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.0.7 on 2026-10-19 17:05
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_pairs(apps, schema_editor):
+    """
+    Seeds the pair counts of timed tournaments from the matches they already
+    have, so their schedule goes on from there instead of starting over
+    """
+    Match = apps.get_model("app", "Match")
+    Tournament = apps.get_model("app", "Tournament")
+
+    for tournament in Tournament.objects.filter(mode="TIMED").iterator():
+        pair_counts = {}
+        rows = (
+            Match.objects.filter(tournament=tournament)
+            .values("player1_id", "player2_id")
+            .annotate(count=Count("id"))
+            .values_list("player1_id", "player2_id", "count")
+        )
+
+        for player1_id, player2_id, count in rows:
+            key = ":".join(sorted((str(player1_id), str(player2_id))))
+            pair_counts[key] = pair_counts.get(key, 0) + count
+
+        tournament.pair_counts = pair_counts
+        tournament.save(update_fields=["pair_counts"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0088_tournament_queue_order"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tournament",
+            name="pair_counts",
+            field=models.JSONField(default=dict),
+        ),
+        migrations.RunPython(count_pairs, migrations.RunPython.noop),
+    ]
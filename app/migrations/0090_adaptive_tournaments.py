@@ -0,0 +1,29 @@
+# Generated by Django 4.0.7 on 2026-10-19 17:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0089_tournament_pair_counts"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="tournament",
+            name="mode",
+            field=models.CharField(
+                choices=[
+                    ("ROUND_ROBIN", "Round Robin"),
+                    ("DOUBLE_ROUND_ROBIN", "Double Round Robin"),
+                    ("TRIPLE_ROUND_ROBIN", "Triple Round Robin"),
+                    ("TIMED", "Timed"),
+                    ("SWISS", "Swiss"),
+                    ("KNOCKOUT", "Knockout"),
+                    ("ADAPTIVE", "Adaptive"),
+                ],
+                max_length=64,
+            ),
+        ),
+    ]
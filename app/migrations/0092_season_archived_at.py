@@ -0,0 +1,18 @@
+# Generated by Django 4.0.7 on 2026-10-19 18:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0091_season_summary"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="season",
+            name="archived_at",
+            field=models.DateTimeField(null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.7 on 2026-10-19 19:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0092_season_archived_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tournament",
+            name="finalized_at",
+            field=models.DateTimeField(null=True),
+        ),
+    ]
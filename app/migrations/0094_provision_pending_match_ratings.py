@@ -0,0 +1,43 @@
+# Generated by Django 4.0.7 on 2026-10-19 19:55
+
+from django.db import migrations
+
+
+def provision_ratings(apps, schema_editor):
+    """
+    Ratings used to be created lazily when a result came in. They are now
+    created together with the matches, so the players of matches queued
+    before that, e.g. agents reactivated mid season, get theirs here.
+    """
+    AgentRatings = apps.get_model("app", "AgentRatings")
+    Match = apps.get_model("app", "Match")
+
+    pending_matches = Match.objects.filter(ran=False)
+
+    agent_games = set()
+    for player_field in ("player1_id", "player2_id"):
+        agent_games.update(
+            pending_matches.values_list("season_id", player_field, "game_id")
+            .distinct()
+            .iterator()
+        )
+
+    AgentRatings.objects.bulk_create(
+        (
+            AgentRatings(season_id=season_id, agent_id=agent_id, game_id=game_id)
+            for season_id, agent_id, game_id in agent_games
+        ),
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0093_tournament_finalized_at"),
+    ]
+
+    operations = [
+        migrations.RunPython(provision_ratings, migrations.RunPython.noop),
+    ]
@@ -1,20 +1,19 @@
-import itertools
 import logging
 import uuid
-from collections import defaultdict
 from datetime import timedelta
-from math import ceil
+from math import ceil, log2
 
 import humanize
-from django.apps import apps
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models import Count, F, QuerySet
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models import Count, Exists, F, Max, OuterRef, Q, QuerySet, Subquery
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.utils.functional import cached_property
 
-from . import utils
+from . import constants, loaders, season_resolver, utils
 
 
 logging.config.dictConfig(settings.LOGGING)
@@ -41,7 +40,7 @@ class AgentQuerySet(QuerySet):
 
     def by_elo(self):
         return (
-            self.filter(ratings__season__active=True, ratings__season__main=True)
+            self.filter(ratings__season_id=season_resolver.current_id())
             .annotate(elo_rating=F("ratings__elo"))
             .order_by("-elo_rating")
         )
@@ -66,18 +65,40 @@ class Agent(BaseModel):
             models.Index(fields=["owner"]),
         ]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        agent = super().from_db(db, field_names, values)
+
+        loader = loaders.get_loader()
+        if loader is not None:
+            loader.register(agent.id)
+
+        return agent
+
     @cached_property
     def current_ratings(self):
-        # FIXME: We shouldn't be creating stuff on a getter
-        # TODO: Cache this so we are not querrying the database all the time.
-        # We might also use a try except instead, since the excep path is much
-        # more unlikely to get executed anyways. It might mess up transactions
-        # thought, so idk if it is worth it.
-        if not self.ratings.filter(season__active=True, season__main=True).exists():
-            season = Season.objects.get(active=True, main=True)
-            AgentRatings.objects.create(season=season, agent=self, game=self.game)
+        """
+        Ratings of the agent on the current season. Goes through the request
+        loader when there is one, so agents loaded together share one query.
+        Agents without ratings get an unsaved, zeroed, instance. Ratings are
+        created when the agent or the season is created, never here.
+        """
+        loader = loaders.get_loader()
+        if loader is not None:
+            ratings = loader.get(self.id)
+        else:
+            ratings = self.ratings.filter(
+                season_id=season_resolver.current_id()
+            ).first()
+
+        if ratings is None:
+            ratings = AgentRatings(
+                agent=self,
+                game_id=self.game_id,
+                season_id=season_resolver.current_id(),
+            )
 
-        return self.ratings.get(season__active=True, season__main=True)
+        return ratings
 
     @property
     def win_ratio(self):
@@ -95,9 +116,7 @@ class Agent(BaseModel):
 
     @property
     def games_played(self):
-        Season = apps.get_model("app", "Season")
-        current_season = Season.objects.get(active=True, main=True)
-        return self.matches.filter(ran=True, season=current_season)
+        return self.matches.filter(ran=True, season_id=season_resolver.current_id())
 
     @property
     def most_recent_match(self):
@@ -181,6 +200,9 @@ class Season(BaseModel):
     is_automated = models.BooleanField(null=True, default=False)
     automated_number = models.IntegerField(null=True)
 
+    # When the snapshot of the season was written, see `services.season_archive`
+    archived_at = models.DateTimeField(null=True)
+
     objects = SeasonQuerySet.as_manager()
 
     class Meta:
@@ -189,6 +211,15 @@ class Season(BaseModel):
     def __str__(self):
         return f"{self.name} ({self.id})"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        season_resolver.invalidate()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        season_resolver.invalidate()
+        return result
+
     @property
     def duration(self):
         return self.end_date - self.start_date
@@ -245,6 +276,31 @@ class Season(BaseModel):
         return Game.objects.filter(agentratings__season=self).distinct()
 
 
+class SeasonSummary(BaseModel):
+    """
+    What the season pages show, stored on a single row. The counters are
+    updated as tournaments and matches get created and played, and the
+    rankings whenever a tournament finishes, so the pages don't need to go
+    over all the matches of the season. See `app.services.season_summary`.
+    """
+
+    season = models.OneToOneField(
+        Season, on_delete=models.CASCADE, related_name="summary"
+    )
+
+    tournaments_count = models.IntegerField(default=0)
+    matches_played_count = models.IntegerField(default=0)
+    matches_pending_count = models.IntegerField(default=0)
+
+    # {game_id: pretty_name} of the games with agents on the season
+    games = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    # {game_id: [agent trophies, ordered by elo]}
+    top_agents = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    # Every rating on the season ordered by elo, with the winners ranking
+    winners = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    rankings_updated_at = models.DateTimeField(null=True)
+
+
 class GameQuerySet(QuerySet):
     def active(self):
         return self.filter(active=True)
@@ -327,6 +383,9 @@ class Match(BaseModel):
         "Season", on_delete=models.CASCADE, related_name="matches"
     )
 
+    # Only set for tournaments that are played round by round
+    round = models.IntegerField(null=True)
+
     objects = MatchQuerySet.as_manager()
 
     class Meta:
@@ -392,14 +451,99 @@ class Match(BaseModel):
         return self.outcome.get("termination") == "TAINTED"
 
 
+def _count_per_tournament(queryset):
+    return Coalesce(
+        Subquery(
+            queryset.filter(tournament=OuterRef("pk"))
+            .order_by()
+            .values("tournament")
+            .annotate(count=Count("pk"))
+            .values("count")
+        ),
+        0,
+    )
+
+
+class TournamentQuerySet(QuerySet):
+    def with_state(self):
+        """
+        Annotates what the tournament state machine looks at, so going over
+        many tournaments doesn't cost a handful of queries per tournament.
+        The `Tournament` properties use these values when present.
+        """
+        matches = Match.objects.all()
+
+        return self.annotate(
+            annotated_matches_count=_count_per_tournament(matches),
+            annotated_pending_matches_count=_count_per_tournament(
+                matches.filter(ran=False)
+            ),
+            annotated_current_round=Coalesce(
+                Subquery(
+                    matches.filter(tournament=OuterRef("pk"))
+                    .order_by()
+                    .values("tournament")
+                    .annotate(current_round=Max("round"))
+                    .values("current_round")
+                ),
+                0,
+            ),
+            annotated_participants_count=_count_per_tournament(
+                Tournament.participants.through.objects.all()
+            ),
+            has_trophies=Exists(Trophy.objects.filter(tournament=OuterRef("pk"))),
+        )
+
+    def needing_update(self):
+        """
+        Tournaments whose state can change on the next update. Every other
+        tournament has pending matches that must be played first, or is
+        already done with its trophies handed out. These are:
+
+        - open timed tournaments that already started, which are topped up on
+          every update
+        - open tournaments without pending matches, which need matches, a
+          new round, or to be marked as done
+        - done tournaments without pending matches that still need trophies,
+          like timed tournaments that finished with matches in flight. Once
+          trophies were attempted, the tournament is finalized and skipped,
+          even if it ended up without any.
+        """
+        return self.with_state().filter(
+            Q(done=False, mode="TIMED", start_date__lte=timezone.now())
+            | Q(done=False, annotated_pending_matches_count=0)
+            | Q(
+                done=True,
+                annotated_pending_matches_count=0,
+                annotated_matches_count__gt=0,
+                has_trophies=False,
+                finalized_at__isnull=True,
+            )
+        )
+
+
 class Tournament(BaseModel):
     MODES = [
         ("ROUND_ROBIN", "Round Robin"),
         ("DOUBLE_ROUND_ROBIN", "Double Round Robin"),
         ("TRIPLE_ROUND_ROBIN", "Triple Round Robin"),
         ("TIMED", "Timed"),
+        ("SWISS", "Swiss"),
+        ("KNOCKOUT", "Knockout"),
+        ("ADAPTIVE", "Adaptive"),
     ]
 
+    # Modes that are played round by round, where each round is only created
+    # once the previous one is finished
+    ROUND_MODES = ["SWISS", "KNOCKOUT", "ADAPTIVE"]
+
+    # How many times each pair meets on round robin modes
+    ROUND_ROBIN_CYCLES = {
+        "ROUND_ROBIN": 1,
+        "DOUBLE_ROUND_ROBIN": 2,
+        "TRIPLE_ROUND_ROBIN": 3,
+    }
+
     name = models.CharField(max_length=64, unique=True)
     game = models.ForeignKey(
         "Game", on_delete=models.CASCADE, related_name="tournaments"
@@ -415,11 +559,47 @@ class Tournament(BaseModel):
     start_date = models.DateTimeField(null=True)
     end_date = models.DateTimeField(null=True)
 
+    # For timed tournaments, how many matches were created for each pair of
+    # agents, keyed by `pairings.pair_key`
+    pair_counts = models.JSONField(default=dict)
+
     is_automated = models.BooleanField(null=True, default=False)
     automated_number = models.IntegerField(null=True)
 
+    # For swiss and adaptive tournaments. Defaults to log2 of the number of
+    # participants
+    rounds = models.IntegerField(null=True)
+
+    # Order in which round robin matches are queued. Either round by round,
+    # or reordered to space out the matches of each agent as much as possible
+    queue_order = models.CharField(
+        max_length=64,
+        choices=[("ROUNDS", "Rounds"), ("SPREAD", "Spread")],
+        default="ROUNDS",
+    )
+
+    # For knockout tournaments. How many games each tie has, and the agents
+    # on each tie of each round, starting from the seeded first round, plus
+    # the agents that forfeited once deactivated
+    best_of = models.IntegerField(default=1)
+    bracket = models.JSONField(default=dict)
+
     done = models.BooleanField(null=True, default=False)
 
+    # When the trophies of a done tournament were handed out, or found to be
+    # impossible to hand out, so it isn't picked up by updates anymore
+    finalized_at = models.DateTimeField(null=True)
+
+    objects = TournamentQuerySet.as_manager()
+
+    # Set by `TournamentQuerySet.with_state`
+    STATE_ANNOTATIONS = [
+        "annotated_matches_count",
+        "annotated_pending_matches_count",
+        "annotated_current_round",
+        "annotated_participants_count",
+    ]
+
     class Meta:
         indexes = [
             models.Index(fields=["done"]),
@@ -436,63 +616,80 @@ class Tournament(BaseModel):
             now = timezone.now()
             return self.start_date <= now and now <= self.end_date
 
+        if self.mode in self.ROUND_MODES:
+            return self.has_pending_matches or self.current_round < self.total_rounds
+
         return self.has_pending_matches
 
+    @property
+    def current_round(self):
+        if "annotated_current_round" in self.__dict__:
+            return self.annotated_current_round
+
+        return self.matches.aggregate(current_round=Max("round"))["current_round"] or 0
+
+    @property
+    def total_rounds(self):
+        if self.rounds and self.mode != "KNOCKOUT":
+            return self.rounds
+
+        n_participants = self.__dict__.get("annotated_participants_count")
+        if n_participants is None:
+            n_participants = self.participants.count()
+
+        if n_participants < 2:
+            return 0
+
+        return max(1, ceil(log2(n_participants)))
+
     @property
     def has_pending_matches(self):
+        if "annotated_pending_matches_count" in self.__dict__:
+            return self.annotated_pending_matches_count > 0
+
         return self.matches.filter(ran=False).exists()
 
     @property
     def pending_matches_count(self):
+        if "annotated_pending_matches_count" in self.__dict__:
+            return self.annotated_pending_matches_count
+
         return self.matches.filter(ran=False).count()
 
+    @property
+    def matches_count(self):
+        if "annotated_matches_count" in self.__dict__:
+            return self.annotated_matches_count
+
+        return self.matches.count()
+
     @property
     def played_matches_count(self):
+        if "annotated_matches_count" in self.__dict__:
+            return self.matches_count - self.pending_matches_count
+
         return self.matches.filter(ran=True).count()
 
     @property
     def ratings(self):
-        score = defaultdict(int)
-        wins = defaultdict(int)
-        loses = defaultdict(int)
-        draws = defaultdict(int)
-        player_map = {}
-
-        for match in self.matches.all():
-            # Dumb way to have an id -> Object mapping without extra queries
-            player_map[match.player1.id] = match.player1
-            player_map[match.player2.id] = match.player2
-
-            if match.result == 0:
-                score[match.player1.id] += 0
-                score[match.player2.id] += 1
-                wins[match.player2.id] += 1
-                loses[match.player1.id] += 1
-            if match.result == 0.5:
-                score[match.player1.id] += 0.5
-                score[match.player2.id] += 0.5
-                draws[match.player1.id] += 1
-                draws[match.player2.id] += 1
-            if match.result == 1:
-                score[match.player1.id] += 1
-                score[match.player2.id] += 0
-                wins[match.player1.id] += 1
-                loses[match.player2.id] += 1
-
-        sorted_score = sorted(score.items(), key=lambda x: x[1], reverse=True)
-
-        results = []
-        for id, _ in sorted_score:
-            results.append(
-                TournamentResult(
-                    agent=player_map[id],
-                    score=score[id],
-                    wins=wins[id],
-                    loses=loses[id],
-                    draws=draws[id],
-                )
+        """
+        Standings of the tournament, ordered by score. Read from the
+        standings table, which is kept up to date as results come in. Use the
+        `rebuild_tournament_standings` command if they ever drift from the
+        matches.
+        """
+        rows = self.standings.select_related("agent").order_by("-score", "agent_id")
+
+        return [
+            TournamentResult(
+                agent=row.agent,
+                score=row.score,
+                wins=row.wins,
+                loses=row.loses,
+                draws=row.draws,
             )
-        return results
+            for row in rows
+        ]
 
     def pending_matches(self, limit=25):
         return self.matches.filter(ran=False).order_by("created_at")[0:limit]
@@ -501,41 +698,193 @@ class Tournament(BaseModel):
         return self.matches.filter(ran=True).order_by("-ran_at")[0:limit]
 
     def create_matches(self):
-        from app.services import match_queue
+        """
+        Creates the matches of the tournament and adds them to the queue. For
+        round robins this is every pairing of participants, once per cycle,
+        scheduled in rounds where each agent plays at most once. For swiss,
+        knockout and adaptive tournaments, it is the next round only.
+        """
+        from app.services import pairings
 
-        logger.info(
-            f"Creating matches for tournament {self.id} {self.name} {self.mode} with {self.pending_matches_count} matches"
+        if self.mode == "SWISS":
+            self._create_matches(
+                [pairings.swiss_round(self)], first_round=self.current_round + 1
+            )
+            return
+
+        if self.mode == "KNOCKOUT":
+            self._create_matches(
+                [pairings.knockout_round(self)],
+                first_round=self.current_round + 1,
+                update_fields=["bracket"],
+            )
+            return
+
+        if self.mode == "ADAPTIVE":
+            self._create_matches(
+                [pairings.adaptive_round(self)], first_round=self.current_round + 1
+            )
+            return
+
+        if self.mode == "TIMED":
+            self._top_up_matches()
+            return
+
+        participant_ids = list(self.participants.values_list("id", flat=True))
+        rounds = pairings.round_robin(
+            participant_ids, self.ROUND_ROBIN_CYCLES[self.mode]
+        )
+
+        if self.queue_order == "SPREAD":
+            rounds = pairings.spread(rounds)
+
+        self._create_matches(rounds)
+
+    def add_participants(self, *agents):
+        """
+        Adds agents to the tournament. If a round robin already has its
+        matches, only the pairings of the new agents are created, once per
+        cycle, after the existing rounds. Swiss tournaments pick new agents
+        up on their next round, and timed ones on their next top up. Knockout
+        brackets can't change once seeded, so they are left as they are.
+        """
+        from app.services import pairings
+
+        existing_ids = list(self.participants.values_list("id", flat=True))
+        new_ids = [
+            agent.id
+            for agent in agents
+            if agent.id not in existing_ids and agent.game_id == self.game_id
+        ]
+
+        if not new_ids:
+            return
+
+        if self.mode == "KNOCKOUT" and self.bracket.get("rounds"):
+            logger.info(
+                f"Knockout tournament {self.id} already started, not adding {new_ids}"
+            )
+            return
+
+        self.participants.add(*new_ids)
+        self.clear_state_annotations()
+
+        if self.mode not in self.ROUND_ROBIN_CYCLES or not self.matches.exists():
+            return
+
+        # Deactivated agents had their matches cancelled and don't get new ones
+        active_ids = list(
+            self.participants.filter(id__in=existing_ids, active=True).values_list(
+                "id", flat=True
+            )
+        )
+        rounds = pairings.new_participant_rounds(
+            active_ids, new_ids, self.ROUND_ROBIN_CYCLES[self.mode]
         )
-        n_rounds = 1
-
-        if self.mode == "DOUBLE_ROUND_ROBIN":
-            n_rounds = 2
-
-        if self.mode == "TRIPLE_ROUND_ROBIN":
-            n_rounds = 3
-
-        participants = list(self.participants.all())
-        new_match_ids = []
-        for _ in range(n_rounds):
-            for bracket in itertools.combinations(participants, 2):
-                bracket = list(bracket)
-                match = Match.objects.create(
-                    player1=bracket[0],
-                    player2=bracket[1],
-                    ran=False,
-                    ran_at=None,
-                    tournament=self,
-                    game=self.game,
-                    season=self.season,
-                )
-                match.participants.add(*bracket)
-                match.save()
-                new_match_ids.append(match.id)
-
-        match_queue.add_many(new_match_ids)
+        self._create_matches(rounds, first_round=self.current_round + 1)
+
+    def forfeit(self, agent):
+        """
+        Records that `agent` forfeits the rest of a knockout tournament, so it
+        loses its current tie and any later one
+        """
+        if not self.bracket.get("rounds"):
+            return
+
+        forfeits = self.bracket.setdefault("forfeits", [])
+        if str(agent.id) not in forfeits:
+            forfeits.append(str(agent.id))
+            self.save(update_fields=["bracket"])
+
+    def _top_up_matches(self):
+        """
+        Tops up the pending matches of a timed tournament to the target depth,
+        with the pairs that were played the least so far.
+        """
+        from app.services import pairings
+
+        n_matches = pairings.timed_target_depth(self) - self.pending_matches_count
+        if n_matches <= 0:
+            return
+
+        participant_ids = sorted(
+            self.participants.filter(active=True).values_list("id", flat=True)
+        )
+        rounds, first_round, self.pair_counts = pairings.timed_pairings(
+            participant_ids, self.pair_counts, n_matches
+        )
+
+        self._create_matches(
+            rounds, first_round=first_round, update_fields=["pair_counts"]
+        )
+
+    def clear_state_annotations(self):
+        """
+        Drops the values from `TournamentQuerySet.with_state`, once they are
+        stale, so the properties go back to querying the database
+        """
+        for name in self.STATE_ANNOTATIONS:
+            self.__dict__.pop(name, None)
+
+    def _create_matches(self, rounds, first_round=1, update_fields=None):
+        """
+        Inserts a match for each (player1_id, player2_id) pairing of each
+        round, together with their participants, using a handful of bulk
+        inserts in a single transaction. Matches are queued in round order,
+        once the transaction commits.
+        `update_fields` are saved on the same transaction, so the pairing
+        state of the tournament never disagrees with its matches.
+        """
+        from app.services import match_queue, ratings, season_summary
+
+        matches = [
+            Match(
+                player1_id=player1_id,
+                player2_id=player2_id,
+                ran=False,
+                ran_at=None,
+                tournament=self,
+                game_id=self.game_id,
+                season_id=self.season_id,
+                round=round,
+            )
+            for round, pairings in enumerate(rounds, start=first_round)
+            for player1_id, player2_id in pairings
+        ]
+
+        MatchParticipant = Match.participants.through
+        match_participants = [
+            MatchParticipant(match_id=match.id, agent_id=agent_id)
+            for match in matches
+            for agent_id in (match.player1_id, match.player2_id)
+        ]
+
+        agent_ids = {
+            agent_id
+            for match in matches
+            for agent_id in (match.player1_id, match.player2_id)
+        }
+
+        with transaction.atomic():
+            if update_fields:
+                self.save(update_fields=update_fields)
+            ratings.provision_ratings(
+                self.season_id, [(agent_id, self.game_id) for agent_id in agent_ids]
+            )
+            Match.objects.bulk_create(matches, batch_size=constants.BULK_BATCH_SIZE)
+            MatchParticipant.objects.bulk_create(
+                match_participants, batch_size=constants.BULK_BATCH_SIZE
+            )
+            season_summary.register_matches_created(self.season_id, len(matches))
+
+        self.clear_state_annotations()
+
+        # Callers may hold a transaction open, e.g. the locked tournament
+        # update, and workers drop queued ids that aren't pending on the db yet
+        transaction.on_commit(lambda: match_queue.add_matches(matches))
 
         logger.info(
-            f"Tournament {self.id} {self.name} {self.mode} has {self.pending_matches_count} matches now"
+            f"Created {len(matches)} matches on {len(rounds)} rounds for tournament {self.id} {self.name} {self.mode}"
         )
 
 
@@ -574,10 +923,43 @@ class Trophy(BaseModel):
         unique_together = [["agent", "tournament"]]
 
 
+class TournamentStanding(BaseModel):
+    tournament = models.ForeignKey(
+        "Tournament", on_delete=models.CASCADE, related_name="standings"
+    )
+    agent = models.ForeignKey(
+        "Agent", on_delete=models.CASCADE, related_name="tournament_standings"
+    )
+
+    score = models.DecimalField(default=0, decimal_places=2, max_digits=10)
+    wins = models.IntegerField(default=0)
+    loses = models.IntegerField(default=0)
+    draws = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ("tournament", "agent")
+        indexes = [
+            models.Index(fields=["agent"]),
+            models.Index(fields=["tournament"]),
+        ]
+
+
 # Non ORM models.  Just stuff to make passing data around easier. Not that this
 # is ephemeral and not persisted on the database.
 class TournamentResult:
-    def __init__(self, *, agent, score, wins, loses, draws):
+    def __init__(
+        self,
+        *,
+        agent,
+        score,
+        wins,
+        loses,
+        draws,
+        place=None,
+        head_to_head=None,
+        sonneborn_berger=None,
+        buchholz=None,
+    ):
         self.agent = agent
         self.name = agent.name
         self.id = agent.id
@@ -586,6 +968,12 @@ class TournamentResult:
         self.loses = loses
         self.draws = draws
 
+        # Only set by `standings.ranked`
+        self.place = place
+        self.head_to_head = head_to_head
+        self.sonneborn_berger = sonneborn_berger
+        self.buchholz = buchholz
+
     @property
     def win_ratio(self):
         return self.wins / self.games_played_count
@@ -600,14 +988,23 @@ class TournamentResult:
 
 
 class SeasonTrophies:
-    def __init__(self, agent, first_places=0, second_places=0, third_places=0):
-        self.agent = agent
-        self.agent_name = agent.name
-        self.agent_id = agent.id
+    def __init__(
+        self,
+        agent_id,
+        agent_name,
+        game_id,
+        first_places=0,
+        second_places=0,
+        third_places=0,
+        elo=None,
+    ):
+        self.agent_id = agent_id
+        self.agent_name = agent_name
+        self.game_id = game_id
         self.first_places = first_places
         self.second_places = second_places
         self.third_places = third_places
-        self.elo = None
+        self.elo = elo
 
     @property
     def trophy_score(self):
@@ -0,0 +1,106 @@
+"""
+Process local cache of the current season, i.e. the newest season that is
+both active and main.
+
+Almost every page and api call needs the current season, and it only changes
+a few times a week. Each process keeps the season in memory, together with
+the version of the season data it was read at. The version is a counter on
+redis, bumped whenever a season is saved or deleted, so resolving the season
+costs a redis round trip instead of a query, and every process picks up a
+change on its next lookup.
+
+Seasons changed with `QuerySet.update` don't go through `Season.save`, so
+whoever does that needs to call `invalidate` too.
+"""
+import logging
+import threading
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+
+logging.config.dictConfig(settings.LOGGING)
+logger = logging.getLogger("SEASON_RESOLVER")
+
+
+_lock = threading.Lock()
+_cached = None
+
+
+class _CachedSeason:
+    def __init__(self, version, season):
+        self.version = version
+        self.season = season
+
+
+def _query():
+    Season = apps.get_model("app", "Season")
+
+    return Season.objects.filter(active=True, main=True).order_by("-created_at").first()
+
+
+def current():
+    """
+    Returns the current season, or None if there is none. Falls back to the
+    database if the cache is disabled or redis is down.
+    """
+    global _cached
+
+    if not settings.CURRENT_SEASON_CACHE_ENABLED:
+        return _query()
+
+    try:
+        version = get_redis_connection("default").get(
+            settings.CURRENT_SEASON_VERSION_KEY
+        )
+    except RedisError:
+        logger.exception("failed to read the current season version")
+        return _query()
+
+    with _lock:
+        cached = _cached
+
+    if cached is not None and cached.version == version:
+        return cached.season
+
+    season = _query()
+
+    with _lock:
+        _cached = _CachedSeason(version, season)
+
+    return season
+
+
+def current_id():
+    season = current()
+    return season.id if season else None
+
+
+def clear():
+    """
+    Drops the cached season of this process
+    """
+    global _cached
+
+    with _lock:
+        _cached = None
+
+
+def _bump_version():
+    try:
+        get_redis_connection("default").incr(settings.CURRENT_SEASON_VERSION_KEY)
+    except RedisError:
+        logger.exception("failed to bump the current season version")
+
+
+def invalidate():
+    """
+    Makes every process resolve the current season again. The version is only
+    bumped once the transaction commits, otherwise other processes could read
+    and cache the old season under the new version.
+    """
+    clear()
+    transaction.on_commit(_bump_version)
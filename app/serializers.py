@@ -7,9 +7,10 @@ from django.db import transaction
 from django.utils import timezone
 from rest_framework import exceptions, serializers
 
-from app import metrics, models
+from app import metrics, models, season_resolver
 
-from .services.ratings import update_ratings_from_match
+from .services import lifecycle, match_counters, match_queue, season_summary, standings
+from .services.ratings import provision_ratings, update_ratings_from_match
 
 
 logging.config.dictConfig(settings.LOGGING)
@@ -79,6 +80,7 @@ class AgentSerializer(serializers.ModelSerializer):
             "file",
             "file_hash",
             "owner",
+            "active",
             "games_played_count",
             "created_at",
             "updated_at",
@@ -128,10 +130,27 @@ class MatchSerializer(serializers.ModelSerializer):
                 f"Only matches with 2 participants are supported at this point. received {len(participants)}"
             )
 
-        instance = super(MatchSerializer, self).create(validated_data)
+        with transaction.atomic():
+            instance = super(MatchSerializer, self).create(validated_data)
 
-        update_ratings_from_match(instance)
-        instance.save()
+            provision_ratings(
+                instance.season_id,
+                [
+                    (instance.player1_id, instance.game_id),
+                    (instance.player2_id, instance.game_id),
+                ],
+            )
+            update_ratings_from_match(instance)
+            instance.save()
+
+            if instance.ran:
+                standings.register_match(instance)
+
+            season_summary.register_match_created(instance)
+
+        if instance.ran:
+            match_counters.register_match(instance)
+            lifecycle.match_ingested(instance)
 
         return instance
 
@@ -152,6 +171,12 @@ class MatchSerializer(serializers.ModelSerializer):
             with transaction.atomic():
                 update_ratings_from_match(instance)
                 instance.save()
+                standings.register_match(instance)
+                season_summary.register_match_played(instance)
+
+            match_counters.register_match(instance)
+            match_queue.remove_from_index(instance)
+            lifecycle.match_ingested(instance)
 
             metrics.register_match_played(instance.game.name)
             metrics.register_match_duration(instance)
@@ -165,6 +190,7 @@ class MatchSerializer(serializers.ModelSerializer):
 
 class TournamentSerializer(serializers.ModelSerializer):
     start_date = serializers.DateTimeField(required=False)
+    bracket = serializers.JSONField(read_only=True)
     end_date = serializers.DateTimeField(required=False)
     participants = serializers.PrimaryKeyRelatedField(
         queryset=models.Agent.objects.all(), many=True, required=False
@@ -187,6 +213,10 @@ class TournamentSerializer(serializers.ModelSerializer):
             "participants",
             "start_date",
             "end_date",
+            "rounds",
+            "queue_order",
+            "best_of",
+            "bracket",
             "done",
             "created_at",
             "updated_at",
@@ -221,8 +251,10 @@ class TournamentSerializer(serializers.ModelSerializer):
             )
 
         if not data.get("season_id"):
-            season = models.Season.objects.get(active=True, main=True)
-            data["season_id"] = str(season.id)
+            season_id = season_resolver.current_id()
+            if season_id is None:
+                raise exceptions.ValidationError("There is no active season")
+            data["season_id"] = str(season_id)
 
         return data
 
@@ -230,8 +262,10 @@ class TournamentSerializer(serializers.ModelSerializer):
         participants = validated_data.pop("participants")
 
         tournament = models.Tournament.objects.create(**validated_data)
+        season_summary.register_tournament_created(tournament)
         tournament.participants.add(*participants)
         tournament.save()
         tournament.create_matches()
+        lifecycle.schedule_tournament_transitions(tournament)
 
         return tournament
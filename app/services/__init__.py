@@ -1,13 +1,15 @@
 import logging
 from datetime import datetime
+from time import time
 
 import humanize
 from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 from django_redis import get_redis_connection
 
-from app import constants, models, tasks
-from app.services.ratings import update_ratings_from_match
+from app import constants, metrics, models, season_resolver, tasks
+from app.services import season_summary
 from app.services.trophy import create_trophies
 
 
@@ -20,8 +22,7 @@ def purge_all_agents():
 
 
 def purge_all_played_games():
-    for agent in models.Agent.objects.all():
-        agent.current_ratings.delete()
+    models.AgentRatings.objects.filter(season_id=season_resolver.current_id()).delete()
 
     models.Match.objects.all().delete()
 
@@ -31,24 +32,85 @@ def purge_all_tournaments():
     models.Match.objects.all().delete()
 
 
+def join_open_tournaments(agent):
+    """
+    Adds a newly created agent to the open automated tournaments of its game.
+    These are the ones that default to all agents as participants.
+    """
+    tournaments = models.Tournament.objects.filter(
+        game_id=agent.game_id, done=False, is_automated=True
+    )
+
+    for tournament in tournaments:
+        tournament.add_participants(agent)
+        logger.info(f"{agent.id} joined tournament {tournament.id} {tournament.name}")
+
+
 def update_tournaments_state():
-    for tournament in models.Tournament.objects.all():
-        update_tournament_state(tournament)
+    update_open_tournaments()
 
     tasks.regenerate_queue.delay()
 
 
+def update_open_tournaments():
+    """
+    Updates the state of every tournament that can change, finding them with
+    a single annotated query instead of checking each tournament. Each one is
+    then updated under its row lock, like the scheduled updates are.
+    """
+    t_start = time()
+
+    tournament_ids = list(
+        models.Tournament.objects.needing_update().values_list("id", flat=True)
+    )
+    n_tournaments = 0
+    for tournament_id in tournament_ids:
+        n_tournaments += update_tournament_state_locked(tournament_id)
+
+    metrics.register_tournaments_update(time() - t_start, n_tournaments)
+
+
+def update_tournament_state_locked(tournament_id):
+    """
+    Updates a single tournament, if its state can change, holding a lock on
+    its row. Every update goes through here, so the periodic updates, the
+    scheduled ones and the ones triggered by ingestion can't create the same
+    round twice. Tournaments locked by another update are skipped, since that
+    one is already doing the work. Returns whether the tournament was updated.
+    """
+    with transaction.atomic():
+        tournament = (
+            models.Tournament.objects.needing_update()
+            .select_for_update(of=("self",), skip_locked=True)
+            .filter(id=tournament_id)
+            .first()
+        )
+        if tournament is None:
+            return False
+
+        update_tournament_state(tournament)
+
+    return True
+
+
 def update_tournament_state(tournament):
-    if (
-        tournament.mode == "TIMED"
-        and tournament.is_active
-        and tournament.pending_matches_count <= 10
+    if tournament.mode == "TIMED" and tournament.start_date > timezone.now():
+        # It gets picked up by its scheduled start
+        return
+
+    if tournament.mode == "TIMED" and tournament.is_active:
+        # Tops up the pending matches to what the workers can play soon
+        tournament.create_matches()
+    elif (
+        tournament.mode in models.Tournament.ROUND_MODES
+        and not tournament.has_pending_matches
+        and tournament.current_round < tournament.total_rounds
     ):
         logger.info(
-            f"TIMED Tournament {tournament.id} has a low number of matches left: {tournament.pending_matches_count}"
+            f"{tournament.mode} Tournament {tournament.id} finished round {tournament.current_round}. Creating the next one"
         )
         tournament.create_matches()
-    elif tournament.matches.count() == 0:
+    elif tournament.matches_count == 0:
         logger.info(
             f"{tournament.mode} Tournament {tournament.id} is missing matches. Creating"
         )
@@ -68,39 +130,27 @@ def update_tournament_state(tournament):
         pending matches to be played.  These matches were created before the
         tournament was marked as done.
         """
-        create_trophies(tournament)
+        try:
+            create_trophies(tournament)
+        except ValueError:
+            logger.exception(f"failed to create trophies for {tournament.id}")
 
+        tournament.finalized_at = timezone.now()
+        tournament.save(update_fields=["finalized_at"])
 
-def recalculate_ratings_for_season(season):
-    updated_count = 0
-    matches_to_update = season.matches.filter(ran=True).count()
-    ratings_to_update = season.ratings.count()
-
-    logger = logging.getLogger("RECALCULATE_RATINGS")
-    logger.info(f"Recalculating ratings for '{season.name}' '{season.id}'")
-    logger.info(f"{ratings_to_update=} {matches_to_update=}")
-
-    for rating in models.AgentRatings.objects.filter(season=season):
-        rating.reset()
-        rating.save()
+        season_summary.refresh_rankings(tournament.season)
 
-    logger.info("Finished resetting ratings")
 
-    for match in season.matches.filter(ran=True).order_by("ran_at"):
-        update_ratings_from_match(match)
-        match.save()
-        updated_count += 1
+def recalculate_ratings_for_season(season):
+    """
+    Resets the ratings of `season` and replays its results, as a bulk job.
+    Returns the job id.
+    """
+    from app.services import bulk_jobs
 
-        if (
-            updated_count == 1
-            or updated_count % 100 == 0
-            or updated_count == matches_to_update
-        ):
-            logger.info(
-                f"updated {updated_count:6d} out of {matches_to_update}  ::  {updated_count / matches_to_update * 100.0:5.2f}%"
-            )
+    logger.info(f"Recalculating ratings for '{season.name}' '{season.id}'")
 
-    logger.info(f"Finished recalculating rankings for season '{season.name}'")
+    return bulk_jobs.start("recalculate_ratings", {"season_id": str(season.id)})
 
 
 def metrics_api_handler(payload):
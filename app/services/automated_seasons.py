@@ -2,9 +2,11 @@ import logging
 from datetime import timedelta
 
 from django.conf import settings
+from django.db.models import Q
 from django.utils import timezone
 
 from app import models, serializers
+from app.services import lifecycle, ratings
 
 
 logging.config.dictConfig(settings.LOGGING)
@@ -12,7 +14,17 @@ logger = logging.getLogger("SERVICES")
 
 
 def update_seasons_state():
-    for season in models.Season.objects.all():
+    """
+    Updates the seasons that are due a transition. Transitions are scheduled
+    for when they are due, this only catches the ones that got lost.
+    """
+    now = timezone.now()
+    seasons = models.Season.objects.filter(
+        Q(active=True, end_date__lt=now)
+        | Q(active=False, start_date__lt=now, end_date__gt=now)
+    )
+
+    for season in seasons:
         update_season_state(season)
 
 
@@ -66,10 +78,10 @@ def create_automated_seasons():
         serializer.save()
 
         create_ratings_for_season(serializer.instance)
+        lifecycle.schedule_season_transitions(serializer.instance)
     else:
         logger.warning(f'failed to create season "{name}"')
 
 
 def create_ratings_for_season(season):
-    for agent in models.Agent.objects.active().all():
-        models.AgentRatings.objects.create(season=season, agent=agent, game=agent.game)
+    ratings.provision_season(season)
@@ -0,0 +1,322 @@
+"""
+Long running jobs over many rows, like regenerating every trophy or
+recalculating the ratings of a season.
+
+A job goes over its queryset with keyset pagination, one chunk per celery
+task, and only queues the next chunk once the current one is done, so it
+never floods the broker. Each chunk is processed in a single transaction.
+Progress is stored on redis after every chunk, so a job that died can be
+resumed from the last finished chunk, and running jobs can be followed on the
+debug page.
+"""
+import json
+import logging
+import uuid
+from datetime import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from app import constants, models, tasks
+from app.services import leaderboard, season_archive, season_summary
+
+
+logging.config.dictConfig(settings.LOGGING)
+logger = logging.getLogger("BULK_JOBS")
+
+
+DEFAULT_CHUNK_SIZE = 100
+
+# Finished jobs are kept around for a while, so they show up on the debug page
+FINISHED_JOB_TTL = constants.ONE_DAY * 7
+
+# Running jobs that haven't finished a chunk in this long are probably dead
+STALLED_AFTER = constants.TEN_MINUTES
+
+
+class BulkJob:
+    """
+    Base class for the jobs. `key` are the fields the queryset is iterated
+    by, and must be unique together. Chunks must be safe to process again,
+    since a chunk that died halfway is redone on resume.
+    """
+
+    key = ("id",)
+
+    def queryset(self, params):
+        raise NotImplementedError
+
+    def setup(self, params):
+        pass
+
+    def process(self, items, params):
+        raise NotImplementedError
+
+    def finish(self, params):
+        pass
+
+
+class RegenTrophiesJob(BulkJob):
+    def queryset(self, params):
+        return models.Tournament.objects.filter(done=True)
+
+    def process(self, items, params):
+        from app.services.trophy import create_trophies
+
+        for tournament in items:
+            try:
+                create_trophies(tournament)
+            except ValueError as e:
+                logger.warning(f"skipping trophies for {tournament.id}: {e}")
+
+    def finish(self, params):
+        for season in models.Season.objects.all():
+            season_summary.refresh_rankings(season)
+            if season.archived_at:
+                season_archive.invalidate(season)
+
+
+class BackfillTrophiesJob(RegenTrophiesJob):
+    def queryset(self, params):
+        return models.Tournament.objects.filter(done=True).exclude(
+            Exists(models.Trophy.objects.filter(tournament=OuterRef("pk")))
+        )
+
+
+class RecalculateRatingsJob(BulkJob):
+    """
+    Replays the results of a season in the order they were played. Unlike
+    the trophy jobs, redoing a chunk counts its matches twice. Chunks are
+    committed right before their cursor is saved, so this only happens if
+    the worker dies in between. If in doubt, start the job again instead of
+    resuming it.
+
+    Results ingested while the job runs would be counted on top of the
+    replay, so it refuses to start on seasons that can still get results,
+    i.e. active ones or ones with pending matches.
+
+    Matches without `ran_at`, from before it was recorded, are replayed by
+    their creation date.
+    """
+
+    key = ("replayed_at", "id")
+
+    def queryset(self, params):
+        return models.Match.objects.filter(
+            season_id=params["season_id"], ran=True
+        ).annotate(replayed_at=Coalesce("ran_at", "created_at"))
+
+    def setup(self, params):
+        season = models.Season.objects.get(id=params["season_id"])
+        if season.active or season.matches.filter(ran=False).exists():
+            raise ValueError(
+                f"Season {season.id} can still get results, can't recalculate its ratings"
+            )
+
+        season_archive.invalidate(season)
+        models.AgentRatings.objects.filter(season_id=params["season_id"]).update(
+            wins=0, loses=0, draws=0, score=0, elo=1500
+        )
+
+    def process(self, items, params):
+        from app.services.ratings import update_ratings_from_match
+
+        for match in items:
+            update_ratings_from_match(match)
+            match.save()
+
+    def finish(self, params):
+        season = models.Season.objects.get(id=params["season_id"])
+        leaderboard.rebuild_season(season)
+        season_summary.refresh_rankings(season)
+
+        # The season may have been archived again halfway through the replay
+        season_archive.invalidate(season)
+
+
+JOBS = {
+    "regen_trophies": RegenTrophiesJob(),
+    "backfill_trophies": BackfillTrophiesJob(),
+    "recalculate_ratings": RecalculateRatingsJob(),
+}
+
+
+def _job_key(job_id):
+    return f"{settings.BULK_JOB_KEY}:{job_id}"
+
+
+def _index_key():
+    return f"{settings.BULK_JOB_KEY}:jobs"
+
+
+def _save(redis, job_id, **fields):
+    fields["updated_at"] = timezone.now().isoformat()
+    redis.hset(_job_key(job_id), mapping=fields)
+
+
+def start(job_type, params=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Starts a job of `job_type` and returns its id
+    """
+    job = JOBS[job_type]
+    params = params or {}
+    job_id = uuid.uuid4().hex
+
+    job.setup(params)
+    total = job.queryset(params).count()
+
+    redis = get_redis_connection("default")
+    _save(
+        redis,
+        job_id,
+        type=job_type,
+        params=json.dumps(params),
+        chunk_size=chunk_size,
+        status="running",
+        cursor="",
+        processed=0,
+        total=total,
+        started_at=timezone.now().isoformat(),
+    )
+    redis.zadd(_index_key(), {job_id: timezone.now().timestamp()})
+
+    logger.info(f"starting {job_type} job {job_id} over {total} items")
+    tasks.run_bulk_job.delay(job_id)
+
+    return job_id
+
+
+def resume(job_id):
+    """
+    Continues a job from the last chunk it finished
+    """
+    redis = get_redis_connection("default")
+    _save(redis, job_id, status="running")
+
+    logger.info(f"resuming job {job_id}")
+    tasks.run_bulk_job.delay(job_id)
+
+
+def _keyset_filter(key, cursor):
+    """
+    Rows strictly after `cursor` when ordered by the `key` fields, e.g. for
+    (a, b): a > a0, or a = a0 and b > b0
+    """
+    condition = None
+    for index, field in enumerate(key):
+        equal = {previous: cursor[i] for i, previous in enumerate(key[:index])}
+        term = Q(**equal, **{f"{field}__gt": cursor[index]})
+        condition = term if condition is None else condition | term
+
+    return condition
+
+
+def _cursor_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+
+    return str(value)
+
+
+def run_chunk(job_id):
+    """
+    Processes the next chunk of a job. Returns whether there is more to do.
+    """
+    redis = get_redis_connection("default")
+    state = progress(job_id)
+
+    if state is None or state["status"] != "running":
+        return False
+
+    job = JOBS[state["type"]]
+    params = state["params"]
+
+    queryset = job.queryset(params).order_by(*job.key)
+    if state["cursor"]:
+        queryset = queryset.filter(_keyset_filter(job.key, state["cursor"]))
+
+    chunk_size = state["chunk_size"]
+    items = list(queryset[:chunk_size])
+
+    if not items:
+        job.finish(params)
+        _save(redis, job_id, status="done")
+        redis.expire(_job_key(job_id), FINISHED_JOB_TTL)
+        logger.info(f"{state['type']} job {job_id} is done")
+        return False
+
+    with transaction.atomic():
+        job.process(items, params)
+
+    last = items[-1]
+    cursor = [_cursor_value(getattr(last, field)) for field in job.key]
+    _save(
+        redis,
+        job_id,
+        cursor=json.dumps(cursor),
+        processed=state["processed"] + len(items),
+    )
+
+    return True
+
+
+def progress(job_id):
+    """
+    Returns the state of a job, with its progress and ETA, or None if it
+    doesn't exist
+    """
+    redis = get_redis_connection("default")
+    raw = redis.hgetall(_job_key(job_id))
+
+    if not raw:
+        return None
+
+    state = {key.decode(): value.decode() for key, value in raw.items()}
+    state["id"] = job_id
+    state["params"] = json.loads(state["params"])
+    state["cursor"] = json.loads(state["cursor"]) if state["cursor"] else None
+    state["chunk_size"] = int(state["chunk_size"])
+    state["processed"] = int(state["processed"])
+    state["total"] = int(state["total"])
+    state["started_at"] = datetime.fromisoformat(state["started_at"])
+    state["updated_at"] = datetime.fromisoformat(state["updated_at"])
+
+    state["percent"] = (
+        state["processed"] / state["total"] * 100.0 if state["total"] else 100.0
+    )
+
+    state["eta"] = None
+    remaining = state["total"] - state["processed"]
+    if state["status"] == "running" and state["processed"] and remaining > 0:
+        elapsed = state["updated_at"] - state["started_at"]
+        state["eta"] = state["updated_at"] + elapsed / state["processed"] * remaining
+
+    state["stalled"] = (
+        state["status"] == "running"
+        and (timezone.now() - state["updated_at"]).total_seconds() > STALLED_AFTER
+    )
+
+    return state
+
+
+def all_jobs():
+    """
+    Returns the state of every known job, most recent first
+    """
+    redis = get_redis_connection("default")
+
+    jobs = []
+    for job_id in redis.zrevrange(_index_key(), 0, -1):
+        state = progress(job_id.decode())
+        if state is None:
+            # Finished jobs expire on their own
+            redis.zrem(_index_key(), job_id)
+            continue
+
+        jobs.append(state)
+
+    return jobs
@@ -0,0 +1,325 @@
+"""
+Per game leaderboards, materialized on redis. Each (season, game) pair has a
+sorted set with the elo of its agents, and each agent has a small hash with
+its stats for the season. Both are updated whenever a rating changes, so
+rendering a leaderboard or looking up a rank doesn't hit the database.
+
+If a leaderboard is missing from redis, e.g. it expired or redis was flushed,
+it is rebuilt from the database on the next read. The same happens when a
+member of the sorted set has lost its stats, since the stats of an agent that
+stopped playing can expire while the sorted set is kept alive by the others.
+"""
+import logging
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from app import constants, models, season_resolver
+
+
+logging.config.dictConfig(settings.LOGGING)
+logger = logging.getLogger("LEADERBOARD")
+
+
+# Leaderboards from old seasons stop being updated, so they are allowed to
+# expire. They get rebuilt if anyone looks at them again.
+LEADERBOARD_TTL = constants.ONE_DAY * 7
+
+RATING_FIELDS = ("elo", "wins", "loses", "draws", "score")
+
+
+def _leaderboard_key(season_id, game_id):
+    return f"{settings.LEADERBOARD_KEY}:{season_id}:{game_id}"
+
+
+def _stats_key(season_id, agent_id):
+    return f"{settings.LEADERBOARD_KEY}:{season_id}:agent:{agent_id}"
+
+
+def _agent_fields(agent, owner_username):
+    return {
+        "name": agent.name,
+        "owner_id": agent.owner_id,
+        "owner_username": owner_username,
+        "active": int(agent.active),
+    }
+
+
+def _rating_fields(rating):
+    return {field: str(getattr(rating, field)) for field in RATING_FIELDS}
+
+
+def _write(pipeline, rating, agent_fields=None):
+    leaderboard_key = _leaderboard_key(rating.season_id, rating.game_id)
+    stats_key = _stats_key(rating.season_id, rating.agent_id)
+
+    pipeline.zadd(leaderboard_key, {str(rating.agent_id): float(rating.elo)})
+    pipeline.hset(stats_key, mapping=_rating_fields(rating))
+    if agent_fields:
+        pipeline.hset(stats_key, mapping=agent_fields)
+
+    pipeline.expire(leaderboard_key, LEADERBOARD_TTL)
+    pipeline.expire(stats_key, LEADERBOARD_TTL)
+
+
+def update_ratings(*ratings):
+    """
+    Updates the leaderboard with the new values from `ratings`, once the
+    current transaction commits, so a rating change that gets rolled back
+    never reaches it. The agent name and owner are only written the first
+    time the agent shows up. Never raises, since a rating change must not
+    fail because of redis.
+    """
+    transaction.on_commit(lambda: _update_ratings(ratings))
+
+
+def add_agents(season_id, agent_ids):
+    """
+    Adds the ratings of `agent_ids` on `season_id`, once the current
+    transaction commits. Used when ratings are provisioned, so agents show
+    up before they play their first match.
+    """
+    transaction.on_commit(
+        lambda: _update_ratings(
+            models.AgentRatings.objects.filter(
+                season_id=season_id, agent_id__in=agent_ids
+            ).select_related("agent__owner")
+        )
+    )
+
+
+def _update_ratings(ratings):
+    try:
+        _write_ratings(list(ratings))
+    except RedisError:
+        logger.exception("failed to update the leaderboard")
+
+
+def _write_ratings(ratings):
+    """
+    Leaderboards missing from redis are left alone, since writing to them
+    would leave a partial leaderboard that doesn't get rebuilt on read
+    """
+    redis = get_redis_connection("default")
+
+    pipeline = redis.pipeline()
+    for rating in ratings:
+        pipeline.exists(_leaderboard_key(rating.season_id, rating.game_id))
+        pipeline.hexists(_stats_key(rating.season_id, rating.agent_id), "name")
+    results = pipeline.execute()
+
+    pipeline = redis.pipeline()
+    for rating, exists, has_fields in zip(ratings, results[::2], results[1::2]):
+        if not exists:
+            continue
+
+        agent_fields = None
+        if not has_fields:
+            agent = rating.agent
+            agent_fields = _agent_fields(agent, agent.owner.username)
+
+        _write(pipeline, rating, agent_fields)
+    pipeline.execute()
+
+
+def update_agent(agent):
+    """
+    Refreshes the name, owner and active flag of `agent` on the current
+    season leaderboard. Should be called whenever an agent is edited.
+    """
+    rating = (
+        models.AgentRatings.objects.filter(
+            agent=agent, season_id=season_resolver.current_id()
+        )
+        .select_related("agent__owner")
+        .first()
+    )
+
+    if rating is None:
+        return
+
+    redis = get_redis_connection("default")
+    pipeline = redis.pipeline()
+    _write(pipeline, rating, _agent_fields(agent, rating.agent.owner.username))
+    pipeline.execute()
+
+
+def rebuild(season, game):
+    """
+    Rebuilds the leaderboard of `game` in `season` from the database
+    """
+    ratings = models.AgentRatings.objects.filter(
+        season=season, game=game
+    ).select_related("agent__owner")
+
+    redis = get_redis_connection("default")
+    pipeline = redis.pipeline()
+    pipeline.delete(_leaderboard_key(season.id, game.id))
+
+    count = 0
+    for rating in ratings:
+        _write(
+            pipeline, rating, _agent_fields(rating.agent, rating.agent.owner.username)
+        )
+        count += 1
+
+    pipeline.execute()
+
+    logger.info(f"rebuilt leaderboard for {season.id} {game.id} with {count} agents")
+
+
+def rebuild_season(season):
+    for game in models.Game.objects.filter(agentratings__season=season).distinct():
+        rebuild(season, game)
+
+
+def _ensure_leaderboard(redis, season, game):
+    if not redis.exists(_leaderboard_key(season.id, game.id)):
+        rebuild(season, game)
+
+
+def _fetch_stats(redis, season, agent_ids):
+    pipeline = redis.pipeline()
+    for agent_id in agent_ids:
+        pipeline.hgetall(_stats_key(season.id, agent_id))
+
+    return pipeline.execute()
+
+
+def _entries(redis, season, game, agent_ids, ranks):
+    all_stats = _fetch_stats(redis, season, agent_ids)
+
+    if not all(all_stats):
+        rebuild(season, game)
+        all_stats = _fetch_stats(redis, season, agent_ids)
+
+    return [
+        LeaderboardEntry(agent_id, rank, stats)
+        for agent_id, rank, stats in zip(agent_ids, ranks, all_stats)
+        if stats
+    ]
+
+
+def top(game, season=None, limit=None, active_only=True):
+    """
+    Returns the leaderboard of `game` in `season`, ordered by elo. Defaults to
+    the current season. The limit applies after inactive agents are dropped.
+    """
+    season = season or season_resolver.current()
+    if season is None:
+        return []
+
+    redis = get_redis_connection("default")
+    _ensure_leaderboard(redis, season, game)
+
+    # Which agents are active is only known from their stats, so the inactive
+    # ones can't be skipped on the sorted set itself
+    end = -1 if limit is None or active_only else limit - 1
+    agent_ids = [
+        agent_id.decode()
+        for agent_id in redis.zrevrange(_leaderboard_key(season.id, game.id), 0, end)
+    ]
+
+    entries = _entries(redis, season, game, agent_ids, range(1, len(agent_ids) + 1))
+
+    if active_only:
+        entries = [entry for entry in entries if entry.active]
+
+    return entries[:limit]
+
+
+def entries_for_agents(game, agent_ids, season=None):
+    """
+    Returns the leaderboard entries of the given agents, ordered by elo, with
+    their rank on the full leaderboard.
+    """
+    season = season or season_resolver.current()
+    if season is None:
+        return []
+
+    agent_ids = [str(agent_id) for agent_id in agent_ids]
+
+    redis = get_redis_connection("default")
+    _ensure_leaderboard(redis, season, game)
+
+    pipeline = redis.pipeline()
+    for agent_id in agent_ids:
+        pipeline.zrevrank(_leaderboard_key(season.id, game.id), agent_id)
+    ranks = [None if rank is None else rank + 1 for rank in pipeline.execute()]
+
+    entries = _entries(redis, season, game, agent_ids, ranks)
+
+    return sorted(entries, key=lambda entry: entry.elo, reverse=True)
+
+
+def rank(agent, season=None):
+    """
+    Returns the 1-based rank of `agent` on its game leaderboard, or None if it
+    isn't ranked. O(log n) on the size of the leaderboard.
+    """
+    season = season or season_resolver.current()
+    if season is None:
+        return None
+
+    redis = get_redis_connection("default")
+    _ensure_leaderboard(redis, season, agent.game)
+
+    rank = redis.zrevrank(_leaderboard_key(season.id, agent.game_id), str(agent.id))
+
+    if rank is None:
+        return None
+
+    return rank + 1
+
+
+class LeaderboardEntry:
+    """
+    Mirrors the subset of `Agent` that the leaderboard tables use
+    """
+
+    def __init__(self, agent_id, rank, stats):
+        stats = {key.decode(): value.decode() for key, value in stats.items()}
+
+        self.id = agent_id
+        self.rank = rank
+        self.name = stats.get("name", "")
+        self.owner_id = stats.get("owner_id")
+        self.owner_username = stats.get("owner_username", "")
+        self.active = stats.get("active", "1") == "1"
+        self.elo = Decimal(stats.get("elo", "1500"))
+        self.score = Decimal(stats.get("score", "0"))
+        self.wins = int(stats.get("wins", 0))
+        self.loses = int(stats.get("loses", 0))
+        self.draws = int(stats.get("draws", 0))
+
+    @property
+    def games_played_count(self):
+        return self.wins + self.loses + self.draws
+
+    @property
+    def win_ratio(self):
+        if self.games_played_count == 0:
+            return 0
+        return self.wins / self.games_played_count
+
+    @property
+    def pretty_win_ratio(self):
+        return f"{self.win_ratio * 100.0:.2f}"
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "rank": self.rank,
+            "name": self.name,
+            "owner_id": self.owner_id,
+            "owner_username": self.owner_username,
+            "elo": self.elo,
+            "score": self.score,
+            "wins": self.wins,
+            "loses": self.loses,
+            "draws": self.draws,
+            "games_played_count": self.games_played_count,
+        }
@@ -0,0 +1,127 @@
+"""
+Season and tournament transitions, scheduled for when they are due instead of
+waiting for the next `automated_manager` tick to notice them.
+
+Seasons get a task at their start and end dates, and timed tournaments at
+theirs. Tournaments also get updated as soon as their last pending match is
+ingested, which hands out trophies or creates the next round right away.
+`automated_manager` still goes over everything, but only as a safety net for
+tasks that got lost.
+
+Tasks with an ETA sit unacked on the redis broker until they are due, and get
+redelivered whenever that takes longer than the broker visibility timeout, so
+only transitions due within `SCHEDULE_HORIZON` are scheduled right away. The
+others are scheduled by `automated_manager` once they get close enough.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from app import models, tasks
+
+
+logging.config.dictConfig(settings.LOGGING)
+logger = logging.getLogger("LIFECYCLE")
+
+
+# Season and tournament windows include their end date, so the transition is
+# scheduled slightly after it
+END_DATE_MARGIN = timedelta(seconds=1)
+
+# Must be well below the visibility timeout of the broker
+SCHEDULE_HORIZON = timedelta(minutes=30)
+
+
+def _apply_async(task, object_id, eta):
+    # automated_manager finds the same transitions on every tick while they
+    # are within the horizon, so each one is only sent once
+    key = f"{settings.LIFECYCLE_SCHEDULE_KEY}:{task.name}:{object_id}:{eta.timestamp()}"
+    if not cache.add(key, True, 2 * SCHEDULE_HORIZON.total_seconds()):
+        return
+
+    task.apply_async((str(object_id),), eta=eta)
+    logger.info(f"scheduled {task.name} for {object_id} at {eta}")
+
+
+def _schedule(task, object_id, dates):
+    now = timezone.now()
+
+    for eta in dates:
+        if eta is None or eta <= now or eta > now + SCHEDULE_HORIZON:
+            continue
+
+        transaction.on_commit(lambda eta=eta: _apply_async(task, object_id, eta))
+
+
+def schedule_season_transitions(season):
+    """
+    Schedules the activation and deactivation of `season`. Should be called
+    whenever a season is created or its dates change. Transitions that are
+    no longer due when their task runs do nothing, and the ones that are too
+    far ahead are left to `schedule_due_transitions`.
+    """
+    end_date = season.end_date and season.end_date + END_DATE_MARGIN
+    _schedule(tasks.update_season_state, season.id, [season.start_date, end_date])
+
+
+def schedule_tournament_transitions(tournament):
+    """
+    Schedules the start and end of a timed tournament. Other modes only
+    change state as their matches get played.
+    """
+    if tournament.mode != "TIMED":
+        return
+
+    end_date = tournament.end_date and tournament.end_date + END_DATE_MARGIN
+    _schedule(
+        tasks.update_tournament_state,
+        tournament.id,
+        [tournament.start_date, end_date],
+    )
+
+
+def _due_soon(start_field, end_field):
+    now = timezone.now()
+    horizon = now + SCHEDULE_HORIZON
+
+    return Q(**{f"{start_field}__gt": now, f"{start_field}__lte": horizon}) | Q(
+        **{
+            f"{end_field}__gt": now - END_DATE_MARGIN,
+            f"{end_field}__lte": horizon - END_DATE_MARGIN,
+        }
+    )
+
+
+def schedule_due_transitions():
+    """
+    Schedules the transitions of seasons and timed tournaments that are now
+    within the horizon. Called by `automated_manager` on every tick.
+    """
+    for season in models.Season.objects.filter(_due_soon("start_date", "end_date")):
+        schedule_season_transitions(season)
+
+    tournaments = models.Tournament.objects.filter(mode="TIMED", done=False).filter(
+        _due_soon("start_date", "end_date")
+    )
+    for tournament in tournaments:
+        schedule_tournament_transitions(tournament)
+
+
+def match_ingested(match):
+    """
+    Updates the tournament of `match` once its last pending match is in
+    """
+    if models.Match.objects.filter(
+        tournament_id=match.tournament_id, ran=False
+    ).exists():
+        return
+
+    logger.info(f"tournament {match.tournament_id} has no pending matches left")
+    transaction.on_commit(
+        lambda: tasks.update_tournament_state.delay(str(match.tournament_id))
+    )
@@ -0,0 +1,171 @@
+"""
+Per minute match counters, stored on redis. Every ingested result increments
+the counter for its minute, both for its game and for all games. Sliding
+window totals and the matches per minute series are then read from the
+counters, instead of scanning the match table.
+
+The counters expire after `RETENTION` seconds. If redis loses data, or the
+counters drift for some other reason, `reconcile` rebuilds them from the
+database.
+"""
+import logging
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Count
+from django.db.models.functions import TruncMinute
+from django.utils import timezone
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError, WatchError
+
+from app import constants, models
+
+
+logging.config.dictConfig(settings.LOGGING)
+logger = logging.getLogger("MATCH_COUNTERS")
+
+
+RETENTION = constants.ONE_DAY + constants.ONE_HOUR
+ALL_GAMES = "all"
+
+# Reconciling starts over when results come in halfway through
+RECONCILE_ATTEMPTS = 5
+
+
+def _minute(date):
+    return int(date.timestamp()) // 60
+
+
+def _key(minute, game_id=None):
+    return f"{settings.MATCH_COUNTER_KEY}:{game_id or ALL_GAMES}:{minute}"
+
+
+def _minutes_between(start_date, end_date):
+    return range(_minute(start_date), _minute(end_date) + 1)
+
+
+def register_match(match):
+    """
+    Counts a match that just had its result ingested. Never raises, a missing
+    increment gets fixed by the next `reconcile`.
+    """
+    minute = _minute(match.ran_at or timezone.now())
+
+    try:
+        redis = get_redis_connection("default")
+        pipeline = redis.pipeline()
+        for key in (_key(minute), _key(minute, match.game_id)):
+            pipeline.incr(key)
+            pipeline.expire(key, RETENTION)
+        pipeline.execute()
+    except RedisError:
+        logger.exception(f"failed to register match {match.id} on the counters")
+
+
+def count_since(start_date, game_id=None):
+    """
+    Number of matches played from `start_date` until now, with minute
+    resolution: the minute that contains `start_date` is counted in full,
+    and the current minute up to now. The window is then up to a minute
+    longer than asked for, but never shorter. Costs one redis round trip,
+    with one key per minute.
+    """
+    if (timezone.now() - start_date).total_seconds() > RETENTION:
+        raise ValueError(f"{start_date} is older than the counters retention")
+
+    _, counts = series(start_date, timezone.now(), game_id=game_id)
+    return sum(counts)
+
+
+def count_last(seconds, game_id=None):
+    return count_since(timezone.now() - timedelta(seconds=seconds), game_id=game_id)
+
+
+def series(start_date, end_date, game_id=None):
+    """
+    Returns a dense matches per minute series between `start_date` and
+    `end_date`.
+    """
+    minutes = _minutes_between(start_date, end_date)
+    if not minutes:
+        return [], []
+
+    redis = get_redis_connection("default")
+    values = redis.mget([_key(minute, game_id) for minute in minutes])
+
+    x = [datetime.fromtimestamp(minute * 60, tz=dt_timezone.utc) for minute in minutes]
+    y = [int(value) if value else 0 for value in values]
+
+    return x, y
+
+
+def _counters_from_db(start_date):
+    data = (
+        models.Match.objects.filter(ran=True, ran_at__gte=start_date)
+        .annotate(minute=TruncMinute("ran_at"))
+        .values("minute", "game_id")
+        .annotate(count=Count("id"))
+        .values_list("minute", "game_id", "count")
+    )
+
+    counters = {}
+    for date, game_id, count in data:
+        minute = _minute(date)
+        counters[_key(minute, game_id)] = count
+        counters[_key(minute)] = counters.get(_key(minute), 0) + count
+
+    return counters
+
+
+def reconcile():
+    """
+    Rebuilds all the counters within the retention window from the database.
+
+    The counters are watched from before the database is read until they are
+    replaced, so an increment in between, which the database read may have
+    missed, makes the attempt start over instead of being lost. Besides the
+    existing counters, the ones for the current and next minute are watched,
+    since recent results create them.
+    """
+    redis = get_redis_connection("default")
+    game_ids = list(models.Game.objects.values_list("id", flat=True))
+
+    for _ in range(RECONCILE_ATTEMPTS):
+        now = timezone.now()
+        start_date = now - timedelta(seconds=RETENTION)
+
+        with redis.pipeline() as pipeline:
+            stale_keys = list(redis.scan_iter(f"{settings.MATCH_COUNTER_KEY}:*"))
+            recent_keys = [
+                _key(minute, game_id)
+                for minute in (_minute(now), _minute(now) + 1)
+                for game_id in [None, *game_ids]
+            ]
+            pipeline.watch(*stale_keys, *recent_keys)
+
+            counters = _counters_from_db(start_date)
+
+            pipeline.multi()
+            if stale_keys:
+                pipeline.delete(*stale_keys)
+
+            for key, count in counters.items():
+                minute = int(key.rsplit(":", 1)[1])
+                ttl = RETENTION - (_minute(now) - minute) * 60
+                pipeline.set(key, count, ex=max(ttl, 1))
+
+            try:
+                pipeline.execute()
+            except WatchError:
+                logger.info("match counters changed while reconciling, retrying")
+                continue
+
+        logger.info(
+            f"reconciled match counters, deleted {len(stale_keys)} and set {len(counters)} keys"
+        )
+        return
+
+    logger.warning(
+        f"match counters kept changing, gave up reconciling after {RECONCILE_ATTEMPTS} attempts"
+    )
@@ -3,7 +3,9 @@ from random import randint, random
 from time import time
 
 from django.conf import settings
+from django.db import transaction
 from django_redis import get_redis_connection
+from redis.exceptions import RedisError
 
 from app import metrics, models, tasks
 
@@ -12,6 +14,15 @@ logging.config.dictConfig(settings.LOGGING)
 logger = logging.getLogger("MATCH_QUEUE")
 
 
+# Besides the queue itself, each agent has a set with the ids of its queued
+# matches, so cancelling the matches of an agent is O(k) on its number of
+# queued matches, instead of a scan over the whole queue. Cancelled matches
+# are deleted, and `get_next` skips their ids like any other match that
+# isn't pending anymore.
+def _agent_key(agent_id):
+    return f"{settings.MATCH_QUEUE_KEY}:agent:{agent_id}"
+
+
 def queue_size():
     redis = get_redis_connection("default")
     return redis.llen(settings.MATCH_QUEUE_KEY)
@@ -83,15 +94,92 @@ def get_next(game_name=None):
     return return_value
 
 
-def add(value):
+def _index(pipeline, matches):
+    """
+    Adds (match_id, player1_id, player2_id) tuples to the per agent indexes
+    """
+    match_ids_by_agent = {}
+    for match_id, player1_id, player2_id in matches:
+        for agent_id in (player1_id, player2_id):
+            match_ids_by_agent.setdefault(agent_id, []).append(str(match_id))
+
+    for agent_id, match_ids in match_ids_by_agent.items():
+        pipeline.sadd(_agent_key(agent_id), *match_ids)
+
+
+def add_matches(matches):
+    """
+    Queues `matches`, in order, and indexes them by agent
+    """
+    if not matches:
+        return
+
     redis = get_redis_connection("default")
-    redis.rpush(settings.MATCH_QUEUE_KEY, str(value))
+    pipeline = redis.pipeline()
+    pipeline.rpush(settings.MATCH_QUEUE_KEY, *[str(match.id) for match in matches])
+    _index(
+        pipeline,
+        [(match.id, match.player1_id, match.player2_id) for match in matches],
+    )
+    pipeline.execute()
 
 
-def add_many(values):
-    if values:
+def remove_from_index(match):
+    """
+    Called once a match was played, so it no longer counts as queued for its
+    agents. Never raises, the indexes get rebuilt with the queue.
+    """
+    try:
         redis = get_redis_connection("default")
-        redis.rpush(settings.MATCH_QUEUE_KEY, *list(map(str, values)))
+        pipeline = redis.pipeline()
+        for agent_id in (match.player1_id, match.player2_id):
+            pipeline.srem(_agent_key(agent_id), str(match.id))
+        pipeline.execute()
+    except RedisError:
+        logger.exception(f"failed to remove match {match.id} from the agent index")
+
+
+def cancel_agent_matches(agent):
+    """
+    Deletes the queued matches of `agent`, found through its index, so
+    workers don't keep picking matches of an agent that is gone. Used when an
+    agent is deactivated.
+
+    This applies to every tournament mode. Round robins and timed tournaments
+    end without the games against the agent, and swiss, adaptive and timed
+    ones only pair active agents from then on. On knockout tournaments the
+    agent forfeits, so its opponents go through whatever the score of their
+    tie.
+    """
+    redis = get_redis_connection("default")
+
+    queued_match_ids = [
+        match_id.decode() for match_id in redis.smembers(_agent_key(agent.id))
+    ]
+    pending_matches = list(
+        models.Match.objects.filter(id__in=queued_match_ids, ran=False).values_list(
+            "id", "player1_id", "player2_id"
+        )
+    )
+
+    with transaction.atomic():
+        for tournament in models.Tournament.objects.select_for_update().filter(
+            mode="KNOCKOUT", done=False, participants=agent
+        ):
+            tournament.forfeit(agent)
+
+        models.Match.objects.filter(
+            id__in=[match_id for match_id, _, _ in pending_matches]
+        ).delete()
+
+    pipeline = redis.pipeline()
+    pipeline.delete(_agent_key(agent.id))
+    for match_id, player1_id, player2_id in pending_matches:
+        opponent_id = player2_id if player1_id == agent.id else player1_id
+        pipeline.srem(_agent_key(opponent_id), str(match_id))
+    pipeline.execute()
+
+    logger.info(f"cancelled {len(pending_matches)} matches from agent {agent.id}")
 
 
 def regenerate_queue():
@@ -104,14 +192,19 @@ def regenerate_queue():
     queue_key = settings.MATCH_QUEUE_KEY
     old_size = queue_size()
 
-    pending_records_ids = (
+    pending_records = list(
         models.Match.objects.filter(ran=False)
-        .order_by("created_at")
-        .values_list("id", flat=True)
+        .order_by("created_at", "round")
+        .values_list("id", "player1_id", "player2_id")
     )
 
-    values = list(map(str, pending_records_ids))
+    values = [str(match_id) for match_id, _, _ in pending_records]
     logger.info(f"regenerate_queue will add {len(values)} new records, had {old_size}")
     if values:
-        redis.delete(queue_key)
-        redis.rpush(queue_key, *values)
+        stale_keys = list(redis.scan_iter(_agent_key("*")))
+
+        pipeline = redis.pipeline()
+        pipeline.delete(queue_key, *stale_keys)
+        pipeline.rpush(queue_key, *values)
+        _index(pipeline, pending_records)
+        pipeline.execute()
@@ -0,0 +1,540 @@
+"""
+Pairing generation for tournaments. Round robins are scheduled in rounds
+with the circle method, while swiss, knockout and adaptive tournaments are
+paired one round at a time, as the previous round finishes.
+"""
+import heapq
+import logging
+from collections import Counter
+from math import ceil, log2
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from redis.exceptions import RedisError
+
+from app import constants, models
+from app.services import match_counters
+
+
+logging.config.dictConfig(settings.LOGGING)
+logger = logging.getLogger("PAIRINGS")
+
+
+# Maximum number of steps spent looking for a round without rematches. If it
+# runs out, the round is paired greedily, allowing rematches.
+MAX_SEARCH_STEPS = 100_000
+
+
+def round_robin(participant_ids, n_cycles=1):
+    """
+    Schedules a round robin with the circle method. Returns a list of rounds,
+    each a list of (player1_id, player2_id) pairings where every agent plays
+    at most once. With an odd number of agents, one sits out each round.
+    Every pair meets once per cycle, swapping player1 and player2 on
+    alternate cycles.
+    """
+    players = list(participant_ids)
+    if len(players) < 2:
+        return []
+
+    if len(players) % 2 == 1:
+        players.append(None)
+
+    n_players = len(players)
+    cycle = []
+
+    for _ in range(n_players - 1):
+        pairings = []
+        for index in range(n_players // 2):
+            player1, player2 = players[index], players[n_players - 1 - index]
+            if player1 is not None and player2 is not None:
+                pairings.append((player1, player2))
+
+        cycle.append(pairings)
+
+        # Keeps the first player fixed and rotates everyone else
+        players = [players[0], players[-1]] + players[1:-1]
+
+    rounds = []
+    for cycle_number in range(n_cycles):
+        for pairings in cycle:
+            if cycle_number % 2 == 1:
+                pairings = [(player2, player1) for player1, player2 in pairings]
+            rounds.append(pairings)
+
+    return rounds
+
+
+def new_participant_rounds(existing_ids, new_ids, n_cycles=1):
+    """
+    Schedules the pairings that agents joining a running round robin are
+    missing: against every existing agent and against each other. Like
+    `round_robin`, each agent plays at most once per round, as long as fewer
+    agents join than were already there.
+    """
+    existing_ids = list(existing_ids)
+    new_ids = list(new_ids)
+
+    cycle = [
+        [
+            (existing_ids[(index + offset) % len(existing_ids)], new_id)
+            for index, new_id in enumerate(new_ids)
+        ]
+        for offset in range(len(existing_ids))
+    ] + round_robin(new_ids)
+
+    rounds = []
+    for cycle_number in range(n_cycles):
+        for pairings in cycle:
+            if cycle_number % 2 == 1:
+                pairings = [(player2, player1) for player1, player2 in pairings]
+            rounds.append(pairings)
+
+    return rounds
+
+
+def spread(rounds):
+    """
+    Reorders the pairings inside each round so that the agents that played
+    last go last, spacing out the matches of each agent across round
+    boundaries as much as possible.
+    """
+    last_seen = {}
+    position = 0
+    result = []
+
+    for pairings in rounds:
+        pairings = sorted(
+            pairings,
+            key=lambda pair: max(
+                last_seen.get(pair[0], -1), last_seen.get(pair[1], -1)
+            ),
+        )
+
+        for player1, player2 in pairings:
+            last_seen[player1] = last_seen[player2] = position
+            position += 1
+
+        result.append(pairings)
+
+    return result
+
+
+# Timed tournaments keep enough pending matches for `TIMED_HORIZON` seconds
+# of the recent throughput of their game, within these bounds
+TIMED_HORIZON = constants.ONE_MINUTE * 5
+TIMED_THROUGHPUT_WINDOW = constants.ONE_MINUTE * 15
+TIMED_MIN_DEPTH = 10
+TIMED_MAX_DEPTH = 1000
+
+
+def timed_target_depth(tournament):
+    """
+    How many pending matches a timed tournament should have. Enough to keep
+    the workers busy until the next top ups, but never more than can be
+    played before the tournament ends.
+    """
+    try:
+        recent_matches = match_counters.count_last(
+            TIMED_THROUGHPUT_WINDOW, game_id=tournament.game_id
+        )
+    except RedisError:
+        logger.exception("failed to read the match counters")
+        return TIMED_MIN_DEPTH
+
+    throughput = recent_matches / TIMED_THROUGHPUT_WINDOW
+    target = min(max(throughput * TIMED_HORIZON, TIMED_MIN_DEPTH), TIMED_MAX_DEPTH)
+
+    time_left = (tournament.end_date - timezone.now()).total_seconds()
+    if time_left < TIMED_HORIZON:
+        target = min(target, throughput * time_left)
+
+    return ceil(target)
+
+
+def pair_key(agent1_id, agent2_id):
+    """
+    Key of an unordered pair of agents on `Tournament.pair_counts`
+    """
+    return ":".join(sorted((str(agent1_id), str(agent2_id))))
+
+
+def timed_pairings(participant_ids, pair_counts, n_matches):
+    """
+    Returns the next `n_matches` pairings of a round robin that repeats
+    forever. `pair_counts` has how many times each pair was already created,
+    and the pairs created the fewest times go first, in round robin order, so
+    adding or removing agents doesn't change where the other pairs are.
+    Returns the rounds of pairings, the number of the first one, and the new
+    pair counts. Rounds are numbered by repetition and position on the
+    schedule, so rounds without pairings are returned empty, to keep the
+    numbering contiguous.
+    """
+    schedule = round_robin(participant_ids)
+    pair_counts = dict(pair_counts)
+
+    heap = [
+        (pair_counts.get(pair_key(*pair), 0), position, round_number, pair)
+        for position, (round_number, pair) in enumerate(
+            (round_number, pair)
+            for round_number, pairings in enumerate(schedule)
+            for pair in pairings
+        )
+    ]
+
+    if not heap:
+        return [], 1, pair_counts
+
+    heapq.heapify(heap)
+
+    rounds = {}
+    for _ in range(n_matches):
+        count, position, round_number, pair = heapq.heappop(heap)
+
+        # Player1 and player2 alternate between repetitions of a pair
+        player1, player2 = pair if count % 2 == 0 else pair[::-1]
+        rounds.setdefault(count * len(schedule) + round_number, []).append(
+            (player1, player2)
+        )
+
+        pair_counts[pair_key(*pair)] = count + 1
+        heapq.heappush(heap, (count + 1, position, round_number, pair))
+
+    first, last = min(rounds), max(rounds)
+    return (
+        [rounds.get(key, []) for key in range(first, last + 1)],
+        first + 1,
+        pair_counts,
+    )
+
+
+def _seeds(tournament):
+    """
+    Returns the ids of the active participants, ordered by their elo on the
+    tournament season, highest first.
+    """
+    participants = tournament.participants.filter(active=True)
+    elos = dict(
+        models.AgentRatings.objects.filter(
+            season_id=tournament.season_id, agent__in=participants
+        ).values_list("agent_id", "elo")
+    )
+    participant_ids = participants.values_list("id", flat=True)
+
+    return sorted(participant_ids, key=lambda agent_id: -elos.get(agent_id, 0))
+
+
+def _pair_without_rematches(players, played, budget):
+    if not players:
+        return []
+
+    first, rest = players[0], players[1:]
+    for opponent in rest:
+        budget[0] -= 1
+        if budget[0] < 0:
+            return None
+
+        if frozenset((first, opponent)) in played:
+            continue
+
+        remaining = [player for player in rest if player != opponent]
+        pairs = _pair_without_rematches(remaining, played, budget)
+        if pairs is not None:
+            return [(first, opponent)] + pairs
+
+    return None
+
+
+def _pair_greedily(players, played):
+    players = list(players)
+    pairs = []
+
+    while players:
+        first = players.pop(0)
+        opponent = next(
+            (p for p in players if frozenset((first, p)) not in played), players[0]
+        )
+        players.remove(opponent)
+        pairs.append((first, opponent))
+
+    return pairs
+
+
+def swiss_round(tournament):
+    """
+    Returns the (player1_id, player2_id) pairings of the next round of a swiss
+    tournament. Agents are ordered by their tournament score, then by elo, and
+    each one is paired with the closest agent on that order that it hasn't
+    played yet.
+
+    With an odd number of agents, the lowest ranked agent that hasn't had a
+    bye yet sits the round out. A bye doesn't award any points, since
+    standings only count played matches.
+    """
+    seeds = _seeds(tournament)
+    if len(seeds) < 2:
+        return []
+
+    scores = {result.agent.id: result.score for result in tournament.ratings}
+    players = sorted(seeds, key=lambda agent_id: -scores.get(agent_id, 0))
+
+    previous_matches = list(tournament.matches.values_list("player1_id", "player2_id"))
+    played = {frozenset(pair) for pair in previous_matches}
+    match_counts = Counter(agent_id for pair in previous_matches for agent_id in pair)
+    player1_counts = Counter(player1_id for player1_id, _ in previous_matches)
+
+    if len(players) % 2 == 1:
+        most_matches = max(match_counts[agent_id] for agent_id in players)
+        bye = next(
+            agent_id
+            for agent_id in reversed(players)
+            if match_counts[agent_id] == most_matches
+        )
+        players.remove(bye)
+        logger.info(f"{bye} gets a bye on tournament {tournament.id}")
+
+    pairs = _pair_without_rematches(players, played, [MAX_SEARCH_STEPS])
+    if pairs is None:
+        logger.warning(
+            f"couldn't pair tournament {tournament.id} without rematches, allowing them"
+        )
+        pairs = _pair_greedily(players, played)
+
+    # Whoever was player1 less often gets to be player1
+    return [
+        (a, b) if player1_counts[a] <= player1_counts[b] else (b, a) for a, b in pairs
+    ]
+
+
+def _seeding_order(size):
+    """
+    Bracket positions of the seeds on a bracket of `size`, a power of two,
+    so the top seeds only meet on the last rounds. E.g. for 8: 1 8 4 5 2 7 3 6
+    """
+    order = [1]
+    while len(order) < size:
+        order = [seed for s in order for seed in (s, 2 * len(order) + 1 - s)]
+
+    return order
+
+
+def _first_knockout_round(seeds):
+    size = 2 ** ceil(log2(len(seeds)))
+    positions = [
+        seeds[seed - 1] if seed <= len(seeds) else None for seed in _seeding_order(size)
+    ]
+
+    return [list(tie) for tie in zip(positions[::2], positions[1::2])]
+
+
+def tie_winner(tournament, round, tie):
+    """
+    Returns the agent that won `tie`, a pair of agent ids, on `round`. The
+    agent with the most points over the games of the tie wins. If they are
+    level, the higher seed goes through. An agent without an opponent, or
+    whose opponent forfeited, wins by default.
+    """
+    agent1, agent2 = tie
+    if agent2 is None:
+        return agent1
+    if agent1 is None:
+        return agent2
+
+    forfeits = tournament.bracket.get("forfeits", [])
+    if agent1 in forfeits and agent2 not in forfeits:
+        return agent2
+    if agent2 in forfeits and agent1 not in forfeits:
+        return agent1
+
+    points = {agent1: 0, agent2: 0}
+    for player1_id, player2_id, result in tournament.matches.filter(
+        round=round, ran=True, player1_id__in=tie, player2_id__in=tie
+    ).values_list("player1_id", "player2_id", "result"):
+        if result < 0:
+            continue
+
+        points[str(player1_id)] += result
+        points[str(player2_id)] += 1 - result
+
+    if points[agent1] == points[agent2]:
+        seeds = tournament.bracket["seeds"]
+        return min(tie, key=seeds.index)
+
+    return max(tie, key=points.get)
+
+
+def knockout_round(tournament):
+    """
+    Returns the pairings of the next round of a knockout tournament, and
+    records its ties on the tournament bracket, which the caller saves
+    together with the matches. The first round is seeded by
+    the elo on the tournament season, the top seeds getting byes if the
+    number of agents isn't a power of two. Each tie has `best_of` games,
+    alternating who is player1.
+    """
+    bracket = tournament.bracket
+
+    if not bracket.get("rounds"):
+        seeds = [str(agent_id) for agent_id in _seeds(tournament)]
+        if len(seeds) < 2:
+            return []
+
+        bracket = {"seeds": seeds, "rounds": []}
+        tournament.bracket = bracket
+        ties = _first_knockout_round(seeds)
+    else:
+        round = len(bracket["rounds"])
+        winners = [tie_winner(tournament, round, tie) for tie in bracket["rounds"][-1]]
+        ties = [list(tie) for tie in zip(winners[::2], winners[1::2])]
+
+    bracket["rounds"].append(ties)
+
+    return [
+        (agent1, agent2) if game % 2 == 0 else (agent2, agent1)
+        for agent1, agent2 in ties
+        if agent1 is not None and agent2 is not None
+        for game in range(tournament.best_of)
+    ]
+
+
+def knockout_placings(tournament):
+    """
+    Returns the winner, the runner up and the semifinal losers of a finished
+    knockout tournament, as a {agent_id: place} dict.
+    """
+    rounds = tournament.bracket.get("rounds", [])
+    if not rounds:
+        return {}
+
+    placings = {}
+    for place, round in [(3, len(rounds) - 1), (1, len(rounds))]:
+        if round < 1:
+            continue
+
+        for tie in rounds[round - 1]:
+            if None in tie:
+                continue
+
+            winner = tie_winner(tournament, round, tie)
+            loser = tie[1] if winner == tie[0] else tie[0]
+
+            if place == 1:
+                placings[winner] = 1
+                placings[loser] = 2
+            else:
+                placings[loser] = 3
+
+    return placings
+
+
+# Agents with fewer games than this on the season are still being placed, and
+# their pairings go before everyone else's on adaptive tournaments
+PLACEMENT_GAMES = 10
+
+
+def expected_scores(elos):
+    """
+    Returns the matrix of expected scores between all pairs of `elos`, where
+    entry [i, j] is the expected score of i against j. Same formula as
+    `elo.compute_expected_result`, computed for every pair at once.
+    """
+    elos = np.asarray(elos, dtype=float)
+    return 1 / (1 + 10 ** ((elos[np.newaxis, :] - elos[:, np.newaxis]) / 400))
+
+
+def information_gain(elos, games_played, times_played=None):
+    """
+    Returns the matrix of how much playing each pair of agents is expected to
+    tell about their ratings. Pairs of agents with close elos, whose outcome
+    is the least predictable, and agents that played few games, whose rating
+    is the least certain, score the highest. Pairs that already played each
+    other `times_played` times get discounted.
+    """
+    expected = expected_scores(elos)
+    uncertainty = 1 / np.sqrt(1 + np.asarray(games_played, dtype=float))
+
+    gain = expected * (1 - expected) * (uncertainty[:, np.newaxis] + uncertainty)
+    if times_played is not None:
+        gain = gain / (1 + times_played)
+
+    np.fill_diagonal(gain, -np.inf)
+    return gain
+
+
+def adaptive_pairings(elos, games_played, times_played=None):
+    """
+    Returns a round of (i, j) index pairings, where each agent plays at most
+    once, picking the pairs with the most information gain first. Pairs with
+    an agent that is still being placed go before all others.
+    """
+    n_agents = len(elos)
+    if n_agents < 2:
+        return []
+
+    gain = information_gain(elos, games_played, times_played)
+    placing = np.asarray(games_played) < PLACEMENT_GAMES
+
+    first, second = np.triu_indices(n_agents, k=1)
+    order = np.lexsort((-gain[first, second], ~(placing[first] | placing[second])))
+
+    paired = np.zeros(n_agents, dtype=bool)
+    pairs = []
+    for index in order:
+        i, j = first[index], second[index]
+        if paired[i] or paired[j]:
+            continue
+
+        paired[i] = paired[j] = True
+        pairs.append((int(i), int(j)))
+
+        if len(pairs) == n_agents // 2:
+            break
+
+    return pairs
+
+
+def adaptive_round(tournament):
+    """
+    Returns the (player1_id, player2_id) pairings of the next round of an
+    adaptive tournament, chosen to converge the ratings of the active
+    participants on the tournament season with as few matches as possible.
+    """
+    participant_ids = list(
+        tournament.participants.filter(active=True).values_list("id", flat=True)
+    )
+    if len(participant_ids) < 2:
+        return []
+
+    ratings = {
+        agent_id: (elo, wins + loses + draws)
+        for agent_id, elo, wins, loses, draws in models.AgentRatings.objects.filter(
+            season_id=tournament.season_id, agent_id__in=participant_ids
+        ).values_list("agent_id", "elo", "wins", "loses", "draws")
+    }
+
+    # Agents without ratings on the season haven't played yet
+    elos, games_played = zip(
+        *(ratings.get(agent_id, (1500, 0)) for agent_id in participant_ids)
+    )
+
+    index = {agent_id: i for i, agent_id in enumerate(participant_ids)}
+    times_played = np.zeros((len(participant_ids), len(participant_ids)))
+    player1_counts = Counter()
+    for player1_id, player2_id in tournament.matches.values_list(
+        "player1_id", "player2_id"
+    ):
+        if player1_id in index and player2_id in index:
+            times_played[index[player1_id], index[player2_id]] += 1
+            times_played[index[player2_id], index[player1_id]] += 1
+        player1_counts[player1_id] += 1
+
+    pairs = [
+        (participant_ids[i], participant_ids[j])
+        for i, j in adaptive_pairings(elos, games_played, times_played)
+    ]
+
+    # Whoever was player1 less often gets to be player1
+    return [
+        (a, b) if player1_counts[a] <= player1_counts[b] else (b, a) for a, b in pairs
+    ]
@@ -1,16 +1,105 @@
 import logging
 from decimal import Decimal
 
-from django.core.exceptions import ObjectDoesNotExist
+from django.conf import settings
 
-from app.models import AgentRatings
+from app import constants
+from app.models import Agent, AgentRatings, Season
 
+from . import leaderboard
 from .elo import compute_updated_ratings
 
 
 logger = logging.getLogger(__name__)
 
 
+INITIAL_ELO = Decimal(1500)
+
+# How new season ratings are seeded from the previous season:
+# - reset: everyone starts at the initial elo
+# - carry_over: agents keep their elo from the previous season
+# - regress: the previous elo moves REGRESSION_FACTOR of the way back to
+#   the initial elo
+SEEDING_POLICIES = ("reset", "carry_over", "regress")
+REGRESSION_FACTOR = Decimal("0.5")
+
+
+def provision_ratings(season_id, agent_games, elos=None):
+    """
+    Creates the ratings of `agent_games`, (agent_id, game_id) pairs, on
+    `season_id` with a single insert. Ratings that already exist are left
+    untouched. `elos` optionally maps agent ids to their initial elo.
+
+    Every agent gets its ratings before it can play on a season, either when
+    the season is created or when matches are created for it, so updating
+    ratings never needs to create them.
+    """
+    elos = elos or {}
+    ratings = [
+        AgentRatings(
+            season_id=season_id,
+            agent_id=agent_id,
+            game_id=game_id,
+            elo=elos.get(agent_id, INITIAL_ELO),
+        )
+        for agent_id, game_id in agent_games
+    ]
+
+    AgentRatings.objects.bulk_create(
+        ratings, batch_size=constants.BULK_BATCH_SIZE, ignore_conflicts=True
+    )
+    leaderboard.add_agents(season_id, [agent_id for agent_id, _ in agent_games])
+
+
+def _seed_elos(season, policy):
+    if policy not in SEEDING_POLICIES:
+        raise ValueError(f"Unknown seeding policy {policy}")
+
+    if policy == "reset":
+        return {}
+
+    # Seasons created through the api may not have dates
+    if season.start_date is not None:
+        previous_seasons = Season.objects.filter(
+            start_date__lt=season.start_date
+        ).order_by("-start_date")
+    else:
+        previous_seasons = Season.objects.filter(
+            created_at__lt=season.created_at
+        ).order_by("-created_at")
+
+    previous_season = previous_seasons.filter(main=True).exclude(id=season.id).first()
+    if previous_season is None:
+        return {}
+
+    elos = dict(previous_season.ratings.values_list("agent_id", "elo"))
+
+    if policy == "regress":
+        elos = {
+            agent_id: elo - (elo - INITIAL_ELO) * REGRESSION_FACTOR
+            for agent_id, elo in elos.items()
+        }
+
+    return elos
+
+
+def provision_season(season, policy=None):
+    """
+    Creates the ratings of every active agent on a new season, seeded
+    according to `policy`, one of `SEEDING_POLICIES`. Defaults to the
+    `SEASON_RATINGS_SEEDING` setting.
+    """
+    policy = policy or settings.SEASON_RATINGS_SEEDING
+    agent_games = list(Agent.objects.active().values_list("id", "game_id"))
+
+    provision_ratings(season.id, agent_games, elos=_seed_elos(season, policy))
+    leaderboard.rebuild_season(season)
+
+    logger.info(
+        f"provisioned {len(agent_games)} ratings for season {season.id} with {policy}"
+    )
+
+
 def update_ratings_from_match(match):
     """
     Takes a match and atomically update the participants ratings
@@ -23,22 +112,8 @@ def update_ratings_from_match(match):
     player1_id = str(player1.name)
     player2_id = str(player2.name)
 
-    # HACK: Not gonna lie, idk if this is even safe. Seems to be prone to race
-    # conditions and record duplication because of that. Ideally we would
-    # ensure that all agent / season pair have a respective AgentRating
-    try:
-        p1_ratings = match.player1.ratings.select_for_update().get(season=match.season)
-    except ObjectDoesNotExist:
-        p1_ratings = AgentRatings.objects.create(
-            season=match.season, agent=match.player1, game=match.game
-        )
-
-    try:
-        p2_ratings = match.player2.ratings.select_for_update().get(season=match.season)
-    except ObjectDoesNotExist:
-        p2_ratings = AgentRatings.objects.create(
-            season=match.season, agent=match.player2, game=match.game
-        )
+    p1_ratings = match.player1.ratings.select_for_update().get(season=match.season)
+    p2_ratings = match.player2.ratings.select_for_update().get(season=match.season)
 
     elos = {player1_id: float(p1_ratings.elo), player2_id: float(p2_ratings.elo)}
     match_result = {(player1_id, player2_id): float(match.result)}
@@ -68,6 +143,8 @@ def update_ratings_from_match(match):
     p1_ratings.save()
     p2_ratings.save()
 
+    leaderboard.update_ratings(p1_ratings, p2_ratings)
+
     update_elo_change_after(match)
 
 
@@ -75,28 +152,6 @@ def update_elo_change_before(match):
     match.player1.refresh_from_db()
     match.player2.refresh_from_db()
 
-    # HACK: We are creating this here as necessary, but we shouldn't need to
-    try:
-        match.player1.ratings.get(season=match.season)
-    except ObjectDoesNotExist:
-        logger.info(
-            f"lazily created agentratings for {match.player1.id} {match.season.id} {match.game.name}"
-        )
-        AgentRatings.objects.create(
-            season=match.season, agent=match.player1, game=match.game
-        )
-
-    # HACK: Prepare for trouble, make it double
-    try:
-        match.player2.ratings.get(season=match.season)
-    except ObjectDoesNotExist:
-        logger.info(
-            f"lazily created agentratings for {match.player2.id} {match.season.id} {match.game.name}"
-        )
-        AgentRatings.objects.create(
-            season=match.season, agent=match.player2, game=match.game
-        )
-
     p1_ratings = match.player1.ratings.get(season=match.season)
     p2_ratings = match.player2.ratings.get(season=match.season)
 
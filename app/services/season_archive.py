@@ -0,0 +1,307 @@
+"""
+Frozen snapshots of seasons that are over. Once a season has ended and all of
+its matches were played, nothing about it changes anymore, so its pages,
+standings, elo series and plots are rendered once and written to the file
+storage. The views of archived seasons are then served from the snapshot,
+without touching the database, and with cache headers.
+
+Jobs that rewrite the results of a season, like regenerating trophies or
+recalculating ratings, `invalidate` its archive, and the season gets archived
+again on the next run of `archive_ended`. For this reason the responses are
+only cached for a while, instead of for good.
+
+Each season gets a directory on the storage with:
+
+- `snapshot.json`: the season, its summary and its tournaments, i.e. what
+  the season and winners pages show
+- `elo_<game_id>.json`: the full elo series of every agent of the game
+- `elo_<game_id>.png`: the elo plot of the game
+"""
+import json
+import logging
+import uuid
+from datetime import datetime
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from app import constants, models, plots
+from app.services import season_summary, timeseries
+
+
+logging.config.dictConfig(settings.LOGGING)
+logger = logging.getLogger("SEASON_ARCHIVE")
+
+
+ARCHIVE_DIR = "season_archives"
+SNAPSHOT_NAME = "snapshot.json"
+
+# Snapshots are only replaced when invalidated, which also drops them from
+# the cache, so the cache only saves the trips to the storage
+SNAPSHOT_CACHE_TIMEOUT = constants.ONE_DAY
+
+# Seasons that aren't archived are remembered for a short while, so their
+# pages don't check the storage on every request
+NOT_ARCHIVED_CACHE_TIMEOUT = constants.ONE_MINUTE * 5
+
+# Max age of the pages and of the plots and data served from an archive
+ARCHIVE_PAGE_MAX_AGE = constants.TEN_MINUTES
+ARCHIVE_DATA_MAX_AGE = constants.ONE_HOUR
+
+
+def _path(season_id, name):
+    """
+    Path of file `name` of the archive of `season_id`, or None if the id isn't
+    valid. Ids come straight from urls, so they are checked before they get
+    anywhere near the storage.
+    """
+    try:
+        season_id = uuid.UUID(str(season_id))
+    except ValueError:
+        return None
+
+    return f"{ARCHIVE_DIR}/{season_id}/{name}"
+
+
+def _game_path(season_id, game_id, extension):
+    try:
+        game_id = uuid.UUID(str(game_id))
+    except ValueError:
+        return None
+
+    return _path(season_id, f"elo_{game_id}.{extension}")
+
+
+def _cache_key(season_id):
+    return f"{settings.SEASON_ARCHIVE_CACHE_KEY}:{season_id}"
+
+
+def _write(path, content):
+    # Some storages rename files instead of overwriting them
+    if default_storage.exists(path):
+        default_storage.delete(path)
+
+    default_storage.save(path, ContentFile(content))
+
+
+def _read(path):
+    if path is None or not default_storage.exists(path):
+        return None
+
+    with default_storage.open(path, "rb") as f:
+        return f.read()
+
+
+def _to_json(data):
+    return json.dumps(data, cls=DjangoJSONEncoder).encode()
+
+
+def is_archivable(season):
+    """
+    Seasons can be archived once they are over and have nothing left to play
+    """
+    return (
+        season.end_date is not None
+        and season.end_date < timezone.now()
+        and not season.tournaments.filter(done=False).exists()
+        and not season.matches.filter(ran=False).exists()
+    )
+
+
+def _tournaments(season):
+    tournaments = (
+        season.tournaments.with_state().select_related("game").order_by("-end_date")
+    )
+
+    return [
+        {
+            "id": str(tournament.id),
+            "name": tournament.name,
+            "mode": tournament.mode,
+            "game": {"id": str(tournament.game.id), "name": tournament.game.name},
+            "played_matches_count": tournament.played_matches_count,
+            "pending_matches_count": tournament.pending_matches_count,
+        }
+        for tournament in tournaments[:25]
+    ]
+
+
+def build_snapshot(season):
+    summary = season_summary.refresh(season)
+
+    return {
+        "archived_at": timezone.now(),
+        "season": {
+            "id": str(season.id),
+            "name": season.name,
+            "active": season.active,
+            "start_date": season.start_date,
+            "end_date": season.end_date,
+            "duration_humanized": season.duration_humanized,
+            "time_left_humanized": season.time_left_humanized,
+        },
+        "summary": {
+            "tournaments_count": summary.tournaments_count,
+            "matches_played_count": summary.matches_played_count,
+            "matches_pending_count": summary.matches_pending_count,
+            "games": summary.games,
+            "top_agents": summary.top_agents,
+            "winners": summary.winners,
+        },
+        "tournaments": _tournaments(season),
+    }
+
+
+def _elo_series(game, season):
+    return {
+        "game_id": str(game.id),
+        "season_id": str(season.id),
+        "series": [
+            {
+                "agent_id": str(agent.id),
+                "agent_name": agent.name,
+                **timeseries.to_columnar(x, y),
+            }
+            for agent, x, y in timeseries.game_season_elo(game, season)
+        ],
+    }
+
+
+def archive(season):
+    """
+    Renders the snapshot of `season` and writes it to the storage. The
+    snapshot is written last, so a season only counts as archived once all of
+    its files are in place.
+    """
+    if not is_archivable(season):
+        raise ValueError(f"Season {season.id} can't be archived yet")
+
+    snapshot = build_snapshot(season)
+
+    for game in models.Game.objects.filter(agentratings__season=season).distinct():
+        _write(
+            _game_path(season.id, game.id, "json"),
+            _to_json(_elo_series(game, season)),
+        )
+        _write(
+            _game_path(season.id, game.id, "png"),
+            plots.plot_game_season_elo(game, season).content,
+        )
+
+    _write(_path(season.id, SNAPSHOT_NAME), _to_json(snapshot))
+    cache.set(
+        _cache_key(season.id),
+        _parse_snapshot(_to_json(snapshot)),
+        SNAPSHOT_CACHE_TIMEOUT,
+    )
+
+    season.archived_at = snapshot["archived_at"]
+    season.save(update_fields=["archived_at"])
+
+    logger.info(f"archived season {season.id} {season.name}")
+
+
+def invalidate(season):
+    """
+    Drops the archive of `season`, so its pages go back to the database until
+    it is archived again. Must be called whenever the results of an archived
+    season change.
+    """
+    path = _path(season.id, SNAPSHOT_NAME)
+    if default_storage.exists(path):
+        default_storage.delete(path)
+
+    cache.delete(_cache_key(season.id))
+    models.Season.objects.filter(id=season.id).update(archived_at=None)
+    season.archived_at = None
+
+    logger.info(f"invalidated the archive of season {season.id} {season.name}")
+
+
+def archive_ended():
+    """
+    Archives every season that is over and wasn't archived yet
+    """
+    seasons = models.Season.objects.filter(
+        archived_at__isnull=True, end_date__lt=timezone.now()
+    ).exclude(
+        Exists(models.Tournament.objects.filter(season=OuterRef("pk"), done=False))
+        | Exists(models.Match.objects.filter(season=OuterRef("pk"), ran=False))
+    )
+
+    for season in seasons:
+        archive(season)
+
+
+def _parse_snapshot(content):
+    snapshot = json.loads(content)
+
+    for field in ("start_date", "end_date"):
+        if snapshot["season"][field]:
+            snapshot["season"][field] = parse_datetime(snapshot["season"][field])
+
+    return snapshot
+
+
+def load(season_id):
+    """
+    Returns the snapshot of `season_id`, or None if it isn't archived. Never
+    touches the database.
+    """
+    path = _path(season_id, SNAPSHOT_NAME)
+    if path is None:
+        return None
+
+    snapshot = cache.get(_cache_key(season_id))
+
+    if snapshot is None:
+        content = _read(path)
+        if content is None:
+            cache.set(_cache_key(season_id), False, NOT_ARCHIVED_CACHE_TIMEOUT)
+            return None
+
+        snapshot = _parse_snapshot(content)
+        cache.set(_cache_key(season_id), snapshot, SNAPSHOT_CACHE_TIMEOUT)
+
+    return snapshot or None
+
+
+def elo_plot(season_id, game_id):
+    """
+    Returns the png of the elo plot of `game_id` on the archive of
+    `season_id`, or None if the season isn't archived
+    """
+    if load(season_id) is None:
+        return None
+
+    return _read(_game_path(season_id, game_id, "png"))
+
+
+def elo_series(season_id, game_id):
+    """
+    Returns the archived elo series of `game_id` on `season_id`, in the same
+    format as `timeseries.game_season_elo` but with the agents as dicts, or
+    None if the season isn't archived
+    """
+    if load(season_id) is None:
+        return None
+
+    content = _read(_game_path(season_id, game_id, "json"))
+    if content is None:
+        return None
+
+    return [
+        (
+            {"id": series["agent_id"], "name": series["agent_name"]},
+            [datetime.fromtimestamp(t, tz=dt_timezone.utc) for t in series["t"]],
+            series["v"],
+        )
+        for series in json.loads(content)["series"]
+    ]
@@ -0,0 +1,175 @@
+"""
+Per season summary shown on the season and winners pages, stored on a
+`SeasonSummary` row so rendering them doesn't go over all the matches and
+ratings of the season.
+
+The counters are incremented as tournaments and matches get created and
+played, once the change they count is committed. Every ingestion updates the
+same summary row, so doing it inside the ingestion transaction would hold its
+lock until commit and serialize the ingestion of the whole season.
+
+The rankings, i.e. the per game trophy tables and the winners list, are
+recomputed whenever a tournament finishes. Active seasons are also refreshed
+from scratch periodically, which picks up elo changes between tournaments and
+fixes any drift on the counters, e.g. from deleted matches or from a process
+that died between a commit and its increment.
+"""
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from app import models
+from app.services import trophy
+
+
+logging.config.dictConfig(settings.LOGGING)
+logger = logging.getLogger("SEASON_SUMMARY")
+
+
+def get(season):
+    """
+    Returns the summary of `season`, computing it if it doesn't exist yet
+    """
+    try:
+        return season.summary
+    except models.SeasonSummary.DoesNotExist:
+        return refresh(season)
+
+
+def _counts(season):
+    matches = season.matches.aggregate(
+        played=Count("id", filter=Q(ran=True)),
+        pending=Count("id", filter=Q(ran=False)),
+    )
+
+    return {
+        "tournaments_count": season.tournaments.count(),
+        "matches_played_count": matches["played"],
+        "matches_pending_count": matches["pending"],
+    }
+
+
+def _winners(season):
+    """
+    Every rating of the season ordered by elo. The ranking skips the agents
+    of superusers, and only counts the best agent of each user. Emails are
+    left out, since the summary ends up on the archives.
+    """
+    ratings = season.ratings.all().select_related("agent__owner").order_by("-elo")
+
+    owner_list = set(
+        models.User.objects.filter(is_superuser=True).values_list("id", flat=True)
+    )
+
+    winners = []
+    ranking = 1
+    for rating in ratings:
+        owner = rating.agent.owner
+        row = {
+            "agent_id": str(rating.agent_id),
+            "agent_name": rating.agent.name,
+            "owner_id": owner.id,
+            "owner_username": owner.username,
+            "elo": float(rating.elo),
+            "ranking": "",
+        }
+
+        if owner.id not in owner_list:
+            row["ranking"] = ranking
+            owner_list.add(owner.id)
+            ranking += 1
+
+        winners.append(row)
+
+    return winners
+
+
+def _rankings(season):
+    top_agents = {}
+    for season_trophies in trophy.trophies_for_season(season):
+        top_agents.setdefault(str(season_trophies.game_id), []).append(
+            {
+                "agent_id": str(season_trophies.agent_id),
+                "agent_name": season_trophies.agent_name,
+                "elo": season_trophies.elo and float(season_trophies.elo),
+                "first_places": season_trophies.first_places,
+                "second_places": season_trophies.second_places,
+                "third_places": season_trophies.third_places,
+                "trophy_count": season_trophies.trophy_count,
+            }
+        )
+
+    games = models.Game.objects.filter(agentratings__season=season).distinct()
+
+    return {
+        "games": {str(game.id): game.pretty_name for game in games},
+        "top_agents": top_agents,
+        "winners": _winners(season),
+        "rankings_updated_at": timezone.now(),
+    }
+
+
+def refresh(season):
+    """
+    Recomputes the whole summary of `season`
+    """
+    summary, _ = models.SeasonSummary.objects.update_or_create(
+        season=season, defaults={**_counts(season), **_rankings(season)}
+    )
+
+    logger.info(f"refreshed summary of season {season.id}")
+
+    return summary
+
+
+def refresh_rankings(season):
+    """
+    Recomputes the trophy tables and winners of `season`. Should be called
+    when one of its tournaments finishes.
+    """
+    updated = models.SeasonSummary.objects.filter(season=season).update(
+        **_rankings(season)
+    )
+
+    if not updated:
+        refresh(season)
+
+
+def refresh_active():
+    for season in models.Season.objects.filter(active=True):
+        refresh(season)
+
+
+def _increment(season_id, **fields):
+    # Seasons without a summary get it computed in full on the first read
+    transaction.on_commit(
+        lambda: models.SeasonSummary.objects.filter(season_id=season_id).update(
+            **{field: F(field) + value for field, value in fields.items()}
+        )
+    )
+
+
+def register_tournament_created(tournament):
+    _increment(tournament.season_id, tournaments_count=1)
+
+
+def register_matches_created(season_id, count):
+    _increment(season_id, matches_pending_count=count)
+
+
+def register_match_created(match):
+    if match.ran:
+        _increment(match.season_id, matches_played_count=1)
+    else:
+        _increment(match.season_id, matches_pending_count=1)
+
+
+def register_match_played(match):
+    """
+    Moves a pending match to the played ones. Must be called once per match,
+    when its result is ingested.
+    """
+    _increment(match.season_id, matches_pending_count=-1, matches_played_count=1)
@@ -0,0 +1,99 @@
+"""
+Snapshot of the site wide stats shown on the home and about pages. It is
+computed periodically by celery and stored on the cache, so rendering those
+pages doesn't touch the database.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from app import constants, models, season_resolver, services
+from app.services import match_counters
+
+
+logging.config.dictConfig(settings.LOGGING)
+logger = logging.getLogger("SITE_STATS")
+
+
+# If celery stops refreshing the snapshot, it expires and the pages fall back
+# to computing it on the request.
+SNAPSHOT_TIMEOUT = constants.ONE_MINUTE * 5
+
+
+class SiteStat:
+    def __init__(self, value, computed_at):
+        self.value = value
+        self.computed_at = computed_at
+
+    @property
+    def age(self):
+        return (timezone.now() - self.computed_at).total_seconds()
+
+    @property
+    def pretty_age(self):
+        return services.prettify_time_delta(self.age)
+
+
+def compute_snapshot():
+    stats = {}
+
+    def _set(name, value):
+        stats[name] = SiteStat(value, timezone.now())
+
+    _set("matches_1m", match_counters.count_last(constants.ONE_MINUTE))
+    _set("matches_1h", match_counters.count_last(constants.ONE_HOUR))
+    _set("matches_24h", match_counters.count_last(constants.ONE_DAY))
+    _set(
+        "active_agent_count",
+        models.Match.objects.filter(
+            ran=True, ran_at__gte=timezone.now() - timedelta(days=1)
+        )
+        .distinct("player1")
+        .count(),
+    )
+    _set(
+        "open_tournament_count",
+        models.Tournament.objects.filter(done=False).count(),
+    )
+
+    current_season = season_resolver.current()
+    _set("current_season_name", current_season.name if current_season else "-")
+
+    _set("pending_matches", models.Match.objects.filter(ran=False).count())
+    _set(
+        "oldest_pending_match_created_at",
+        models.Match.objects.filter(ran=False)
+        .order_by("created_at")
+        .values_list("created_at", flat=True)
+        .first(),
+    )
+    _set("last_celery_heartbeat", services.get_last_celery_heartbeat())
+    _set("last_colosseum_heartbeat", services.get_last_colosseum_heartbeat())
+
+    return stats
+
+
+def refresh_snapshot():
+    snapshot = compute_snapshot()
+    cache.set(settings.SITE_STATS_CACHE_KEY, snapshot, SNAPSHOT_TIMEOUT)
+    return snapshot
+
+
+def get_snapshot():
+    snapshot = cache.get(settings.SITE_STATS_CACHE_KEY)
+
+    if snapshot is None:
+        logger.info("site stats snapshot is missing, computing it on the request")
+        snapshot = refresh_snapshot()
+
+    return snapshot
+
+
+def pretty_time_since(date):
+    if date is None:
+        return "-"
+
+    return services.prettify_time_delta((timezone.now() - date).total_seconds())
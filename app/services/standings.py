@@ -0,0 +1,210 @@
+"""
+Per tournament standings. Each result is added to the standings of both
+players as it gets ingested, so reading the standings of a tournament is a
+handful of rows instead of a pass over all of its matches.
+
+`ranked` computes the full table with tie-breakers straight from the
+matches, using numpy arrays instead of match objects.
+"""
+import logging
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
+
+from app import models
+
+
+logging.config.dictConfig(settings.LOGGING)
+logger = logging.getLogger("STANDINGS")
+
+
+def _deltas(result):
+    """
+    Returns the (score, wins, loses, draws) increments for player1 and
+    player2 given a match result.
+    """
+    if result == 1:
+        return (1, 1, 0, 0), (0, 0, 1, 0)
+    if result == 0:
+        return (0, 0, 1, 0), (1, 1, 0, 0)
+    if result == Decimal("0.5"):
+        return (Decimal("0.5"), 0, 0, 1), (Decimal("0.5"), 0, 0, 1)
+
+    return None
+
+
+def register_match(match):
+    """
+    Adds the result of `match` to the standings of its tournament. Must be
+    called once per match, in the same transaction that ingests its result.
+    """
+    deltas = _deltas(match.result)
+    if deltas is None:
+        return
+
+    for agent_id, (score, wins, loses, draws) in zip(
+        (match.player1_id, match.player2_id), deltas
+    ):
+        standing, _ = models.TournamentStanding.objects.get_or_create(
+            tournament_id=match.tournament_id, agent_id=agent_id
+        )
+        models.TournamentStanding.objects.filter(id=standing.id).update(
+            score=F("score") + score,
+            wins=F("wins") + wins,
+            loses=F("loses") + loses,
+            draws=F("draws") + draws,
+        )
+
+
+def _tally(matches, player_field, win_result, lose_result):
+    return (
+        matches.values(player_field)
+        .annotate(
+            wins=Count("id", filter=Q(result=win_result)),
+            loses=Count("id", filter=Q(result=lose_result)),
+            draws=Count("id", filter=Q(result=Decimal("0.5"))),
+        )
+        .values_list(player_field, "wins", "loses", "draws")
+    )
+
+
+def rebuild(tournament):
+    """
+    Recomputes the standings of `tournament` from its matches
+    """
+    matches = tournament.matches.filter(ran=True, result__in=[0, Decimal("0.5"), 1])
+
+    totals = {}
+    for rows in (
+        _tally(matches, "player1_id", 1, 0),
+        _tally(matches, "player2_id", 0, 1),
+    ):
+        for agent_id, wins, loses, draws in rows:
+            total = totals.setdefault(agent_id, [0, 0, 0])
+            total[0] += wins
+            total[1] += loses
+            total[2] += draws
+
+    standings = [
+        models.TournamentStanding(
+            tournament=tournament,
+            agent_id=agent_id,
+            score=wins + Decimal("0.5") * draws,
+            wins=wins,
+            loses=loses,
+            draws=draws,
+        )
+        for agent_id, (wins, loses, draws) in totals.items()
+    ]
+
+    with transaction.atomic():
+        tournament.standings.all().delete()
+        models.TournamentStanding.objects.bulk_create(standings)
+
+    logger.info(
+        f"rebuilt standings for tournament {tournament.id} with {len(standings)} agents"
+    )
+
+
+def rebuild_all():
+    for tournament in models.Tournament.objects.only("id").iterator():
+        rebuild(tournament)
+
+
+def _match_arrays(tournament):
+    """
+    Fetches the results of `tournament` as integer coded arrays. Returns the
+    agent ids, indexed by their code, and the player1, player2 and result
+    arrays.
+    """
+    rows = tournament.matches.filter(
+        ran=True, result__in=[0, Decimal("0.5"), 1]
+    ).values_list("player1_id", "player2_id", "result")
+
+    if not rows:
+        return [], np.array([], dtype=int), np.array([], dtype=int), np.array([])
+
+    player1_ids, player2_ids, results = zip(*rows)
+
+    agent_ids, codes = np.unique(
+        np.array(player1_ids + player2_ids, dtype=object), return_inverse=True
+    )
+    player1, player2 = np.split(codes, 2)
+
+    return list(agent_ids), player1, player2, np.array(results, dtype=float)
+
+
+def _per_agent(n_agents, player1, player2, player1_values, player2_values):
+    return np.bincount(player1, weights=player1_values, minlength=n_agents) + (
+        np.bincount(player2, weights=player2_values, minlength=n_agents)
+    )
+
+
+def ranked(tournament):
+    """
+    Returns the standings of `tournament` as `TournamentResult`s, with
+    tie-breakers, ordered by place. Ties on score are broken by, in order:
+
+    - head to head: the score on the matches between the tied agents
+    - Sonneborn-Berger: the sum of the scores of the beaten opponents, plus
+      half of the scores of the drawn ones
+    - Buchholz: the sum of the scores of all opponents
+
+    Places are dense, agents that are still tied after all the tie-breakers
+    share the same place.
+    """
+    agent_ids, player1, player2, results = _match_arrays(tournament)
+    n_agents = len(agent_ids)
+
+    if n_agents == 0:
+        return []
+
+    score = _per_agent(n_agents, player1, player2, results, 1 - results)
+    wins = _per_agent(n_agents, player1, player2, results == 1, results == 0)
+    loses = _per_agent(n_agents, player1, player2, results == 0, results == 1)
+    draws = _per_agent(n_agents, player1, player2, results == 0.5, results == 0.5)
+
+    # Agents are in the same group when they have the same score
+    _, score_group = np.unique(score, return_inverse=True)
+    same_group = score_group[player1] == score_group[player2]
+    head_to_head = _per_agent(
+        n_agents,
+        player1,
+        player2,
+        np.where(same_group, results, 0),
+        np.where(same_group, 1 - results, 0),
+    )
+
+    sonneborn_berger = _per_agent(
+        n_agents,
+        player1,
+        player2,
+        results * score[player2],
+        (1 - results) * score[player1],
+    )
+    buchholz = _per_agent(n_agents, player1, player2, score[player2], score[player1])
+
+    keys = np.stack([score, head_to_head, sonneborn_berger, buchholz], axis=1)
+    order = np.lexsort((-buchholz, -sonneborn_berger, -head_to_head, -score))
+    is_new_place = np.any(np.diff(keys[order], axis=0) != 0, axis=1)
+    places = np.concatenate([[1], 1 + np.cumsum(is_new_place)])
+
+    agents = models.Agent.objects.in_bulk(agent_ids)
+
+    return [
+        models.TournamentResult(
+            agent=agents[agent_ids[index]],
+            score=Decimal(str(score[index])),
+            wins=int(wins[index]),
+            loses=int(loses[index]),
+            draws=int(draws[index]),
+            place=int(place),
+            head_to_head=float(head_to_head[index]),
+            sonneborn_berger=float(sonneborn_berger[index]),
+            buchholz=float(buchholz[index]),
+        )
+        for index, place in zip(order, places)
+    ]
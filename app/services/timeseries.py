@@ -0,0 +1,141 @@
+"""
+Time series used by the charts. The same data feeds both the server rendered
+plots and the json endpoints, so the pages can render the charts client side.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.utils import timezone
+
+from app import models
+from app.services import match_counters
+
+
+def matches_per_minute(start_date=None, end_date=None):
+    """
+    Returns the number of matches played per minute between `start_date` and
+    `end_date`, defaulting to the last 24 hours. Minutes without matches are
+    filled with zeros, so the series is always dense.
+    """
+    end_date = end_date or timezone.now()
+    start_date = start_date or end_date - timedelta(days=1)
+
+    return match_counters.series(start_date, end_date)
+
+
+def agent_elo(agent, season):
+    """
+    Returns the elo of `agent` after each match it played in `season`
+    """
+    elo_key = f"data__elo_after__{agent.id}"
+
+    data = (
+        agent.matches.filter(ran=True, season=season)
+        .values("ran_at", elo_key)
+        .order_by("ran_at")
+    )
+
+    # It is possible to have a match where we, for some reason, didn't
+    # calculate the elo change. In that case we just skip it Null values.
+    # The system should pick that up automatically to reevaluate
+    x = [d["ran_at"] for d in data if d[elo_key] is not None]
+    y = [d[elo_key] for d in data if d[elo_key] is not None]
+
+    return x, y
+
+
+def game_season_elo(game, season):
+    """
+    Returns the elo series of every agent from `game` in `season`, ordered by
+    their current elo. The whole season is fetched in a single query, instead
+    of one query per agent.
+    """
+    agent_ratings = (
+        models.AgentRatings.objects.filter(game=game, season=season)
+        .select_related("agent")
+        .order_by("-elo")
+    )
+
+    matches = (
+        models.Match.objects.filter(ran=True, game=game, season=season)
+        .values_list("ran_at", "player1_id", "player2_id", "data__elo_after")
+        .order_by("ran_at")
+    )
+
+    xs = defaultdict(list)
+    ys = defaultdict(list)
+    for ran_at, player1_id, player2_id, elo_after in matches:
+        if not elo_after:
+            continue
+
+        for player_id in (player1_id, player2_id):
+            elo = elo_after.get(str(player_id))
+            if elo is None:
+                continue
+
+            xs[player_id].append(ran_at)
+            ys[player_id].append(elo)
+
+    return [
+        (agent_rating.agent, xs[agent_rating.agent_id], ys[agent_rating.agent_id])
+        for agent_rating in agent_ratings
+    ]
+
+
+def moving_average(values, window):
+    """
+    Trailing moving average of `values`. The first points use as many points
+    as available, so the output has the same length as the input.
+    """
+    if window <= 1:
+        return list(values)
+
+    result = []
+    running_sum = 0
+
+    for index, value in enumerate(values):
+        running_sum += value
+
+        if index >= window:
+            running_sum -= values[index - window]
+
+        result.append(running_sum / min(index + 1, window))
+
+    return result
+
+
+def downsample(x, y, n_points):
+    """
+    Reduces a series to at most `n_points` by averaging consecutive buckets
+    of points. Each bucket is represented by the timestamp of its first point.
+    """
+    if n_points <= 0 or len(x) <= n_points:
+        return list(x), list(y)
+
+    bucket_size = len(x) / n_points
+    x_ = []
+    y_ = []
+
+    for bucket in range(n_points):
+        start = int(bucket * bucket_size)
+        end = int((bucket + 1) * bucket_size)
+        values = y[start:end]
+
+        x_.append(x[start])
+        y_.append(sum(values) / len(values))
+
+    return x_, y_
+
+
+def to_columnar(x, y, *, window=1, n_points=0):
+    """
+    Applies the moving average and the downsampling to a series, and packs it
+    as compact columnar arrays: unix timestamps and values.
+    """
+    y = moving_average(y, window)
+    x, y = downsample(x, y, n_points)
+
+    return {
+        "t": [int(point.timestamp()) for point in x],
+        "v": [round(float(point), 2) for point in y],
+    }
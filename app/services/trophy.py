@@ -1,12 +1,11 @@
 import logging
-from collections import defaultdict
 
 from django.conf import settings
-from django.db import IntegrityError
-from django.db.models import Count
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
 
-from app import tasks
-from app.models import SeasonTrophies, Tournament, Trophy
+from app.models import AgentRatings, SeasonTrophies, Trophy
+from app.services import pairings, standings
 
 
 logging.config.dictConfig(settings.LOGGING)
@@ -28,24 +27,38 @@ TROPHY_TYPE_TO_PLACE = {
 
 
 def trophies_for_season(season):
-    data = {}
-
-    for trophy in season.trophies.all():
-        if trophy.agent_id not in data.keys():
-            data[trophy.agent_id] = SeasonTrophies(trophy.agent)
-            data[trophy.agent_id].elo = trophy.agent.ratings.get(season=season).elo
-
-        match trophy.type:
-            case "FIRST":
-                data[trophy.agent_id].first_places += 1
-            case "SECOND":
-                data[trophy.agent_id].second_places += 1
-            case "THIRD":
-                data[trophy.agent_id].third_places += 1
-
-    rankings = sorted((data.values()), reverse=True, key=lambda t: t.elo)
+    """
+    Returns how many trophies of each type each agent won on `season`,
+    together with its elo on the season, ordered by elo. A single grouped
+    query.
+    """
+    elo = AgentRatings.objects.filter(agent=OuterRef("agent_id"), season=season).values(
+        "elo"
+    )[:1]
+
+    rows = (
+        season.trophies.values("agent_id", "agent__name", "agent__game_id")
+        .annotate(
+            first_places=Count("id", filter=Q(type="FIRST")),
+            second_places=Count("id", filter=Q(type="SECOND")),
+            third_places=Count("id", filter=Q(type="THIRD")),
+            elo=Subquery(elo),
+        )
+        .order_by(F("elo").desc(nulls_last=True))
+    )
 
-    return rankings
+    return [
+        SeasonTrophies(
+            agent_id=row["agent_id"],
+            agent_name=row["agent__name"],
+            game_id=row["agent__game_id"],
+            first_places=row["first_places"],
+            second_places=row["second_places"],
+            third_places=row["third_places"],
+            elo=row["elo"],
+        )
+        for row in rows
+    ]
 
 
 def trophies_for_agent(agent):
@@ -76,61 +89,50 @@ def create_trophies(tournament):
     if tournament.pending_matches_count > 0:
         raise ValueError(f"Complete tournament {tournament.id} has pending matches")
 
-    if tournament.trophies.count() > 0:
-        logger.warning(
-            f"Tournament {tournament.id} had {tournament.trophies.count()} trophies. Recreating them"
+    if tournament.mode == "KNOCKOUT":
+        placings = pairings.knockout_placings(tournament).items()
+    else:
+        placings = [
+            (result.agent.id, result.place) for result in standings.ranked(tournament)
+        ]
+
+    trophies = [
+        Trophy(
+            agent_id=agent_id,
+            game_id=tournament.game_id,
+            season_id=tournament.season_id,
+            tournament=tournament,
+            type=PLACE_TO_TROPHY_TYPE[place],
         )
-        tournament.trophies.all().delete()
-
-    results = tournament.ratings
-    top_3_scores = sorted(
-        list(set([result.score for result in set(results)])), reverse=True
-    )[:3]
-    rankings = defaultdict(list)
-
-    for result in results:
-        rankings[result.score].append(result.agent)
-
-    for place, score in enumerate(top_3_scores):
-        trophy_type = PLACE_TO_TROPHY_TYPE[place + 1]
-
-        for agent in rankings[score]:
-            try:
-                Trophy.objects.create(
-                    agent=agent,
-                    game=tournament.game,
-                    season=tournament.season,
-                    tournament=tournament,
-                    type=trophy_type,
-                )
-            except IntegrityError as e:
-                logger.warning(
-                    f"failed to generate trophy for {agent.id=} {tournament.id=} with error: {e}"
-                )
-
+        for agent_id, place in placings
+        if place in PLACE_TO_TROPHY_TYPE
+    ]
+
+    with transaction.atomic():
+        deleted, _ = tournament.trophies.all().delete()
+        if deleted:
+            logger.warning(
+                f"Tournament {tournament.id} had {deleted} trophies. Recreating them"
+            )
 
-def backfill_missing_trophies():
-    tournaments = (
-        Tournament.objects.filter(done=True)
-        .annotate(stuff=Count("trophies__id"))
-        .only("id")
-        .filter(stuff=0)
-    )
+        Trophy.objects.bulk_create(trophies, ignore_conflicts=True)
 
-    count = tournaments.count()
 
-    print(f"backfilling {count} tournaments with trophies")
+def backfill_missing_trophies():
+    """
+    Creates the trophies of finished tournaments that have none, as a bulk
+    job. Returns the job id.
+    """
+    from app.services import bulk_jobs
 
-    for index, tournament in enumerate(tournaments):
-        try:
-            create_trophies(tournament)
-            print(f"{index} / {count} : {tournament.id=}")
-        except ValueError as e:
-            print(
-                f"failed to create trophies for tournament {tournament} with error: {e}"
-            )
+    return bulk_jobs.start("backfill_trophies")
 
 
 def regen_all_trophies():
-    for tournament in Tournament.objects.filter(done=True).only("id").iterator():
-        tasks.create_trophies.delay(tournament.id)
+    """
+    Recreates the trophies of every finished tournament, as a bulk job.
+    Returns the job id.
+    """
+    from app.services import bulk_jobs
+
+    return bulk_jobs.start("regen_trophies")
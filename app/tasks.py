@@ -1,18 +1,142 @@
+import functools
 import logging
+import threading
+import uuid
+from time import sleep, time
 
 from django.conf import settings
 from django.utils import timezone
 from django_redis import get_redis_connection
+from redis.exceptions import RedisError, WatchError
 
-from app import metrics, models, services
+from app import constants, metrics, models, services
 from app.celery import app as celery
-from app.services import automated_seasons, automated_tournaments, match_queue
+from app.celery import queue_depths
+from app.services import (
+    automated_seasons,
+    automated_tournaments,
+    bulk_jobs,
+    lifecycle,
+    match_counters,
+    match_queue,
+    season_archive,
+    season_summary,
+    site_stats,
+)
 
 
 logging.config.dictConfig(settings.LOGGING)
 logger = logging.getLogger("TASKS")
 
 
+class TaskLock:
+    """
+    A lock on redis, held with a lease that expires on its own if the holder
+    dies. Only the holder can renew or release it. Uses plain commands and
+    optimistic transactions, no lua scripts.
+    """
+
+    def __init__(self, name, lease):
+        self.key = f"{settings.TASK_LOCK_KEY}:{name}"
+        self.lease = lease
+        self.token = uuid.uuid4().hex
+        self.redis = get_redis_connection("default")
+
+    def acquire(self, wait=0):
+        deadline = time() + wait
+        while True:
+            if self.redis.set(self.key, self.token, nx=True, px=int(self.lease * 1000)):
+                return True
+
+            if time() >= deadline:
+                return False
+
+            sleep(0.1)
+
+    def _if_held(self, command):
+        with self.redis.pipeline() as pipeline:
+            try:
+                pipeline.watch(self.key)
+                if pipeline.get(self.key) != self.token.encode():
+                    return False
+
+                pipeline.multi()
+                command(pipeline)
+                pipeline.execute()
+                return True
+            except WatchError:
+                return False
+
+    def renew(self):
+        return self._if_held(
+            lambda pipeline: pipeline.pexpire(self.key, int(self.lease * 1000))
+        )
+
+    def release(self):
+        return self._if_held(lambda pipeline: pipeline.delete(self.key))
+
+
+def single_instance(lease=constants.ONE_MINUTE, wait=0):
+    """
+    Makes sure only one instance of the decorated task runs at a time, across
+    all workers. If another instance holds the lock, waits up to `wait`
+    seconds for it and then skips the run. The lock is renewed every third of
+    its `lease` while the task runs, so long runs keep it, but it expires if
+    the worker dies.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            name = func.__name__
+            lock = TaskLock(name, lease)
+
+            t_start = time()
+            try:
+                acquired = lock.acquire(wait)
+            except RedisError:
+                logger.exception(f"failed to acquire the lock for {name}, skipping")
+                return None
+
+            metrics.register_task_lock(name, time() - t_start, acquired)
+
+            if not acquired:
+                logger.info(f"{name} is already running, skipping")
+                return None
+
+            stop = threading.Event()
+
+            def renew():
+                while not stop.wait(lease / 3):
+                    try:
+                        if lock.renew():
+                            continue
+                    except RedisError:
+                        logger.exception(f"failed to renew the lock for {name}")
+                        continue
+
+                    logger.warning(f"lost the lock for {name} while running")
+                    return
+
+            renewal = threading.Thread(target=renew, daemon=True)
+            renewal.start()
+
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stop.set()
+                renewal.join()
+
+                try:
+                    lock.release()
+                except RedisError:
+                    logger.exception(f"failed to release the lock for {name}")
+
+        return wrapper
+
+    return decorator
+
+
 @celery.task
 def _push_metric(data):
     from app import metrics
@@ -28,6 +152,7 @@ def push_metric(data):
 
 
 @celery.task
+@single_instance()
 def automated_manager():
     """
     Creates things automatically
@@ -35,12 +160,30 @@ def automated_manager():
     automated_seasons.update_seasons_state()
     automated_seasons.create_automated_seasons()
     automated_tournaments.create_automated_tournaments()
+    lifecycle.schedule_due_transitions()
 
-    for tournament in models.Tournament.objects.filter(done=False):
-        services.update_tournament_state(tournament)
+    services.update_open_tournaments()
 
 
 @celery.task
+def update_season_state(season_id):
+    season = models.Season.objects.filter(id=season_id).first()
+    if season is None:
+        return
+
+    automated_seasons.update_season_state(season)
+
+
+@celery.task
+def update_tournament_state(tournament_id):
+    """
+    Updates a single tournament, if its state can change
+    """
+    services.update_tournament_state_locked(tournament_id)
+
+
+@celery.task
+@single_instance()
 def metrics_logger():
     """
     Periodically collect and send some metrics to influxdb
@@ -53,6 +196,16 @@ def metrics_logger():
         }
     )
 
+    for queue, depth in queue_depths().items():
+        metrics.push_metric(
+            {
+                "fields": {"value": depth},
+                "measurement": "celery_queue_depth",
+                "tags": {"queue": queue},
+                "time": timezone.now().isoformat(),
+            }
+        )
+
     unplayed_matches_count = models.Match.objects.filter(ran=False).count()
     metrics.push_metric(
         {
@@ -102,11 +255,36 @@ def metrics_logger():
 
 
 @celery.task
+@single_instance()
 def regenerate_queue():
     match_queue.regenerate_queue()
 
 
 @celery.task
+def reconcile_match_counters():
+    match_counters.reconcile()
+
+
+@celery.task
+@single_instance()
+def refresh_site_stats():
+    site_stats.refresh_snapshot()
+
+
+@celery.task
+@single_instance()
+def refresh_season_summaries():
+    season_summary.refresh_active()
+
+
+@celery.task
+@single_instance()
+def archive_seasons():
+    season_archive.archive_ended()
+
+
+@celery.task
+@single_instance()
 def heartbeat():
     """
     Simple heart beat for celery. Stores the time at which this function runs
@@ -117,6 +295,25 @@ def heartbeat():
     redis.set(heartbeat_key, timezone.now().isoformat())
 
 
+@celery.task
+def run_bulk_job(job_id):
+    """
+    Processes the next chunk of a bulk job, then queues the one after it
+    """
+    lock = TaskLock(f"bulk_job:{job_id}", constants.TEN_MINUTES)
+    if not lock.acquire():
+        logger.info(f"bulk job {job_id} is already running a chunk, skipping")
+        return
+
+    try:
+        has_more = bulk_jobs.run_chunk(job_id)
+    finally:
+        lock.release()
+
+    if has_more:
+        run_bulk_job.delay(job_id)
+
+
 @celery.task
 def create_trophies(tournament_id):
     tournament = models.Tournament.objects.get(id=tournament_id)
@@ -1,10 +1,14 @@
 from datetime import timedelta
 
-from django.test import TestCase
+from django.conf import settings
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
+from django_redis import get_redis_connection
 from freezegun import freeze_time
 
-from app import factories, models
+from app import factories, loaders, models, season_resolver
 
 
 class AgentTestCase(TestCase):
@@ -19,6 +23,47 @@ class AgentTestCase(TestCase):
         agent = factories.AgentFactory()
         self.assertEqual(agent.games_played_count, 0)
 
+    def test_current_ratings_without_ratings(self):
+        agent = factories.AgentFactory()
+
+        self.assertEqual(agent.elo, 1500)
+        self.assertFalse(models.AgentRatings.objects.filter(agent=agent).exists())
+        self.assertEqual(agent.current_ratings.season_id, season_resolver.current_id())
+
+    def test_loader_does_not_remember_missing_ratings(self):
+        season = models.Season.objects.get()
+        agent = factories.AgentFactory()
+
+        with loaders.ratings_loader() as loader:
+            self.assertIsNone(loader.get(agent.id))
+
+            models.AgentRatings.objects.create(
+                agent=agent, game=agent.game, season=season, elo=1600
+            )
+
+            self.assertEqual(loader.get(agent.id).elo, 1600)
+
+    @override_settings(CURRENT_SEASON_CACHE_ENABLED=True)
+    def test_current_ratings_are_batched(self):
+        season = models.Season.objects.get()
+        for _ in range(5):
+            agent = factories.AgentFactory()
+            models.AgentRatings.objects.create(
+                agent=agent, game=agent.game, season=season, elo=1600
+            )
+
+        # The current season is resolved once per process, not per request
+        season_resolver.clear()
+        self.addCleanup(season_resolver.clear)
+        season_resolver.current()
+
+        with loaders.ratings_loader():
+            agents = list(models.Agent.objects.all())
+            with self.assertNumQueries(1):
+                elos = [agent.elo for agent in agents]
+
+        self.assertEqual(elos, [1600] * 5)
+
 
 class MatchTestCase(TestCase):
     def setUp(self):
@@ -69,3 +114,134 @@ class TournamentTestCase(TestCase):
         self.assertEqual(
             models.Match.objects.filter(tournament_id=tournament.id).count(), 10
         )
+        self.assertEqual(
+            models.Match.participants.through.objects.filter(
+                match__tournament_id=tournament.id
+            ).count(),
+            20,
+        )
+
+        # Each round has 2 matches, with the fifth agent sitting out
+        for round in range(1, 6):
+            self.assertEqual(tournament.matches.filter(round=round).count(), 2)
+
+    def test_matches_are_queued_on_commit(self):
+        redis = get_redis_connection("default")
+        redis.delete(settings.MATCH_QUEUE_KEY)
+
+        tournament = factories.TournamentFactory(mode="ROUND_ROBIN")
+        tournament.participants.set([factories.AgentFactory() for _ in range(3)])
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            tournament.create_matches()
+
+        self.assertEqual(redis.llen(settings.MATCH_QUEUE_KEY), 0)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(redis.llen(settings.MATCH_QUEUE_KEY), 3)
+
+    def test_add_participants(self):
+        game = factories.GameFactory()
+        agents = [factories.AgentFactory(game=game) for _ in range(5)]
+        tournament = factories.TournamentFactory(mode="DOUBLE_ROUND_ROBIN", game=game)
+        tournament.participants.set(agents[:4])
+        tournament.create_matches()
+
+        old_match_ids = set(tournament.matches.values_list("id", flat=True))
+        last_round = tournament.current_round
+
+        tournament.add_participants(agents[4], agents[0])
+
+        self.assertEqual(tournament.participants.count(), 5)
+        self.assertEqual(tournament.matches.count(), 20)
+
+        new_matches = tournament.matches.exclude(id__in=old_match_ids)
+        self.assertEqual(new_matches.count(), 8)
+        self.assertFalse(new_matches.filter(round__lte=last_round).exists())
+        for match in new_matches:
+            self.assertIn(agents[4].id, [match.player1_id, match.player2_id])
+
+    def test_add_participants_to_knockout(self):
+        game = factories.GameFactory()
+        agents = [factories.AgentFactory(game=game) for _ in range(3)]
+        tournament = factories.TournamentFactory(mode="KNOCKOUT", game=game)
+        tournament.participants.set(agents[:2])
+        tournament.create_matches()
+
+        tournament.add_participants(agents[2])
+        self.assertEqual(tournament.participants.count(), 2)
+
+    def test_create_matches_queries(self):
+        def _create_matches(n_agents):
+            tournament = factories.TournamentFactory(mode="DOUBLE_ROUND_ROBIN")
+            tournament.participants.set(
+                [factories.AgentFactory() for _ in range(n_agents)]
+            )
+
+            with CaptureQueriesContext(connection) as context:
+                tournament.create_matches()
+
+            return len(context)
+
+        self.assertEqual(_create_matches(3), _create_matches(12))
+
+
+@override_settings(CURRENT_SEASON_CACHE_ENABLED=True)
+class SeasonResolverTestCase(TestCase):
+    def setUp(self):
+        models.Season.objects.all().delete()
+        get_redis_connection("default").delete(settings.CURRENT_SEASON_VERSION_KEY)
+        season_resolver.clear()
+        self.addCleanup(season_resolver.clear)
+
+    def test_current_is_cached(self):
+        season = factories.SeasonFactory()
+
+        self.assertEqual(season_resolver.current(), season)
+        with self.assertNumQueries(0):
+            self.assertEqual(season_resolver.current_id(), season.id)
+
+    def test_no_current_season(self):
+        factories.SeasonFactory(active=False)
+        factories.SeasonFactory(main=False)
+
+        self.assertIsNone(season_resolver.current())
+        self.assertIsNone(season_resolver.current_id())
+
+    def test_saving_a_season_bumps_the_version(self):
+        season = factories.SeasonFactory()
+        self.assertEqual(season_resolver.current(), season)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            season.active = False
+            season.save()
+
+        self.assertIsNone(season_resolver.current())
+
+    def test_other_processes_see_the_new_version(self):
+        season = factories.SeasonFactory()
+        self.assertEqual(season_resolver.current(), season)
+
+        # Another process deletes the season, which only changes the version
+        # as far as this one is concerned
+        models.Season.objects.filter(id=season.id).delete()
+        self.assertEqual(season_resolver.current(), season)
+        get_redis_connection("default").incr(settings.CURRENT_SEASON_VERSION_KEY)
+
+        self.assertIsNone(season_resolver.current())
+
+    def test_version_is_bumped_on_commit(self):
+        season = factories.SeasonFactory()
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            season.delete()
+
+        self.assertIsNone(
+            get_redis_connection("default").get(settings.CURRENT_SEASON_VERSION_KEY)
+        )
+        for callback in callbacks:
+            callback()
+        self.assertEqual(
+            get_redis_connection("default").get(settings.CURRENT_SEASON_VERSION_KEY),
+            b"1",
+        )
@@ -1,17 +1,38 @@
+import json
+import shutil
+import tempfile
 from datetime import timedelta
 from decimal import Decimal
+from unittest import mock
 
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
 from django.test import TestCase
+from django.utils import timezone
+from django_redis import get_redis_connection
 from freezegun import freeze_time
 
-from app import factories, models, services
+from app import constants, factories, models, services, tasks
 from app.services import (
     automated_seasons,
     automated_tournaments,
+    bulk_jobs,
+    leaderboard,
+    lifecycle,
+    match_counters,
     match_queue,
+    pairings,
     ratings,
+    season_archive,
+    season_summary,
+    site_stats,
+    standings,
+    timeseries,
     trophy,
 )
+from app.services.elo import compute_expected_result
 
 
 class RatingsServiceTestCase(TestCase):
@@ -25,6 +46,10 @@ class RatingsServiceTestCase(TestCase):
         )
         self.agent1 = factories.AgentFactory(game=self.game)
         self.agent2 = factories.AgentFactory(game=self.game)
+        ratings.provision_ratings(
+            self.season.id,
+            [(self.agent1.id, self.game.id), (self.agent2.id, self.game.id)],
+        )
         self.match1 = factories.MatchFactory(
             player1=self.agent1,
             player2=self.agent2,
@@ -64,6 +89,215 @@ class RatingsServiceTestCase(TestCase):
         self.assertEqual(self.agent2.elo, Decimal("1501"))
 
 
+class ProvisionRatingsTestCase(TestCase):
+    def setUp(self):
+        models.Season.objects.all().delete()
+
+        self.game = factories.GameFactory()
+        self.previous_season = factories.SeasonFactory(
+            active=False,
+            start_date=timezone.now() - timedelta(days=14),
+            end_date=timezone.now() - timedelta(days=7),
+        )
+        self.season = factories.SeasonFactory(
+            start_date=timezone.now() - timedelta(days=7),
+            end_date=timezone.now() + timedelta(days=7),
+        )
+        self.agent1 = factories.AgentFactory(game=self.game)
+        self.agent2 = factories.AgentFactory(game=self.game)
+        self.inactive_agent = factories.AgentFactory(game=self.game, active=False)
+
+        models.AgentRatings.objects.create(
+            agent=self.agent1, game=self.game, season=self.previous_season, elo=1700
+        )
+
+    def _elos(self):
+        return dict(self.season.ratings.values_list("agent_id", "elo"))
+
+    def test_reset(self):
+        ratings.provision_season(self.season, policy="reset")
+
+        self.assertEqual(
+            self._elos(), {self.agent1.id: Decimal(1500), self.agent2.id: Decimal(1500)}
+        )
+
+    def test_carry_over(self):
+        ratings.provision_season(self.season, policy="carry_over")
+
+        self.assertEqual(
+            self._elos(), {self.agent1.id: Decimal(1700), self.agent2.id: Decimal(1500)}
+        )
+
+    def test_regress(self):
+        ratings.provision_season(self.season, policy="regress")
+
+        self.assertEqual(
+            self._elos(), {self.agent1.id: Decimal(1600), self.agent2.id: Decimal(1500)}
+        )
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            ratings.provision_season(self.season, policy="nope")
+
+    def test_season_without_dates(self):
+        season = factories.SeasonFactory(name="api", start_date=None, end_date=None)
+
+        for policy in ("carry_over", "regress"):
+            ratings.provision_season(season, policy=policy)
+
+        self.assertEqual(season.ratings.count(), 2)
+
+    def test_existing_ratings_are_kept(self):
+        models.AgentRatings.objects.create(
+            agent=self.agent2, game=self.game, season=self.season, elo=1234, wins=3
+        )
+
+        with self.assertNumQueries(1):
+            ratings.provision_ratings(
+                self.season.id,
+                [(self.agent1.id, self.game.id), (self.agent2.id, self.game.id)],
+            )
+
+        rating = self.agent2.ratings.get(season=self.season)
+        self.assertEqual(rating.elo, 1234)
+        self.assertEqual(rating.wins, 3)
+        self.assertEqual(self.season.ratings.count(), 2)
+
+    def test_creating_matches_provisions_ratings(self):
+        tournament = factories.TournamentFactory(game=self.game, season=self.season)
+        tournament.participants.add(self.agent1, self.inactive_agent)
+
+        tournament.create_matches()
+
+        self.assertEqual(set(self._elos()), {self.agent1.id, self.inactive_agent.id})
+
+
+class LeaderboardTestCase(TestCase):
+    def setUp(self):
+        models.Season.objects.all().delete()
+
+        self.game = factories.GameFactory()
+        self.season = factories.SeasonFactory()
+        self.tournament = factories.TournamentFactory(
+            game=self.game, season=self.season
+        )
+        self.agent1 = factories.AgentFactory(game=self.game)
+        self.agent2 = factories.AgentFactory(game=self.game)
+        self.agent3 = factories.AgentFactory(game=self.game, active=False)
+
+        for agent, elo in [
+            (self.agent1, 1400),
+            (self.agent2, 1600),
+            (self.agent3, 1700),
+        ]:
+            models.AgentRatings.objects.create(
+                agent=agent, game=self.game, season=self.season, elo=elo
+            )
+
+        leaderboard.rebuild(self.season, self.game)
+
+    def test_top(self):
+        entries = leaderboard.top(self.game)
+
+        self.assertEqual(
+            [entry.id for entry in entries], [str(self.agent2.id), str(self.agent1.id)]
+        )
+        self.assertEqual(entries[0].elo, Decimal("1600"))
+        self.assertEqual(entries[0].rank, 2)
+        self.assertEqual(entries[0].owner_username, self.agent2.owner.username)
+
+    def test_top_with_inactive(self):
+        entries = leaderboard.top(self.game, active_only=False)
+        self.assertEqual(len(entries), 3)
+
+    def test_top_limit_skips_inactive(self):
+        entries = leaderboard.top(self.game, limit=2)
+
+        self.assertEqual(
+            [entry.id for entry in entries], [str(self.agent2.id), str(self.agent1.id)]
+        )
+
+    def test_rank(self):
+        self.assertEqual(leaderboard.rank(self.agent3), 1)
+        self.assertEqual(leaderboard.rank(self.agent2), 2)
+        self.assertEqual(leaderboard.rank(self.agent1), 3)
+
+    def test_updated_on_rating_change(self):
+        match = factories.MatchFactory(
+            player1=self.agent1,
+            player2=self.agent2,
+            season=self.season,
+            tournament=self.tournament,
+            game=self.game,
+            result=1,
+            ran=True,
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            ratings.update_ratings_from_match(match)
+
+        entries = leaderboard.entries_for_agents(
+            self.game, [self.agent1.id, self.agent2.id]
+        )
+
+        self.assertEqual(entries[0].id, str(self.agent2.id))
+        self.assertEqual(entries[0].loses, 1)
+        self.assertEqual(entries[1].wins, 1)
+        self.assertGreater(entries[1].elo, Decimal("1400"))
+
+    def test_not_updated_on_rollback(self):
+        match = factories.MatchFactory(
+            player1=self.agent1,
+            player2=self.agent2,
+            season=self.season,
+            tournament=self.tournament,
+            game=self.game,
+            result=1,
+            ran=True,
+        )
+        with self.captureOnCommitCallbacks() as callbacks:
+            ratings.update_ratings_from_match(match)
+
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(leaderboard.top(self.game)[1].wins, 0)
+
+    def test_provisioned_agents_are_added(self):
+        agent = factories.AgentFactory(game=self.game)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ratings.provision_ratings(self.season.id, [(agent.id, self.game.id)])
+
+        self.assertEqual(len(leaderboard.top(self.game)), 3)
+
+    def test_updates_skip_missing_leaderboards(self):
+        redis = get_redis_connection("default")
+        redis.delete(leaderboard._leaderboard_key(self.season.id, self.game.id))
+        agent = factories.AgentFactory(game=self.game)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ratings.provision_ratings(self.season.id, [(agent.id, self.game.id)])
+
+        self.assertFalse(
+            redis.exists(leaderboard._leaderboard_key(self.season.id, self.game.id))
+        )
+        self.assertEqual(len(leaderboard.top(self.game)), 3)
+
+    def test_rebuilds_missing_leaderboard(self):
+        redis = get_redis_connection("default")
+        redis.delete(leaderboard._leaderboard_key(self.season.id, self.game.id))
+
+        self.assertEqual(len(leaderboard.top(self.game)), 2)
+
+    def test_rebuilds_expired_agent_stats(self):
+        redis = get_redis_connection("default")
+        redis.delete(leaderboard._stats_key(self.season.id, self.agent1.id))
+
+        entries = leaderboard.top(self.game)
+
+        self.assertEqual(
+            [entry.id for entry in entries], [str(self.agent2.id), str(self.agent1.id)]
+        )
+
+
 class UpdateSeasonStatesTestCase(TestCase):
     def test_update(self):
         with freeze_time("2021-05-01"):
@@ -85,6 +319,78 @@ class UpdateSeasonStatesTestCase(TestCase):
             self.assertEqual(models.Season.objects.filter(active=True).count(), 0)
 
 
+class LifecycleTestCase(TestCase):
+    def test_schedules_season_transitions(self):
+        season = factories.SeasonFactory(
+            start_date=timezone.now() + timedelta(minutes=10),
+            end_date=timezone.now() + timedelta(minutes=20),
+        )
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            lifecycle.schedule_season_transitions(season)
+        self.assertEqual(len(callbacks), 2)
+
+        season.start_date = timezone.now() - timedelta(hours=1)
+        with self.captureOnCommitCallbacks() as callbacks:
+            lifecycle.schedule_season_transitions(season)
+        self.assertEqual(len(callbacks), 1)
+
+    def test_transitions_beyond_the_horizon_wait_for_the_poll(self):
+        season = factories.SeasonFactory(
+            start_date=timezone.now() - timedelta(days=1),
+            end_date=timezone.now() + timedelta(days=7),
+        )
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            lifecycle.schedule_season_transitions(season)
+        self.assertEqual(len(callbacks), 0)
+
+        with freeze_time(season.end_date - timedelta(minutes=10)):
+            with self.captureOnCommitCallbacks() as callbacks:
+                lifecycle.schedule_due_transitions()
+        self.assertEqual(len(callbacks), 1)
+
+    def test_only_timed_tournaments_are_scheduled(self):
+        season = factories.SeasonFactory()
+        tournament = factories.TournamentFactory(
+            season=season,
+            start_date=timezone.now() + timedelta(minutes=10),
+            end_date=timezone.now() + timedelta(minutes=20),
+        )
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            lifecycle.schedule_tournament_transitions(tournament)
+        self.assertEqual(len(callbacks), 0)
+
+        tournament.mode = "TIMED"
+        with self.captureOnCommitCallbacks() as callbacks:
+            lifecycle.schedule_tournament_transitions(tournament)
+        self.assertEqual(len(callbacks), 2)
+
+    def test_timed_tournaments_wait_for_their_start(self):
+        season = factories.SeasonFactory()
+        tournament = factories.TournamentFactory(
+            season=season,
+            mode="TIMED",
+            start_date=timezone.now() + timedelta(hours=1),
+            end_date=timezone.now() + timedelta(days=1),
+        )
+        tournament.participants.set(
+            [factories.AgentFactory(game=tournament.game) for _ in range(2)]
+        )
+
+        tasks.update_tournament_state(tournament.id)
+        tournament.refresh_from_db()
+
+        self.assertFalse(tournament.done)
+        self.assertEqual(tournament.matches.count(), 0)
+
+        with freeze_time(timezone.now() + timedelta(hours=2)):
+            tasks.update_tournament_state(tournament.id)
+
+        self.assertGreater(tournament.matches.count(), 0)
+
+
 class CreateAutomatedSeasonsTestCase(TestCase):
     def setUp(self):
         self.game = factories.GameFactory()
@@ -133,6 +439,182 @@ class MatchQueueTestCase(TestCase):
         match_queue.regenerate_queue()
 
 
+class UpdateOpenTournamentsTestCase(TestCase):
+    def setUp(self):
+        self.season = factories.SeasonFactory()
+        self.game = factories.GameFactory()
+        self.agents = [factories.AgentFactory(game=self.game) for _ in range(3)]
+
+    def _create_tournament(self, **kwargs):
+        tournament = factories.TournamentFactory(
+            game=self.game, season=self.season, **kwargs
+        )
+        tournament.participants.set(self.agents)
+        return tournament
+
+    def test_skips_tournaments_with_pending_matches(self):
+        for _ in range(5):
+            self._create_tournament()
+
+        services.update_open_tournaments()
+        self.assertEqual(models.Match.objects.filter(ran=False).count(), 15)
+
+        # Nothing can change until matches are played, so only the
+        # annotated query runs
+        with self.assertNumQueries(1):
+            services.update_open_tournaments()
+
+    def test_finishes_tournaments(self):
+        tournament = self._create_tournament()
+        services.update_open_tournaments()
+
+        tournament.matches.update(ran=True, ran_at=timezone.now(), result=1)
+        services.update_open_tournaments()
+        tournament.refresh_from_db()
+
+        self.assertTrue(tournament.done)
+        self.assertEqual(tournament.trophies.count(), 3)
+
+    def test_creates_trophies_once_timed_matches_are_played(self):
+        tournament = self._create_tournament(
+            mode="TIMED",
+            start_date=timezone.now() - timedelta(hours=2),
+            end_date=timezone.now() - timedelta(hours=1),
+            done=True,
+        )
+        factories.MatchFactory(
+            player1=self.agents[0],
+            player2=self.agents[1],
+            season=self.season,
+            tournament=tournament,
+            game=self.game,
+            result=1,
+            ran=True,
+        )
+
+        services.update_open_tournaments()
+
+        self.assertEqual(tournament.trophies.count(), 2)
+
+        with self.assertNumQueries(1):
+            services.update_open_tournaments()
+
+    def test_skips_done_tournaments_without_trophies(self):
+        tournament = self._create_tournament(done=True)
+        factories.MatchFactory(
+            player1=self.agents[0],
+            player2=self.agents[1],
+            season=self.season,
+            tournament=tournament,
+            game=self.game,
+            result=-1,
+            ran=True,
+        )
+
+        services.update_open_tournaments()
+        tournament.refresh_from_db()
+
+        # The only match has no valid result, so nobody gets a trophy
+        self.assertFalse(tournament.trophies.exists())
+        self.assertIsNotNone(tournament.finalized_at)
+
+        with self.assertNumQueries(1):
+            services.update_open_tournaments()
+
+
+class CancelAgentMatchesTestCase(TestCase):
+    def setUp(self):
+        get_redis_connection("default").delete(settings.MATCH_QUEUE_KEY)
+
+        self.season = factories.SeasonFactory()
+        self.game = factories.GameFactory()
+        self.agents = [factories.AgentFactory(game=self.game) for _ in range(4)]
+
+        self.tournament = factories.TournamentFactory(
+            game=self.game, season=self.season
+        )
+        self.tournament.participants.set(self.agents)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tournament.create_matches()
+
+    def _drain_queue(self):
+        match_ids = []
+        while match_id := match_queue.get_next():
+            match_ids.append(match_id)
+
+        return match_ids
+
+    def test_index(self):
+        redis = get_redis_connection("default")
+        self.assertEqual(redis.scard(match_queue._agent_key(self.agents[0].id)), 3)
+
+        match = self.agents[0].matches.first()
+        match_queue.remove_from_index(match)
+        self.assertEqual(redis.scard(match_queue._agent_key(self.agents[0].id)), 2)
+
+    def test_cancel_agent_matches(self):
+        agent = self.agents[0]
+        timed_match = factories.MatchFactory(
+            player1=agent,
+            player2=self.agents[1],
+            game=self.game,
+            season=self.season,
+            tournament=factories.TournamentFactory(
+                mode="TIMED", game=self.game, season=self.season
+            ),
+        )
+        match_queue.add_matches([timed_match])
+
+        match_queue.cancel_agent_matches(agent)
+
+        self.assertFalse(
+            models.Match.objects.filter(Q(player1=agent) | Q(player2=agent)).exists()
+        )
+        self.assertEqual(self.tournament.matches.count(), 3)
+
+        redis = get_redis_connection("default")
+        self.assertFalse(redis.exists(match_queue._agent_key(agent.id)))
+        self.assertEqual(redis.scard(match_queue._agent_key(self.agents[1].id)), 2)
+
+        match_ids = self._drain_queue()
+        self.assertEqual(
+            set(match_ids),
+            {
+                str(match_id)
+                for match_id in self.tournament.matches.values_list("id", flat=True)
+            },
+        )
+
+    def test_cancel_agent_matches_on_knockout(self):
+        tournament = factories.TournamentFactory(
+            mode="KNOCKOUT", game=self.game, season=self.season, best_of=3
+        )
+        tournament.participants.set(self.agents)
+        with self.captureOnCommitCallbacks(execute=True):
+            tournament.create_matches()
+
+        agent = self.agents[0]
+        tie = next(
+            tie for tie in tournament.bracket["rounds"][0] if str(agent.id) in tie
+        )
+        opponent_id = tie[1] if tie[0] == str(agent.id) else tie[0]
+
+        match_queue.cancel_agent_matches(agent)
+        tournament.refresh_from_db()
+
+        self.assertEqual(tournament.bracket["forfeits"], [str(agent.id)])
+        self.assertEqual(tournament.matches.filter(ran=False).count(), 3)
+        self.assertEqual(pairings.tie_winner(tournament, 1, tie), opponent_id)
+
+    def test_regenerate_queue_rebuilds_the_index(self):
+        redis = get_redis_connection("default")
+        redis.delete(match_queue._agent_key(self.agents[1].id))
+
+        match_queue.regenerate_queue()
+
+        self.assertEqual(redis.scard(match_queue._agent_key(self.agents[1].id)), 3)
+
+
 class TrophyTestCase(TestCase):
     def setUp(self):
         models.Season.objects.all().delete()
@@ -185,6 +667,30 @@ class TrophyTestCase(TestCase):
 
         self.assertEqual(self.tournament.trophies.count(), 3)
 
+    def test_trophies_for_season(self):
+        models.AgentRatings.objects.create(
+            agent=self.agent1, game=self.game, season=self.season, elo=1600
+        )
+        models.AgentRatings.objects.create(
+            agent=self.agent2, game=self.game, season=self.season, elo=1650
+        )
+        services.update_tournaments_state()
+
+        with self.assertNumQueries(1):
+            rankings = trophy.trophies_for_season(self.season)
+
+        # Ordered by elo, with agents without ratings last
+        self.assertEqual(
+            [row.agent_id for row in rankings],
+            [self.agent2.id, self.agent1.id, self.agent3.id],
+        )
+        self.assertEqual(rankings[0].second_places, 1)
+        self.assertEqual(rankings[0].elo, 1650)
+        self.assertEqual(rankings[1].first_places, 1)
+        self.assertEqual(rankings[2].third_places, 1)
+        self.assertIsNone(rankings[2].elo)
+        self.assertEqual(rankings[1].game_id, self.game.id)
+
     def test_trophy_regen(self):
         services.update_tournaments_state()
         self.tournament.refresh_from_db()
@@ -225,9 +731,1091 @@ class TrophyTestCase(TestCase):
         self.assertEqual(self.agent1.trophies.first().type, "FIRST")
         self.assertEqual(self.agent2.trophies.first().type, "SECOND")
         self.assertEqual(self.agent3.trophies.first().type, "THIRD")
-        self.assertEqual(self.agent4.trophies.first().type, "THIRD")
 
-        self.assertEqual(self.tournament.trophies.count(), 4)
+        # agent3 and agent4 have the same score and beat each other once, but
+        # agent3 played against stronger opponents
+        self.assertFalse(self.agent4.trophies.exists())
+
+        self.assertEqual(self.tournament.trophies.count(), 3)
+
+    def test_full_tie(self):
+        self.agent4 = factories.AgentFactory(game=self.game)
+        models.Match.objects.all().delete()
+        for a1, a2 in [
+            (self.agent1, self.agent2),
+            (self.agent1, self.agent3),
+            (self.agent1, self.agent4),
+            (self.agent2, self.agent3),
+            (self.agent3, self.agent4),
+            (self.agent4, self.agent2),
+        ]:
+            factories.MatchFactory(
+                player1=a1,
+                player2=a2,
+                season=self.season,
+                tournament=self.tournament,
+                game=self.game,
+                result=1,
+                ran=True,
+            )
+
+        self.tournament.done = True
+        self.tournament.save()
+        trophy.create_trophies(self.tournament)
+
+        # agent2, agent3 and agent4 can't be told apart by any tie-breaker
+        self.assertEqual(self.agent1.trophies.first().type, "FIRST")
+        for agent in [self.agent2, self.agent3, self.agent4]:
+            self.assertEqual(agent.trophies.first().type, "SECOND")
+
+
+class BulkJobsTestCase(TestCase):
+    def setUp(self):
+        get_redis_connection("default").delete(bulk_jobs._index_key())
+
+        self.game = factories.GameFactory()
+        self.season = factories.SeasonFactory()
+        self.agent1 = factories.AgentFactory(game=self.game)
+        self.agent2 = factories.AgentFactory(game=self.game)
+
+    def _create_tournaments(self, n_tournaments):
+        for _ in range(n_tournaments):
+            tournament = factories.TournamentFactory(
+                game=self.game, season=self.season, done=True
+            )
+            factories.MatchFactory(
+                player1=self.agent1,
+                player2=self.agent2,
+                season=self.season,
+                tournament=tournament,
+                game=self.game,
+                result=1,
+                ran=True,
+            )
+
+    def test_regen_trophies(self):
+        self._create_tournaments(3)
+
+        job_id = bulk_jobs.start("regen_trophies", chunk_size=2)
+
+        self.assertEqual(models.Trophy.objects.filter(type="FIRST").count(), 3)
+        self.assertEqual(models.Trophy.objects.filter(type="SECOND").count(), 3)
+
+        job = bulk_jobs.progress(job_id)
+        self.assertEqual(job["status"], "done")
+        self.assertEqual(job["processed"], 3)
+        self.assertEqual(job["percent"], 100.0)
+        self.assertEqual([job["id"] for job in bulk_jobs.all_jobs()], [job_id])
+
+    def test_resume(self):
+        self._create_tournaments(3)
+        job_id = bulk_jobs.start("backfill_trophies", chunk_size=1)
+
+        # Pretend the job died after its first chunk
+        first, *rest = models.Tournament.objects.order_by("id")
+        models.Trophy.objects.all().delete()
+        bulk_jobs._save(
+            get_redis_connection("default"),
+            job_id,
+            status="running",
+            cursor=json.dumps([str(first.id)]),
+            processed=1,
+        )
+
+        bulk_jobs.resume(job_id)
+
+        self.assertEqual(first.trophies.count(), 0)
+        for tournament in rest:
+            self.assertEqual(tournament.trophies.count(), 2)
+
+        self.assertEqual(bulk_jobs.progress(job_id)["processed"], 3)
+
+    def test_recalculate_ratings(self):
+        tournament = factories.TournamentFactory(game=self.game, season=self.season)
+        for agent in (self.agent1, self.agent2):
+            models.AgentRatings.objects.create(
+                agent=agent, game=self.game, season=self.season, elo=1700
+            )
+
+        self.season.active = False
+        self.season.save()
+
+        # The matches were played at the same time, so the keyset has to
+        # fall back to the id. The last one has no ran_at at all.
+        ran_at = timezone.now()
+        for result, match_ran_at in ((1, ran_at), (0, ran_at), (1, ran_at), (1, None)):
+            factories.MatchFactory(
+                player1=self.agent1,
+                player2=self.agent2,
+                season=self.season,
+                tournament=tournament,
+                game=self.game,
+                result=result,
+                ran=True,
+                ran_at=match_ran_at,
+            )
+
+        job_id = bulk_jobs.start(
+            "recalculate_ratings", {"season_id": str(self.season.id)}, chunk_size=1
+        )
+
+        self.assertEqual(bulk_jobs.progress(job_id)["processed"], 4)
+
+        rating = models.AgentRatings.objects.get(agent=self.agent1, season=self.season)
+        self.assertEqual(rating.wins, 3)
+        self.assertEqual(rating.loses, 1)
+        self.assertGreater(rating.elo, 1500)
+        self.assertLess(rating.elo, 1700)
+
+    def test_recalculate_ratings_refuses_active_seasons(self):
+        with self.assertRaises(ValueError):
+            bulk_jobs.start("recalculate_ratings", {"season_id": str(self.season.id)})
+
+
+class StandingsTestCase(TestCase):
+    def setUp(self):
+        self.season = factories.SeasonFactory()
+        self.game = factories.GameFactory()
+        self.tournament = factories.TournamentFactory(
+            game=self.game, season=self.season
+        )
+        self.agent1 = factories.AgentFactory(game=self.game)
+        self.agent2 = factories.AgentFactory(game=self.game)
+        self.agent3 = factories.AgentFactory(game=self.game)
+
+        self.matches = [
+            factories.MatchFactory(
+                player1=player1,
+                player2=player2,
+                season=self.season,
+                tournament=self.tournament,
+                game=self.game,
+                result=result,
+                ran=True,
+            )
+            for player1, player2, result in [
+                (self.agent1, self.agent2, 1),
+                (self.agent2, self.agent3, Decimal("0.5")),
+                (self.agent3, self.agent1, 0),
+            ]
+        ]
+        factories.MatchFactory(
+            player1=self.agent1,
+            player2=self.agent3,
+            season=self.season,
+            tournament=self.tournament,
+            game=self.game,
+        )
+
+    def _standings(self):
+        return {
+            standing.agent_id: (
+                standing.score,
+                standing.wins,
+                standing.loses,
+                standing.draws,
+            )
+            for standing in self.tournament.standings.all()
+        }
+
+    def test_register_match(self):
+        for match in self.matches:
+            standings.register_match(match)
+
+        self.assertEqual(
+            self._standings(),
+            {
+                self.agent1.id: (2, 2, 0, 0),
+                self.agent2.id: (Decimal("0.5"), 0, 1, 1),
+                self.agent3.id: (Decimal("0.5"), 0, 1, 1),
+            },
+        )
+
+    def test_rebuild_matches_register_match(self):
+        for match in self.matches:
+            standings.register_match(match)
+        registered = self._standings()
+
+        standings.rebuild(self.tournament)
+
+        self.assertEqual(self._standings(), registered)
+
+    def test_ranked(self):
+        self.agent4 = factories.AgentFactory(game=self.game)
+        factories.MatchFactory(
+            player1=self.agent4,
+            player2=self.agent2,
+            season=self.season,
+            tournament=self.tournament,
+            game=self.game,
+            result=1,
+            ran=True,
+        )
+
+        results = standings.ranked(self.tournament)
+
+        self.assertEqual(
+            [(result.agent, result.place) for result in results],
+            [(self.agent1, 1), (self.agent4, 2), (self.agent2, 3), (self.agent3, 4)],
+        )
+        self.assertEqual(results[0].score, 2)
+        self.assertEqual(results[0].wins, 2)
+        self.assertEqual(results[1].sonneborn_berger, 0.5)
+
+        # agent2 and agent3 drew their match, but agent2 had stronger opponents
+        self.assertEqual(results[2].head_to_head, results[3].head_to_head)
+        self.assertEqual(results[2].sonneborn_berger, results[3].sonneborn_berger)
+        self.assertEqual(results[2].buchholz, 3.5)
+        self.assertEqual(results[3].buchholz, 2.5)
+
+    def test_ranked_without_matches(self):
+        models.Match.objects.all().delete()
+        self.assertEqual(standings.ranked(self.tournament), [])
+
+    def test_tournament_ratings(self):
+        standings.rebuild(self.tournament)
+
+        with self.assertNumQueries(1):
+            ratings = self.tournament.ratings
+
+        self.assertEqual(ratings[0].agent, self.agent1)
+        self.assertEqual(ratings[0].score, 2)
+
+        # Ties are broken by agent id, so the order is stable across requests
+        tied = sorted([self.agent2.id, self.agent3.id])
+        self.assertEqual([rating.agent.id for rating in ratings[1:]], tied)
+
+    def test_tournament_ratings_are_read_only(self):
+        self.assertEqual(self.tournament.ratings, [])
+        self.assertFalse(self.tournament.standings.exists())
+
+
+class RoundRobinPairingsTestCase(TestCase):
+    def _distances(self, rounds):
+        """
+        Distances, on queue order, between consecutive matches of an agent
+        """
+        last_seen = {}
+        distances = []
+        for position, pair in enumerate(pair for round in rounds for pair in round):
+            for agent in pair:
+                if agent in last_seen:
+                    distances.append(position - last_seen[agent])
+                last_seen[agent] = position
+
+        return distances
+
+    def test_round_robin(self):
+        rounds = pairings.round_robin(range(6))
+
+        self.assertEqual(len(rounds), 5)
+        for round in rounds:
+            agents = [agent for pair in round for agent in pair]
+            self.assertEqual(sorted(agents), list(range(6)))
+
+        pairs = [frozenset(pair) for round in rounds for pair in round]
+        self.assertEqual(len(set(pairs)), 15)
+        self.assertEqual(len(pairs), 15)
+
+    def test_round_robin_odd(self):
+        rounds = pairings.round_robin(range(5))
+
+        self.assertEqual(len(rounds), 5)
+        for round in rounds:
+            self.assertEqual(len(round), 2)
+
+        pairs = {frozenset(pair) for round in rounds for pair in round}
+        self.assertEqual(len(pairs), 10)
+
+    def test_round_robin_cycles(self):
+        rounds = pairings.round_robin(range(4), n_cycles=2)
+
+        self.assertEqual(len(rounds), 6)
+        self.assertEqual(
+            [(b, a) for a, b in rounds[0]],
+            rounds[3],
+        )
+
+    def test_round_robin_interleaves_agents(self):
+        rounds = pairings.round_robin(range(20), n_cycles=2)
+        self.assertEqual(min(self._distances(rounds)), 9)
+
+    def test_spread(self):
+        rounds = pairings.round_robin(range(7), n_cycles=3)
+        spread_rounds = pairings.spread(rounds)
+
+        self.assertEqual(
+            sorted(pair for round in rounds for pair in round),
+            sorted(pair for round in spread_rounds for pair in round),
+        )
+
+        def _short_gaps(rounds):
+            return len([d for d in self._distances(rounds) if d <= 2])
+
+        self.assertLess(_short_gaps(spread_rounds), _short_gaps(rounds))
+
+
+class JoinOpenTournamentsTestCase(TestCase):
+    def setUp(self):
+        self.season = factories.SeasonFactory()
+        self.game = factories.GameFactory()
+        self.agents = [factories.AgentFactory(game=self.game) for _ in range(3)]
+
+    def test_join_open_tournaments(self):
+        automated = factories.TournamentFactory(
+            game=self.game, season=self.season, is_automated=True
+        )
+        manual = factories.TournamentFactory(game=self.game, season=self.season)
+        done = factories.TournamentFactory(
+            game=self.game, season=self.season, is_automated=True, done=True
+        )
+        for tournament in [automated, manual, done]:
+            tournament.participants.set(self.agents)
+            tournament.create_matches()
+
+        agent = factories.AgentFactory(game=self.game)
+        services.join_open_tournaments(agent)
+
+        self.assertEqual(automated.matches.count(), 6)
+        self.assertEqual(manual.matches.count(), 3)
+        self.assertEqual(done.matches.count(), 3)
+
+        pairs = [
+            frozenset(pair)
+            for pair in automated.matches.values_list("player1_id", "player2_id")
+        ]
+        self.assertEqual(len(set(pairs)), 6)
+
+
+class TimedTournamentTestCase(TestCase):
+    def setUp(self):
+        match_counters.reconcile()
+
+        self.season = factories.SeasonFactory()
+        self.game = factories.GameFactory()
+        self.agents = [factories.AgentFactory(game=self.game) for _ in range(4)]
+
+        self.tournament = factories.TournamentFactory(
+            mode="TIMED",
+            game=self.game,
+            season=self.season,
+            start_date=timezone.now() - timedelta(hours=1),
+            end_date=timezone.now() + timedelta(hours=1),
+        )
+        self.tournament.participants.set(self.agents)
+
+    def _play(self, n_matches):
+        for match in self.tournament.matches.filter(ran=False)[:n_matches]:
+            match.ran = True
+            match.ran_at = timezone.now()
+            match.save()
+            match_counters.register_match(match)
+
+    def test_top_up(self):
+        services.update_tournament_state(self.tournament)
+        self.assertEqual(
+            self.tournament.pending_matches_count, pairings.TIMED_MIN_DEPTH
+        )
+
+        services.update_tournament_state(self.tournament)
+        self.assertEqual(self.tournament.matches.count(), pairings.TIMED_MIN_DEPTH)
+
+        self._play(4)
+        services.update_tournament_state(self.tournament)
+        self.assertEqual(
+            self.tournament.pending_matches_count, pairings.TIMED_MIN_DEPTH
+        )
+        self.assertEqual(sum(self.tournament.pair_counts.values()), 14)
+
+    def test_new_participants_do_not_shift_the_schedule(self):
+        services.update_tournament_state(self.tournament)
+        pair_counts = dict(self.tournament.pair_counts)
+
+        new_agent = factories.AgentFactory(game=self.game)
+        self.tournament.participants.add(new_agent)
+        self._play(pairings.TIMED_MIN_DEPTH)
+        services.update_tournament_state(self.tournament)
+
+        # The pairs of the new agent were never played, so they go first
+        new_pairs = {pairings.pair_key(agent.id, new_agent.id) for agent in self.agents}
+        for key, count in self.tournament.pair_counts.items():
+            expected = 0 if key in new_pairs else pair_counts[key]
+            self.assertGreaterEqual(count, expected)
+        self.assertTrue(all(self.tournament.pair_counts.get(key) for key in new_pairs))
+
+    def test_round_numbers_follow_the_pair_counts(self):
+        agent_ids = [agent.id for agent in self.agents]
+        schedule = pairings.round_robin(agent_ids)
+
+        # Only the pairs of the second round are behind
+        pair_counts = {
+            pairings.pair_key(*pair): 0 if round_number == 1 else 1
+            for round_number, round in enumerate(schedule)
+            for pair in round
+        }
+        rounds, first_round, _ = pairings.timed_pairings(agent_ids, pair_counts, 4)
+
+        self.assertEqual(first_round, 2)
+        self.assertEqual(
+            [len(round) for round in rounds], [len(schedule[1]), 0, len(schedule[0])]
+        )
+
+    def test_follows_the_schedule(self):
+        services.update_tournament_state(self.tournament)
+
+        pairs = [
+            frozenset(pair)
+            for pair in self.tournament.matches.order_by("round").values_list(
+                "player1_id", "player2_id"
+            )
+        ]
+
+        # 4 agents have 6 pairings, that repeat in the same order
+        self.assertEqual(len(set(pairs[:6])), 6)
+        self.assertEqual(pairs[6:], pairs[:4])
+
+    def test_target_depth_follows_throughput(self):
+        services.update_tournament_state(self.tournament)
+        self._play(10)
+
+        for _ in range(90):
+            match_counters.register_match(self.tournament.matches.first())
+
+        # 100 matches in the last 15 minutes, so 5 minutes worth is ~34
+        self.assertEqual(pairings.timed_target_depth(self.tournament), 34)
+
+    def test_stops_at_end_date(self):
+        self.tournament.end_date = timezone.now() + timedelta(seconds=30)
+        self.tournament.save()
+        self.assertEqual(pairings.timed_target_depth(self.tournament), 0)
+
+        self.tournament.end_date = timezone.now() - timedelta(seconds=30)
+        self.tournament.save()
+        services.update_tournament_state(self.tournament)
+
+        self.assertEqual(self.tournament.matches.count(), 0)
+
+
+class SwissTournamentTestCase(TestCase):
+    def setUp(self):
+        self.season = factories.SeasonFactory()
+        self.game = factories.GameFactory()
+
+    def _create_tournament(self, n_agents):
+        agents = [factories.AgentFactory(game=self.game) for _ in range(n_agents)]
+        for elo, agent in enumerate(agents):
+            models.AgentRatings.objects.create(
+                agent=agent, game=self.game, season=self.season, elo=1500 + elo
+            )
+
+        tournament = factories.TournamentFactory(
+            mode="SWISS", game=self.game, season=self.season
+        )
+        tournament.participants.set(agents)
+
+        return tournament
+
+    def _play_round(self, tournament):
+        for match in tournament.matches.filter(ran=False):
+            match.ran = True
+            match.ran_at = timezone.now()
+            match.result = 1
+            match.save()
+            standings.register_match(match)
+
+    def test_rounds(self):
+        tournament = self._create_tournament(8)
+        self.assertEqual(tournament.total_rounds, 3)
+
+        for round in range(1, 4):
+            services.update_tournament_state(tournament)
+
+            self.assertEqual(tournament.current_round, round)
+            self.assertEqual(tournament.matches.filter(round=round).count(), 4)
+            self.assertTrue(tournament.is_active)
+
+            self._play_round(tournament)
+
+        services.update_tournament_state(tournament)
+        tournament.refresh_from_db()
+
+        self.assertTrue(tournament.done)
+        self.assertEqual(tournament.matches.count(), 12)
+        self.assertEqual(tournament.trophies.filter(type="FIRST").count(), 1)
+
+        pairs = [
+            frozenset(pair)
+            for pair in tournament.matches.values_list("player1_id", "player2_id")
+        ]
+        self.assertEqual(len(set(pairs)), len(pairs))
+
+    def test_pairs_by_score(self):
+        tournament = self._create_tournament(4)
+        services.update_tournament_state(tournament)
+        self._play_round(tournament)
+
+        winners = set(
+            tournament.matches.filter(round=1).values_list("player1_id", flat=True)
+        )
+        services.update_tournament_state(tournament)
+
+        for match in tournament.matches.filter(round=2):
+            self.assertEqual(match.player1_id in winners, match.player2_id in winners)
+
+    def test_byes(self):
+        tournament = self._create_tournament(5)
+        tournament.rounds = 5
+        tournament.save()
+
+        byes = []
+        for _ in range(5):
+            services.update_tournament_state(tournament)
+
+            round_matches = tournament.matches.filter(ran=False)
+            self.assertEqual(round_matches.count(), 2)
+
+            playing = {
+                agent_id
+                for pair in round_matches.values_list("player1_id", "player2_id")
+                for agent_id in pair
+            }
+            byes.extend(
+                tournament.participants.exclude(id__in=playing).values_list(
+                    "id", flat=True
+                )
+            )
+
+            self._play_round(tournament)
+
+        self.assertEqual(len(set(byes)), 5)
+
+
+class KnockoutTournamentTestCase(TestCase):
+    def setUp(self):
+        self.season = factories.SeasonFactory()
+        self.game = factories.GameFactory()
+
+        # Seeds go from the highest elo to the lowest
+        self.seeds = [factories.AgentFactory(game=self.game) for _ in range(6)]
+        for elo, agent in enumerate(reversed(self.seeds)):
+            models.AgentRatings.objects.create(
+                agent=agent, game=self.game, season=self.season, elo=1500 + elo
+            )
+
+    def _create_tournament(self, best_of):
+        tournament = factories.TournamentFactory(
+            mode="KNOCKOUT", game=self.game, season=self.season, best_of=best_of
+        )
+        tournament.participants.set(self.seeds)
+        return tournament
+
+    def _play_round(self, tournament):
+        for match in tournament.matches.filter(ran=False):
+            match.ran = True
+            match.ran_at = timezone.now()
+            match.result = 1
+            match.save()
+
+    def _ties(self, tournament, round):
+        return [
+            [
+                self.seeds.index(models.Agent.objects.get(id=agent_id)) + 1
+                for agent_id in tie
+            ]
+            for tie in tournament.bracket["rounds"][round - 1]
+            if None not in tie
+        ]
+
+    def test_bracket(self):
+        tournament = self._create_tournament(best_of=3)
+        self.assertEqual(tournament.total_rounds, 3)
+
+        services.update_tournament_state(tournament)
+
+        # The two top seeds get a bye
+        self.assertEqual(self._ties(tournament, 1), [[4, 5], [3, 6]])
+        self.assertEqual(tournament.matches.filter(round=1).count(), 6)
+
+        # Player1 always wins, so the first agent of each tie wins 2-1
+        self._play_round(tournament)
+        services.update_tournament_state(tournament)
+        self.assertEqual(self._ties(tournament, 2), [[1, 4], [2, 3]])
+
+        self._play_round(tournament)
+        services.update_tournament_state(tournament)
+        self.assertEqual(self._ties(tournament, 3), [[1, 2]])
+        self.assertEqual(tournament.matches.count(), 15)
+
+        self._play_round(tournament)
+        services.update_tournament_state(tournament)
+        tournament.refresh_from_db()
+
+        self.assertTrue(tournament.done)
+        self.assertEqual(self.seeds[0].trophies.get().type, "FIRST")
+        self.assertEqual(self.seeds[1].trophies.get().type, "SECOND")
+        self.assertEqual(self.seeds[2].trophies.get().type, "THIRD")
+        self.assertEqual(self.seeds[3].trophies.get().type, "THIRD")
+        self.assertEqual(tournament.trophies.count(), 4)
+
+    def test_bracket_is_saved_with_the_matches(self):
+        tournament = self._create_tournament(best_of=3)
+
+        with mock.patch.object(
+            models.Match.objects, "bulk_create", side_effect=RuntimeError
+        ):
+            with self.assertRaises(RuntimeError):
+                tournament.create_matches()
+
+        tournament.refresh_from_db()
+        self.assertEqual(tournament.bracket, {})
+        self.assertFalse(tournament.matches.exists())
+
+    def test_level_tie_goes_to_the_higher_seed(self):
+        tournament = self._create_tournament(best_of=2)
+        services.update_tournament_state(tournament)
+        self._play_round(tournament)
+
+        self.assertEqual(
+            pairings.tie_winner(
+                tournament, 1, [str(self.seeds[4].id), str(self.seeds[3].id)]
+            ),
+            str(self.seeds[3].id),
+        )
+
+
+class AdaptiveTournamentTestCase(TestCase):
+    def setUp(self):
+        self.season = factories.SeasonFactory()
+        self.game = factories.GameFactory()
+
+    def test_expected_scores(self):
+        elos = {"a": 1500, "b": 1700, "c": 1350}
+        expected = pairings.expected_scores(list(elos.values()))
+
+        for (a, b), value in compute_expected_result(elos).items():
+            i, j = list(elos).index(a), list(elos).index(b)
+            self.assertAlmostEqual(expected[i, j], value)
+            self.assertAlmostEqual(expected[j, i], 1 - value)
+
+    def test_pairs_close_ratings(self):
+        pairs = pairings.adaptive_pairings([1500, 1900, 1510, 1890], [50, 50, 50, 50])
+
+        self.assertEqual(sorted(pairs), [(0, 2), (1, 3)])
+
+    def test_new_agents_first(self):
+        # The new agent is far from everyone, but it still gets a match
+        pairs = pairings.adaptive_pairings([1500, 1510, 1000], [50, 50, 0])
+
+        self.assertEqual(len(pairs), 1)
+        self.assertIn(2, pairs[0])
+
+    def test_avoids_rematches(self):
+        times_played = np.zeros((4, 4))
+        times_played[0, 2] = times_played[2, 0] = 3
+        times_played[1, 3] = times_played[3, 1] = 3
+
+        pairs = pairings.adaptive_pairings(
+            [1500, 1900, 1510, 1890], [50, 50, 50, 50], times_played
+        )
+
+        self.assertNotIn((0, 2), pairs)
+        self.assertNotIn((1, 3), pairs)
+
+    def test_rounds(self):
+        agents = [factories.AgentFactory(game=self.game) for _ in range(6)]
+        tournament = factories.TournamentFactory(
+            mode="ADAPTIVE", game=self.game, season=self.season, rounds=4
+        )
+        tournament.participants.set(agents)
+
+        for round in range(1, 5):
+            services.update_tournament_state(tournament)
+
+            self.assertEqual(tournament.current_round, round)
+            self.assertEqual(tournament.matches.filter(round=round).count(), 3)
+
+            for match in tournament.matches.filter(ran=False):
+                match.ran = True
+                match.ran_at = timezone.now()
+                match.result = 1
+                match.save()
+                standings.register_match(match)
+
+        services.update_tournament_state(tournament)
+        tournament.refresh_from_db()
+
+        self.assertTrue(tournament.done)
+        self.assertEqual(tournament.matches.count(), 12)
+
+
+class MatchCountersTestCase(TestCase):
+    def setUp(self):
+        self.game = factories.GameFactory()
+        self.game2 = factories.GameFactory()
+        match_counters.reconcile()
+
+    def test_register_match(self):
+        match = factories.MatchFactory(game=self.game, ran=True, ran_at=timezone.now())
+        match_counters.register_match(match)
+        match_counters.register_match(match)
+
+        self.assertEqual(match_counters.count_last(constants.ONE_HOUR), 2)
+        self.assertEqual(
+            match_counters.count_last(constants.ONE_HOUR, game_id=self.game.id), 2
+        )
+        self.assertEqual(
+            match_counters.count_last(constants.ONE_HOUR, game_id=self.game2.id), 0
+        )
+
+    def test_reconcile(self):
+        now = timezone.now()
+        for game, minutes_ago in [
+            (self.game, 0),
+            (self.game, 5),
+            (self.game2, 5),
+            (self.game2, 90),
+            (self.game2, 60 * 30),
+        ]:
+            factories.MatchFactory(
+                game=game, ran=True, ran_at=now - timedelta(minutes=minutes_ago)
+            )
+
+        match_counters.reconcile()
+
+        self.assertEqual(match_counters.count_last(constants.ONE_HOUR), 3)
+        self.assertEqual(match_counters.count_last(constants.ONE_DAY), 4)
+        self.assertEqual(
+            match_counters.count_last(constants.ONE_DAY, game_id=self.game2.id), 2
+        )
+
+    @freeze_time("2022-05-14 12:00:10")
+    def test_count_last_includes_the_start_minute(self):
+        match = factories.MatchFactory(
+            game=self.game, ran=True, ran_at=timezone.now() - timedelta(seconds=50)
+        )
+        match_counters.register_match(match)
+
+        self.assertEqual(match_counters.count_last(constants.ONE_MINUTE), 1)
+
+    def test_reconcile_retries_on_concurrent_increments(self):
+        match = factories.MatchFactory(game=self.game, ran=True, ran_at=timezone.now())
+        counters_from_db = match_counters._counters_from_db
+        calls = []
+
+        def _counters_from_db(start_date):
+            calls.append(start_date)
+            if len(calls) == 1:
+                # The result is ingested right after the database was read
+                match_counters.register_match(match)
+                return {}
+
+            return counters_from_db(start_date)
+
+        with mock.patch.object(
+            match_counters, "_counters_from_db", side_effect=_counters_from_db
+        ):
+            match_counters.reconcile()
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(match_counters.count_last(constants.ONE_HOUR), 1)
+
+    def test_series(self):
+        now = timezone.now()
+        factories.MatchFactory(game=self.game, ran=True, ran_at=now)
+        match_counters.reconcile()
+
+        x, y = match_counters.series(now - timedelta(minutes=9), now)
+
+        self.assertEqual(len(x), 10)
+        self.assertEqual(y[-1], 1)
+        self.assertEqual(sum(y), 1)
+
+    def test_count_older_than_retention(self):
+        with self.assertRaises(ValueError):
+            match_counters.count_last(constants.ONE_DAY * 2)
+
+
+class SiteStatsTestCase(TestCase):
+    def setUp(self):
+        self.season = factories.SeasonFactory()
+        self.tournament = factories.TournamentFactory(season=self.season)
+        self.pending_match = factories.MatchFactory(
+            ran=False, season=self.season, tournament=self.tournament
+        )
+        factories.MatchFactory(
+            ran=False, season=self.season, tournament=self.tournament
+        )
+
+    def test_compute_snapshot(self):
+        snapshot = site_stats.compute_snapshot()
+
+        self.assertEqual(snapshot["pending_matches"].value, 2)
+        self.assertEqual(snapshot["open_tournament_count"].value, 1)
+        self.assertEqual(snapshot["current_season_name"].value, self.season.name)
+        self.assertEqual(
+            snapshot["oldest_pending_match_created_at"].value,
+            self.pending_match.created_at,
+        )
+        self.assertLess(snapshot["pending_matches"].age, 60)
+
+    def test_get_snapshot_is_cached(self):
+        site_stats.refresh_snapshot()
+        factories.MatchFactory(
+            ran=False, season=self.season, tournament=self.tournament
+        )
+
+        snapshot = site_stats.get_snapshot()
+        self.assertEqual(snapshot["pending_matches"].value, 2)
+
+
+class SeasonSummaryTestCase(TestCase):
+    def setUp(self):
+        self.season = factories.SeasonFactory()
+        self.game = factories.GameFactory()
+        self.owner = factories.UserFactory()
+        self.agent1 = factories.AgentFactory(game=self.game, owner=self.owner)
+        self.agent2 = factories.AgentFactory(game=self.game, owner=self.owner)
+        self.agent3 = factories.AgentFactory(game=self.game)
+        self.tournament = factories.TournamentFactory(
+            game=self.game, season=self.season
+        )
+        self.tournament.participants.add(self.agent1, self.agent2, self.agent3)
+
+        for agent, elo in (
+            (self.agent1, 1600),
+            (self.agent2, 1550),
+            (self.agent3, 1500),
+        ):
+            models.AgentRatings.objects.create(
+                agent=agent, game=self.game, season=self.season, elo=elo
+            )
+
+    def test_refresh(self):
+        factories.MatchFactory(ran=True, season=self.season, tournament=self.tournament)
+        factories.MatchFactory(
+            ran=False, season=self.season, tournament=self.tournament
+        )
+        models.Trophy.objects.create(
+            agent=self.agent3,
+            game=self.game,
+            season=self.season,
+            tournament=self.tournament,
+            type="FIRST",
+        )
+
+        summary = season_summary.refresh(self.season)
+
+        self.assertEqual(summary.tournaments_count, 1)
+        self.assertEqual(summary.matches_played_count, 1)
+        self.assertEqual(summary.matches_pending_count, 1)
+        self.assertEqual(summary.games, {str(self.game.id): self.game.pretty_name})
+
+        top_agents = summary.top_agents[str(self.game.id)]
+        self.assertEqual(top_agents[0]["agent_id"], str(self.agent3.id))
+        self.assertEqual(top_agents[0]["first_places"], 1)
+
+        # Only the best agent of each user is ranked
+        self.assertEqual(
+            [(winner["agent_id"], winner["ranking"]) for winner in summary.winners],
+            [
+                (str(self.agent1.id), 1),
+                (str(self.agent2.id), ""),
+                (str(self.agent3.id), 2),
+            ],
+        )
+
+    def test_get_computes_missing_summary(self):
+        self.assertFalse(
+            models.SeasonSummary.objects.filter(season=self.season).exists()
+        )
+
+        summary = season_summary.get(self.season)
+
+        self.assertEqual(summary.season, self.season)
+        self.assertEqual(season_summary.get(self.season).id, summary.id)
+
+    def test_counters_are_incremented(self):
+        season_summary.refresh(self.season)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tournament.create_matches()
+            match = self.tournament.matches.first()
+            season_summary.register_match_played(match)
+
+        summary = models.SeasonSummary.objects.get(season=self.season)
+        self.assertEqual(summary.matches_pending_count, 2)
+        self.assertEqual(summary.matches_played_count, 1)
+
+        # The match wasn't really played, a full refresh fixes the counters
+        summary = season_summary.refresh(self.season)
+        self.assertEqual(summary.matches_pending_count, 3)
+        self.assertEqual(summary.matches_played_count, 0)
+
+    def test_rankings_are_refreshed_when_tournament_finishes(self):
+        season_summary.refresh(self.season)
+        self.tournament.create_matches()
+        for match in self.tournament.matches.all():
+            match.ran = True
+            match.result = 1
+            match.save()
+        standings.rebuild(self.tournament)
+
+        services.update_tournament_state(self.tournament)
+
+        summary = models.SeasonSummary.objects.get(season=self.season)
+        self.assertEqual(
+            sum(
+                agent["trophy_count"] for agent in summary.top_agents[str(self.game.id)]
+            ),
+            3,
+        )
+
+
+class SeasonArchiveTestCase(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        storage_settings = self.settings(
+            DEFAULT_FILE_STORAGE="django.core.files.storage.FileSystemStorage",
+            MEDIA_ROOT=media_root,
+        )
+        storage_settings.enable()
+        self.addCleanup(storage_settings.disable)
+
+        self.season = factories.SeasonFactory(
+            active=False,
+            start_date=timezone.now() - timedelta(days=7),
+            end_date=timezone.now() - timedelta(hours=1),
+        )
+        cache.delete(f"{settings.SEASON_ARCHIVE_CACHE_KEY}:{self.season.id}")
+
+        self.game = factories.GameFactory()
+        self.agent1 = factories.AgentFactory(game=self.game)
+        self.agent2 = factories.AgentFactory(game=self.game)
+        self.tournament = factories.TournamentFactory(
+            game=self.game, season=self.season, done=True
+        )
+        for agent in (self.agent1, self.agent2):
+            models.AgentRatings.objects.create(
+                agent=agent, game=self.game, season=self.season
+            )
+
+        for minutes_ago in range(5):
+            factories.MatchFactory(
+                player1=self.agent1,
+                player2=self.agent2,
+                game=self.game,
+                season=self.season,
+                tournament=self.tournament,
+                ran=True,
+                ran_at=self.season.end_date - timedelta(minutes=minutes_ago),
+                data={
+                    "elo_after": {
+                        str(self.agent1.id): 1500 + minutes_ago,
+                        str(self.agent2.id): 1500 - minutes_ago,
+                    }
+                },
+            )
+
+    def test_archive(self):
+        season_archive.archive(self.season)
+
+        self.season.refresh_from_db()
+        self.assertIsNotNone(self.season.archived_at)
+
+        snapshot = season_archive.load(self.season.id)
+        self.assertEqual(snapshot["season"]["name"], self.season.name)
+        self.assertAlmostEqual(
+            snapshot["season"]["end_date"],
+            self.season.end_date,
+            delta=timedelta(milliseconds=1),
+        )
+        self.assertEqual(snapshot["summary"]["matches_played_count"], 5)
+        self.assertEqual(len(snapshot["summary"]["winners"]), 2)
+        self.assertEqual(snapshot["tournaments"][0]["id"], str(self.tournament.id))
+
+        series = season_archive.elo_series(self.season.id, self.game.id)
+        self.assertEqual(len(series), 2)
+        self.assertEqual(len(series[0][1]), 5)
+
+        png = season_archive.elo_plot(self.season.id, self.game.id)
+        self.assertTrue(png.startswith(b"\x89PNG"))
+
+    def test_load_reads_from_storage(self):
+        season_archive.archive(self.season)
+        cache.delete(f"{settings.SEASON_ARCHIVE_CACHE_KEY}:{self.season.id}")
+
+        with self.assertNumQueries(0):
+            snapshot = season_archive.load(self.season.id)
+
+        self.assertEqual(snapshot["season"]["id"], str(self.season.id))
+
+    def test_load_not_archived(self):
+        self.assertIsNone(season_archive.load(self.season.id))
+        self.assertIsNone(season_archive.load("../../etc"))
+        self.assertIsNone(season_archive.elo_plot(self.season.id, self.game.id))
+
+    def test_seasons_with_pending_matches_are_not_archived(self):
+        factories.MatchFactory(
+            ran=False, season=self.season, tournament=self.tournament
+        )
+
+        with self.assertRaises(ValueError):
+            season_archive.archive(self.season)
+
+        season_archive.archive_ended()
+        self.assertIsNone(season_archive.load(self.season.id))
+
+    def test_invalidate(self):
+        season_archive.archive(self.season)
+
+        season_archive.invalidate(self.season)
+
+        self.season.refresh_from_db()
+        self.assertIsNone(self.season.archived_at)
+        self.assertIsNone(season_archive.load(self.season.id))
+
+        season_archive.archive_ended()
+        self.assertIsNotNone(season_archive.load(self.season.id))
+
+    def test_snapshot_has_no_emails(self):
+        season_archive.archive(self.season)
+
+        winners = season_archive.load(self.season.id)["summary"]["winners"]
+        self.assertNotIn("owner_email", winners[0])
+
+    def test_archive_ended(self):
+        active_season = factories.SeasonFactory(
+            start_date=timezone.now() - timedelta(days=1),
+            end_date=timezone.now() + timedelta(days=1),
+        )
+
+        season_archive.archive_ended()
+
+        self.assertIsNotNone(season_archive.load(self.season.id))
+        active_season.refresh_from_db()
+        self.assertIsNone(active_season.archived_at)
+
+
+class TimeseriesTestCase(TestCase):
+    def test_moving_average(self):
+        self.assertEqual(
+            timeseries.moving_average([1, 2, 3, 4], 2),
+            [1, 1.5, 2.5, 3.5],
+        )
+        self.assertEqual(timeseries.moving_average([1, 2, 3], 1), [1, 2, 3])
+
+    def test_downsample(self):
+        x = list(range(10))
+        y = list(range(10))
+
+        x_, y_ = timeseries.downsample(x, y, 5)
+        self.assertEqual(x_, [0, 2, 4, 6, 8])
+        self.assertEqual(y_, [0.5, 2.5, 4.5, 6.5, 8.5])
+
+        x_, y_ = timeseries.downsample(x, y, 20)
+        self.assertEqual(x_, x)
+        self.assertEqual(y_, y)
 
 
 class PrettifyTimeDelta(TestCase):
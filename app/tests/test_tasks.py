@@ -1,9 +1,13 @@
 from datetime import timedelta
+from types import SimpleNamespace
 
+from django.conf import settings
 from django.test import TestCase
 from django.utils import timezone
 
 from app import factories, models, tasks
+from app.celery import app as celery
+from app.celery import config_concurrency
 
 
 class AutomatedManagerTestcase(TestCase):
@@ -43,6 +47,41 @@ class AutomatedManagerTestcase(TestCase):
         self.assertEqual(models.Match.objects.filter(ran=False).count(), 6)
 
 
+class SingleInstanceTestCase(TestCase):
+    def setUp(self):
+        self.game = factories.GameFactory()
+        self.season = factories.SeasonFactory(
+            start_date=timezone.now() - timedelta(hours=2),
+            end_date=timezone.now() - timedelta(hours=1),
+        )
+
+    def test_skips_while_held(self):
+        lock = tasks.TaskLock("automated_manager", lease=60)
+        self.assertTrue(lock.acquire())
+
+        tasks.automated_manager()
+        self.assertEqual(models.Season.objects.count(), 1)
+
+        lock.release()
+
+        tasks.automated_manager()
+        self.assertEqual(models.Season.objects.count(), 2)
+
+    def test_only_the_holder_can_release(self):
+        lock = tasks.TaskLock("test_task", lease=60)
+        other = tasks.TaskLock("test_task", lease=60)
+
+        self.assertTrue(lock.acquire())
+        self.assertFalse(other.acquire())
+        self.assertFalse(other.renew())
+        self.assertFalse(other.release())
+
+        self.assertTrue(lock.renew())
+        self.assertTrue(lock.release())
+        self.assertTrue(other.acquire())
+        other.release()
+
+
 class MetricsLoggerTestCase(TestCase):
     def setUp(self):
         self.game = factories.GameFactory()
@@ -60,3 +99,29 @@ class MetricsLoggerTestCase(TestCase):
         tasks.metrics_logger()
         tasks.automated_manager()  # This creates some data
         tasks.metrics_logger()
+
+
+class TaskRoutingTestCase(TestCase):
+    def test_every_task_is_routed(self):
+        task_names = [name for name in celery.tasks if name.startswith("app.tasks.")]
+        self.assertGreater(len(task_names), 0)
+
+        for name in task_names:
+            self.assertIn(
+                settings.CELERY_TASK_ROUTES[name]["queue"], settings.CELERY_QUEUES
+            )
+
+    def test_single_queue_workers_use_its_concurrency(self):
+        conf = SimpleNamespace(worker_concurrency=2)
+        config_concurrency(conf=conf, options={"queues": "maintenance"})
+        self.assertEqual(
+            conf.worker_concurrency, settings.CELERY_QUEUE_CONCURRENCY["maintenance"]
+        )
+
+        conf = SimpleNamespace(worker_concurrency=2)
+        config_concurrency(conf=conf, options={"queues": ["critical", "bulk"]})
+        self.assertEqual(conf.worker_concurrency, 2)
+
+        conf = SimpleNamespace(worker_concurrency=2)
+        config_concurrency(conf=conf, options={"queues": "bulk", "concurrency": 8})
+        self.assertEqual(conf.worker_concurrency, 2)
@@ -1,12 +1,25 @@
+import shutil
+import tempfile
 from datetime import timedelta
 from uuid import UUID
 
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
 from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from django_redis import get_redis_connection
 from rest_framework.test import APIClient
 
 from .. import factories, models
+from ..services import (
+    bulk_jobs,
+    match_counters,
+    season_archive,
+    season_summary,
+    site_stats,
+)
 
 
 class AgentListViewTestCase(TestCase):
@@ -37,6 +50,20 @@ class AgentDetailViewTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
 
 
+class BulkJobsDebugViewTestCase(TestCase):
+    def setUp(self):
+        self.season = factories.SeasonFactory()
+        self.tournament = factories.TournamentFactory(season=self.season, done=True)
+        self.client = Client()
+
+    def test_get(self):
+        bulk_jobs.start("regen_trophies")
+
+        response = self.client.get("/debug/bulk_jobs")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "regen_trophies")
+
+
 class AgentApiViewTestCase(TestCase):
     def setUp(self):
         self.game = factories.GameFactory()
@@ -63,6 +90,56 @@ class AgentApiViewTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn("file", data.keys())
 
+    def test_deactivate(self):
+        tournament = factories.TournamentFactory(game=self.game, season=self.season)
+        tournament.participants.set(
+            [self.agent, factories.AgentFactory(game=self.game)]
+        )
+        tournament.create_matches()
+
+        self.client.force_authenticate(user=self.admin_user)
+        response = self.client.patch(f"/api/agents/{self.agent.id}/", {"active": False})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(tournament.matches.exists())
+        self.assertEqual(
+            self.client.get(f"/api/agents/{self.agent.id}/").data["active"], False
+        )
+
+    def test_rank(self):
+        models.AgentRatings.objects.create(
+            agent=self.agent, game=self.game, season=self.season
+        )
+
+        response = self.client.get(f"/api/agents/{self.agent.id}/rank/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["rank"], 1)
+
+
+class LeaderboardAPIViewTestCase(TestCase):
+    def setUp(self):
+        self.game = factories.GameFactory()
+        self.season = factories.SeasonFactory()
+
+        for elo in [1400, 1600, 1500]:
+            agent = factories.AgentFactory(game=self.game)
+            models.AgentRatings.objects.create(
+                agent=agent, game=self.game, season=self.season, elo=elo
+            )
+
+        self.client = APIClient()
+
+    def test_get(self):
+        response = self.client.get(f"/api/leaderboard/{self.game.id}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([entry["rank"] for entry in response.data], [1, 2, 3])
+        self.assertEqual(response.data[0]["elo"], 1600)
+
+    def test_get_with_limit(self):
+        response = self.client.get(f"/api/leaderboard/{self.game.id}/?limit=2")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 2)
+
 
 class NextMatchAPIViewTestCase(TestCase):
     def setUp(self):
@@ -271,6 +348,10 @@ class MatchViewSetTestCase(TestCase):
         self.tournament = factories.TournamentFactory(
             game=self.game, season=self.season
         )
+        for agent in (self.agent1, self.agent2):
+            models.AgentRatings.objects.create(
+                agent=agent, game=self.game, season=self.season
+            )
 
         self.admin_user = factories.UserFactory(is_staff=True)
         self.api_client = APIClient()
@@ -298,13 +379,46 @@ class MatchViewSetTestCase(TestCase):
         response = self.api_client.get("/api/matches/count/?current_season=true")
         self.assertEqual(response.data, 2)
 
+    def test_match_count_current_season_hours_ago(self):
+        factories.MatchFactory(
+            ran=True,
+            ran_at=timezone.now(),
+            season=self.season_old,
+            tournament=self.tournament,
+        )
+        factories.MatchFactory(
+            ran=True,
+            ran_at=timezone.now(),
+            season=self.season,
+            tournament=self.tournament,
+        )
+        factories.MatchFactory(
+            ran=True,
+            ran_at=timezone.now() - timedelta(hours=2),
+            season=self.season,
+            tournament=self.tournament,
+        )
+        match_counters.reconcile()
+
+        response = self.api_client.get(
+            "/api/matches/count/?current_season=true&hours_ago=1"
+        )
+        self.assertEqual(response.data, 1)
+
     def test_match_count_hours_ago(self):
         factories.MatchFactory(ran=True, ran_at=timezone.now())
-        factories.MatchFactory(ran=True, ran_at=timezone.now() - timedelta(hours=1))
+        # Windows start at the beginning of their first minute
+        factories.MatchFactory(
+            ran=True, ran_at=timezone.now() - timedelta(hours=1, minutes=1)
+        )
         factories.MatchFactory(ran=True, ran_at=timezone.now() - timedelta(hours=6))
         factories.MatchFactory(ran=True, ran_at=timezone.now() - timedelta(hours=12))
         factories.MatchFactory(ran=True, ran_at=timezone.now() - timedelta(hours=32))
 
+        # Recent windows are read from the counters, which are only updated
+        # on result ingestion.
+        match_counters.reconcile()
+
         response = self.api_client.get("/api/matches/count/?hours_ago=1")
         self.assertEqual(response.data, 1)
 
@@ -341,6 +455,35 @@ class MatchViewSetTestCase(TestCase):
         self.assertEqual(match.data["elo_change"][str(self.agent1.id)], 12)
         self.assertEqual(match.data["elo_change"][str(self.agent2.id)], -12)
 
+        standings = {
+            standing.agent_id: standing for standing in self.tournament.standings.all()
+        }
+        self.assertEqual(standings[self.agent1.id].wins, 1)
+        self.assertEqual(standings[self.agent1.id].score, 1)
+        self.assertEqual(standings[self.agent2.id].loses, 1)
+        self.assertEqual(standings[self.agent2.id].score, 0)
+
+    def test_last_match_finishes_tournament(self):
+        match = models.Match.objects.create(
+            game=self.game,
+            tournament=self.tournament,
+            player1=self.agent1,
+            player2=self.agent2,
+            season=self.season,
+        )
+
+        self.api_client.force_authenticate(user=self.admin_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.api_client.patch(
+                f"/api/matches/{match.id}/",
+                {"ran": True, "ran_at": timezone.now(), "result": 1},
+            )
+
+        self.tournament.refresh_from_db()
+
+        self.assertTrue(self.tournament.done)
+        self.assertEqual(self.agent1.trophies.get().type, "FIRST")
+
 
 class SeasonDetailViewTestCase(TestCase):
     def setUp(self):
@@ -362,3 +505,293 @@ class SeasonDetailViewTestCase(TestCase):
     def test_get_old_season(self):
         response = self.client.get(f"/seasons/{self.season_old.id}/")
         self.assertEqual(response.status_code, 200)
+
+    def test_trophy_table(self):
+        agent = factories.AgentFactory()
+        models.AgentRatings.objects.create(
+            agent=agent, game=agent.game, season=self.season, elo=1623
+        )
+        models.Trophy.objects.create(
+            agent=agent,
+            game=agent.game,
+            season=self.season,
+            tournament=factories.TournamentFactory(game=agent.game, season=self.season),
+            type="FIRST",
+        )
+
+        response = self.client.get(f"/seasons/{self.season.id}/")
+
+        self.assertContains(response, agent.name)
+        self.assertContains(response, "1623")
+
+    def test_constant_queries(self):
+        for _ in range(3):
+            tournament = factories.TournamentFactory(season=self.season)
+            factories.MatchFactory(ran=True, season=self.season, tournament=tournament)
+        season_summary.refresh(self.season)
+
+        # The season with its summary, and the tournaments
+        with self.assertNumQueries(2):
+            response = self.client.get(f"/seasons/{self.season.id}/")
+
+        self.assertEqual(response.status_code, 200)
+
+
+class SeasonWinnersViewTestCase(TestCase):
+    def setUp(self):
+        self.season = factories.SeasonFactory(
+            start_date=timezone.now() - timedelta(hours=1),
+            end_date=timezone.now() + timedelta(hours=1),
+        )
+        self.game = factories.GameFactory()
+        self.client = Client()
+
+    def test_winners(self):
+        owner = factories.UserFactory()
+        agents = [factories.AgentFactory(game=self.game, owner=owner) for _ in range(3)]
+        for elo, agent in enumerate(agents):
+            models.AgentRatings.objects.create(
+                agent=agent, game=self.game, season=self.season, elo=1500 + elo
+            )
+        season_summary.refresh(self.season)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/seasons/{self.season.id}/winners/")
+
+        self.assertEqual(response.status_code, 200)
+        for agent in agents:
+            self.assertContains(response, agent.name)
+        self.assertContains(response, owner.username)
+
+
+class ArchivedSeasonViewTestCase(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        storage_settings = self.settings(
+            DEFAULT_FILE_STORAGE="django.core.files.storage.FileSystemStorage",
+            MEDIA_ROOT=media_root,
+        )
+        storage_settings.enable()
+        self.addCleanup(storage_settings.disable)
+
+        self.season = factories.SeasonFactory(
+            active=False,
+            start_date=timezone.now() - timedelta(days=7),
+            end_date=timezone.now() - timedelta(hours=1),
+        )
+        self.game = factories.GameFactory()
+        self.agent = factories.AgentFactory(game=self.game)
+        models.AgentRatings.objects.create(
+            agent=self.agent, game=self.game, season=self.season, elo=1623
+        )
+        self.tournament = factories.TournamentFactory(
+            game=self.game, season=self.season, done=True
+        )
+        models.Trophy.objects.create(
+            agent=self.agent,
+            game=self.game,
+            season=self.season,
+            tournament=self.tournament,
+            type="FIRST",
+        )
+        season_archive.archive(self.season)
+
+        self.client = Client()
+
+    def test_season_detail(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(f"/seasons/{self.season.id}/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, self.season.name)
+        self.assertContains(response, self.tournament.name)
+        self.assertContains(response, "1623")
+        self.assertIn(
+            f"max-age={season_archive.ARCHIVE_PAGE_MAX_AGE}",
+            response["Cache-Control"],
+        )
+        self.assertIn("public", response["Cache-Control"])
+
+    def test_season_winners(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(f"/seasons/{self.season.id}/winners/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, self.agent.name)
+        self.assertNotContains(response, self.agent.owner.email)
+
+    def test_season_winners_emails_for_staff(self):
+        self.client.force_login(factories.UserFactory(is_staff=True))
+
+        response = self.client.get(f"/seasons/{self.season.id}/winners/")
+
+        self.assertContains(response, self.agent.owner.email)
+        self.assertIn("private", response["Cache-Control"])
+
+    def test_elo_plot(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                f"/plots/game_season_elo_plot/{self.game.id}/{self.season.id}/"
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertIn(
+            f"max-age={season_archive.ARCHIVE_DATA_MAX_AGE}",
+            response["Cache-Control"],
+        )
+
+    def test_elo_plot_data(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                f"/plots/game_season_elo_plot/{self.game.id}/{self.season.id}/data/"
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["series"][0]["agent_id"], str(self.agent.id))
+
+
+class PlotDataViewTestCase(TestCase):
+    def setUp(self):
+        self.game = factories.GameFactory()
+        self.season = factories.SeasonFactory()
+        self.tournament = factories.TournamentFactory(
+            game=self.game, season=self.season
+        )
+        self.agent1 = factories.AgentFactory(game=self.game)
+        self.agent2 = factories.AgentFactory(game=self.game)
+        models.AgentRatings.objects.create(
+            agent=self.agent1, game=self.game, season=self.season
+        )
+        models.AgentRatings.objects.create(
+            agent=self.agent2, game=self.game, season=self.season
+        )
+
+        for minutes_ago in range(10):
+            match = factories.MatchFactory(
+                player1=self.agent1,
+                player2=self.agent2,
+                game=self.game,
+                season=self.season,
+                tournament=self.tournament,
+                ran=True,
+                ran_at=timezone.now() - timedelta(minutes=minutes_ago),
+                data={
+                    "elo_after": {
+                        str(self.agent1.id): 1500 + minutes_ago,
+                        str(self.agent2.id): 1500 - minutes_ago,
+                    }
+                },
+            )
+            match.participants.set([self.agent1, self.agent2])
+
+        self.client = Client()
+
+    def test_matches_per_day(self):
+        response = self.client.get("/plots/matches_per_day/data/?points=24&window=1")
+        self.assertEqual(response.status_code, 200)
+
+        data = response.json()
+        self.assertEqual(len(data["t"]), 24)
+        self.assertEqual(len(data["v"]), 24)
+        self.assertEqual(data["window"], 1)
+
+    def test_matches_per_day_invalid_params(self):
+        response = self.client.get("/plots/matches_per_day/data/?points=0")
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get("/plots/matches_per_day/data/?window=foo")
+        self.assertEqual(response.status_code, 400)
+
+    def test_agent_elo(self):
+        response = self.client.get(
+            f"/plots/agent_elo_plot/{self.agent1.id}/data/?points=5&window=1"
+        )
+        self.assertEqual(response.status_code, 200)
+
+        data = response.json()
+        self.assertEqual(len(data["t"]), 5)
+        self.assertEqual(data["v"][0], 1508.5)
+
+    def test_game_season_elo(self):
+        response = self.client.get(
+            f"/plots/game_season_elo_plot/{self.game.id}/{self.season.id}/data/"
+        )
+        self.assertEqual(response.status_code, 200)
+
+        series = response.json()["series"]
+        self.assertEqual(len(series), 2)
+        self.assertEqual(len(series[0]["t"]), 10)
+
+
+class UserDetailViewTestCase(TestCase):
+    def setUp(self):
+        self.user = factories.UserFactory()
+        self.game = factories.GameFactory()
+        self.season = factories.SeasonFactory()
+
+        self.client = Client()
+
+    def _add_agent(self):
+        agent = factories.AgentFactory(owner=self.user, game=self.game)
+        models.AgentRatings.objects.create(
+            agent=agent, game=self.game, season=self.season
+        )
+
+    def _count_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f"/users/{self.user.id}/")
+
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def test_queries_do_not_scale_with_agents(self):
+        self._add_agent()
+        n_queries = self._count_queries()
+
+        for _ in range(5):
+            self._add_agent()
+
+        self.assertEqual(self._count_queries(), n_queries)
+
+
+class HomeViewTestCase(TestCase):
+    def setUp(self):
+        self.season = factories.SeasonFactory()
+        self.tournament = factories.TournamentFactory(season=self.season)
+        factories.MatchFactory(
+            ran=False, season=self.season, tournament=self.tournament
+        )
+
+        self.client = Client()
+
+    def test_get(self):
+        site_stats.refresh_snapshot()
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["pending_matches"], 1)
+        self.assertEqual(response.context["current_season_name"], self.season.name)
+
+    def test_get_without_snapshot(self):
+        cache.delete(settings.SITE_STATS_CACHE_KEY)
+
+        response = self.client.get("/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["pending_matches"], 1)
+
+
+class AboutViewTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+
+    def test_get(self):
+        site_stats.refresh_snapshot()
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/about/")
+
+        self.assertEqual(response.status_code, 200)
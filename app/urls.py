@@ -59,6 +59,11 @@ urlpatterns = [
     # API
     path("api/", include(router.urls)),
     path("api/next_match/", views.NextMatchAPIView.as_view(), name="next_match"),
+    path(
+        "api/leaderboard/<str:game_pk>/",
+        views.LeaderboardAPIView.as_view(),
+        name="leaderboard",
+    ),
     path(
         "api/automated_seasons/",
         views.AutomatedSeasonsAPIView.as_view(),
@@ -84,6 +89,22 @@ urlpatterns = [
         views.plot_game_season_elo,
         name="game_season_elo_plot",
     ),
+    # Plot data
+    path(
+        "plots/matches_per_day/data/",
+        views.plot_matches_per_day_data,
+        name="matches_per_day_data",
+    ),
+    path(
+        "plots/agent_elo_plot/<str:pk>/data/",
+        views.plot_agent_elo_data,
+        name="agent_elo_plot_data",
+    ),
+    path(
+        "plots/game_season_elo_plot/<str:game_pk>/<str:season_pk>/data/",
+        views.plot_game_season_elo_data,
+        name="game_season_elo_plot_data",
+    ),
     # Debug
     path("api/debug/ping/", views.PingAPIView.as_view(), name="ping"),
     path("api/debug/redis_info/", views.RedisInfoAPIView.as_view(), name="redis_info"),
@@ -107,4 +128,9 @@ urlpatterns = [
         views.MatchQueueDebugDetailView.as_view(),
         name="match_queue_debug_view",
     ),
+    path(
+        "debug/bulk_jobs",
+        views.BulkJobsDebugDetailView.as_view(),
+        name="bulk_jobs_debug_view",
+    ),
 ]
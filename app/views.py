@@ -1,7 +1,6 @@
 import json
 import logging
 import lzma
-from collections import defaultdict
 from datetime import timedelta
 
 import humanize
@@ -15,8 +14,10 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.core.files.base import ContentFile
 from django.core.paginator import Paginator
 from django.db.models import F
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import redirect, render
 from django.utils import timezone
+from django.utils.cache import patch_cache_control
 from django.views import generic
 from django.views.decorators.cache import cache_page
 from django_redis import get_redis_connection
@@ -31,11 +32,23 @@ from app import (
     metrics,
     models,
     permissions,
+    season_resolver,
     serializers,
     services,
     utils,
 )
-from app.services import match_queue
+from app.services import (
+    bulk_jobs,
+    leaderboard,
+    lifecycle,
+    match_counters,
+    match_queue,
+    ratings,
+    season_archive,
+    season_summary,
+    site_stats,
+    timeseries,
+)
 
 from . import plots
 
@@ -51,6 +64,9 @@ class AgentListView(generic.ListView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["games"] = models.Game.objects.active().with_agents().order_by("name")
+        context["leaderboards"] = [
+            (game, leaderboard.top(game)) for game in context["games"]
+        ]
         return context
 
     def get_queryset(self):
@@ -61,7 +77,7 @@ class AgentListView(generic.ListView):
                 owner_username=F("owner__username"),
             )
             .filter(active=True)
-            .filter(ratings__season__active=True, ratings__season__main=True)
+            .filter(ratings__season_id=season_resolver.current_id())
             .order_by("-elo_rating")
         )
 
@@ -154,57 +170,90 @@ class SeasonListView(generic.ListView):
         return Paginator(season_list, 25).page(season_page_number)
 
 
-class SeasonDetailView(generic.DetailView):
-    model = models.Season
-    template_name = "seasons/detail.html"
+def _archived_response(request, response, max_age):
+    """
+    Responses served from a season archive only change if the season gets
+    archived again, so they can be cached for a while. Pages for logged in
+    users have user specific bits, so only anonymous ones can be cached by
+    shared caches.
+    """
+    patch_cache_control(
+        response,
+        max_age=max_age,
+        **{"private" if request.user.is_authenticated else "public": True},
+    )
+    return response
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
 
-        season = self.get_object()
-        context["tournaments"] = season.tournaments.order_by("-end_date")[:25]
-        trophies = services.trophy.trophies_for_season(season)
+def _owner_emails(request, winners):
+    """
+    Emails of the owners on a winners list, which only staff gets to see.
+    They aren't part of the summary, so they never end up on the archives.
+    """
+    if not request.user.is_staff:
+        return {}
 
-        trophies_by_game = defaultdict(list)
-        for trophy in trophies:
-            game = str(trophy.agent.game_id)
-            trophies_by_game[game].append(trophy)
+    return dict(
+        User.objects.filter(
+            id__in={winner["owner_id"] for winner in winners}
+        ).values_list("id", "email")
+    )
 
-        context["game_name_by_id"] = {
-            str(game.id): game.pretty_name for game in season.games
-        }
-        context["trophies_by_game"] = dict(trophies_by_game)
-        context["agent_elo"] = {
-            rating.agent_id: rating.elo for rating in season.ratings.order_by("-elo")
-        }
 
-        return context
+class ArchivedSeasonMixin:
+    """
+    Renders the page of archived seasons from their snapshot, without touching
+    the database. `get_context_data` only runs for seasons that aren't
+    archived.
+    """
 
+    def get(self, request, *args, **kwargs):
+        snapshot = season_archive.load(kwargs["pk"])
+        if snapshot is None:
+            return super().get(request, *args, **kwargs)
+
+        context = {
+            "object": snapshot["season"],
+            "season": snapshot["season"],
+            "summary": snapshot["summary"],
+            "tournaments": snapshot["tournaments"],
+            "owner_emails": _owner_emails(request, snapshot["summary"]["winners"]),
+        }
+        return _archived_response(
+            request,
+            render(request, self.template_name, context),
+            season_archive.ARCHIVE_PAGE_MAX_AGE,
+        )
 
-class SeasonWinnersView(generic.DetailView):
-    model = models.Season
-    template_name = "seasons/winners.html"
+
+class SeasonDetailView(ArchivedSeasonMixin, generic.DetailView):
+    queryset = models.Season.objects.select_related("summary")
+    template_name = "seasons/detail.html"
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        season = self.get_object()
-        context["ratings"] = season.ratings.all().order_by("-elo")
-        context["ranking"] = {}
-
-        owner_list = set(
-            models.User.objects.filter(is_superuser=True).values_list("id", flat=True)
+        season = self.object
+        context["summary"] = season_summary.get(season)
+        context["tournaments"] = (
+            season.tournaments.with_state()
+            .select_related("game")
+            .order_by("-end_date")[:25]
         )
 
-        ranking = 1
-        for rating in context["ratings"]:
-            if rating.agent.owner.id not in owner_list:
-                context["ranking"][rating.agent_id] = ranking
-                owner_list.add(rating.agent.owner.id)
-                ranking += 1
-            else:
-                context["ranking"][rating.agent_id] = ""
+        return context
+
 
+class SeasonWinnersView(ArchivedSeasonMixin, generic.DetailView):
+    queryset = models.Season.objects.select_related("summary")
+    template_name = "seasons/winners.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["summary"] = season_summary.get(self.object)
+        context["owner_emails"] = _owner_emails(
+            self.request, context["summary"].winners
+        )
         return context
 
 
@@ -294,6 +343,17 @@ class TournamentDetailView(generic.DetailView):
     model = models.Tournament
     template_name = "tournaments/detail.html"
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+
+        tournament = self.object
+        context["participants"] = leaderboard.entries_for_agents(
+            tournament.game,
+            tournament.participants.values_list("id", flat=True),
+        )
+
+        return context
+
 
 class UserListView(generic.ListView):
     template_name = "users/index.html"
@@ -307,6 +367,11 @@ class UserDetailView(generic.DetailView):
     model = User
     template_name = "users/detail.html"
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["agents"] = self.object.agents.by_elo().select_related("game")
+        return context
+
 
 class UserEditView(generic.UpdateView):
     model = User
@@ -321,23 +386,14 @@ class AboutView(generic.TemplateView):
     template_name = "about.html"
 
     def get_context_data(self, *args, **kwargs):
+        stats = site_stats.get_snapshot()
+
         context = {}
-        context["games_ran_in_the_last_day"] = models.Match.objects.filter(
-            ran=True, ran_at__gte=timezone.now() - timedelta(days=1)
-        ).count()
-        context["games_ran_in_the_last_hour"] = models.Match.objects.filter(
-            ran=True, ran_at__gte=timezone.now() - timedelta(hours=1)
-        ).count()
-        context["games_ran_in_the_last_minute"] = models.Match.objects.filter(
-            ran=True, ran_at__gte=timezone.now() - timedelta(minutes=1)
-        ).count()
-        context["n_agents"] = (
-            models.Match.objects.filter(
-                ran=True, ran_at__gte=timezone.now() - timedelta(days=1)
-            )
-            .distinct("player1")
-            .count()
-        )
+        context["games_ran_in_the_last_day"] = stats["matches_24h"].value
+        context["games_ran_in_the_last_hour"] = stats["matches_1h"].value
+        context["games_ran_in_the_last_minute"] = stats["matches_1m"].value
+        context["n_agents"] = stats["active_agent_count"].value
+        context["stats_age"] = stats["matches_24h"].pretty_age
 
         return context
 
@@ -367,70 +423,32 @@ class HomeView(generic.TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["matches_1h"] = models.Match.objects.filter(
-            ran=True, ran_at__gte=timezone.now() - timedelta(hours=1)
-        ).count()
-        context["matches_24h"] = models.Match.objects.filter(
-            ran=True, ran_at__gte=timezone.now() - timedelta(days=1)
-        ).count()
-        context["active_agent_count"] = (
-            models.Match.objects.filter(
-                ran=True, ran_at__gte=timezone.now() - timedelta(days=1)
-            )
-            .distinct("player1")
-            .count()
-        )
-        context["open_tournament_count"] = models.Tournament.objects.filter(
-            done=False
-        ).count()
-
-        try:
-            context["current_season_name"] = models.Season.objects.current_season().name
-        except Exception:
-            context["current_season_name"] = "-"
-
-        context["pending_matches"] = models.Match.objects.filter(ran=False).count()
-
-        oldest_pending_match = (
-            models.Match.objects.filter(ran=False).order_by("created_at").first()
+        stats = site_stats.get_snapshot()
+
+        context["matches_1h"] = stats["matches_1h"].value
+        context["matches_24h"] = stats["matches_24h"].value
+        context["active_agent_count"] = stats["active_agent_count"].value
+        context["open_tournament_count"] = stats["open_tournament_count"].value
+        context["current_season_name"] = stats["current_season_name"].value
+        context["pending_matches"] = stats["pending_matches"].value
+        context["oldest_pending_match_age"] = site_stats.pretty_time_since(
+            stats["oldest_pending_match_created_at"].value
         )
 
-        context["oldest_pending_match_age"] = "-"
-        if oldest_pending_match:
-            age = (timezone.now() - oldest_pending_match.created_at).total_seconds()
-
-            if age < constants.ONE_HOUR:
-                minimum_unit = "seconds"
-            elif age < constants.ONE_DAY:
-                minimum_unit = "minutes"
-            else:
-                minimum_unit = "hours"
-
-            context["oldest_pending_match_age"] = humanize.precisedelta(
-                age,
-                minimum_unit=minimum_unit,
-                format="%0.0f",
-            )
-
         context["celery_heartbeat"] = "-"
-        time_since_last_celery_heartbeat = (
-            services.get_time_since_last_celery_heartbeat()
-        )
-        if time_since_last_celery_heartbeat is not None:
+        if last_heartbeat := stats["last_celery_heartbeat"].value:
             context["celery_heartbeat"] = (
-                services.prettify_time_delta(time_since_last_celery_heartbeat) + " ago"
+                site_stats.pretty_time_since(last_heartbeat) + " ago"
             )
 
         context["colosseum_heartbeat"] = "-"
-        time_since_last_colosseum_heartbeat = (
-            services.get_time_since_last_colosseum_heartbeat()
-        )
-        if time_since_last_colosseum_heartbeat is not None:
+        if last_heartbeat := stats["last_colosseum_heartbeat"].value:
             context["colosseum_heartbeat"] = (
-                services.prettify_time_delta(time_since_last_colosseum_heartbeat)
-                + " ago"
+                site_stats.pretty_time_since(last_heartbeat) + " ago"
             )
 
+        context["stats_age"] = {name: stat.pretty_age for name, stat in stats.items()}
+
         return context
 
 
@@ -446,6 +464,7 @@ class DebugListView(generic.TemplateView):
         context["context_object_name"] = "debug"
         context["endpoint_list"] = [
             {"name": "Match Queue", "url": "match_queue_debug_view"},
+            {"name": "Bulk Jobs", "url": "bulk_jobs_debug_view"},
             {"name": "Tainted Matches", "url": "tainted_matches_debug"},
             {"name": "Redis Info", "url": "redis_info"},
             {"name": "Ping", "url": "ping"},
@@ -501,6 +520,18 @@ class RedisInfoAPIView(APIView):
         return Response({"ping": conn.ping(), "info": conn.info()})
 
 
+class BulkJobsDebugDetailView(generic.TemplateView):
+    template_name = "debug/bulk_jobs.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["context_object_name"] = "bulk_jobs"
+        context["title"] = "Bulk Jobs"
+        context["jobs"] = bulk_jobs.all_jobs()
+
+        return context
+
+
 class MatchQueueDebugAPIView(APIView):
     permission_classes = []
     queryset = models.Match.objects.none()
@@ -567,9 +598,10 @@ class NextMatchAPIView(APIView):
     matches between tournaments.
 
     Doing a POST to this view checks if there are any tournaments where the
-    matches weren't created, and creates new matches accordingly. For timed
-    matches this is whenever the pending match count is less or equal to 10,
-    otherwise it is when there are no matches for the tournament.
+    matches weren't created, and creates new matches accordingly. Timed
+    tournaments are topped up whenever their pending matches drop below the
+    target depth, which follows the recent match throughput. Round robins get
+    all of their matches at once, and the other modes one round at a time.
     """
 
     permission_classes = [permissions.IsAdminUser]
@@ -592,6 +624,25 @@ class NextMatchAPIView(APIView):
         return Response()
 
 
+class LeaderboardAPIView(APIView):
+    """
+    Leaderboard of a game for the current season, ordered by elo. Accepts an
+    optional `limit`.
+    """
+
+    permission_classes = []
+    queryset = models.Agent.objects.none()
+
+    def get(self, request, game_pk):
+        game = models.Game.objects.get(id=game_pk)
+
+        limit = request.query_params.get("limit")
+        limit = int(limit) if limit and limit.isdigit() else None
+
+        entries = leaderboard.top(game, limit=limit)
+        return Response([entry.as_dict() for entry in entries])
+
+
 class UserViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAdminUserOrReadOnly]
     queryset = User.objects.all()
@@ -611,11 +662,26 @@ class AgentViewSet(viewsets.ModelViewSet):
             return self.serializer_class
         return self.unauth_serializer_class
 
+    def perform_update(self, serializer):
+        was_active = serializer.instance.active
+
+        agent = serializer.save()
+        leaderboard.update_agent(agent)
+
+        if was_active and not agent.active:
+            match_queue.cancel_agent_matches(agent)
+
+    @action(detail=True, methods=["get"])
+    def rank(self, request, pk=None):
+        agent = self.get_object()
+        return Response({"id": agent.id, "rank": leaderboard.rank(agent)})
+
     @action(detail=True, methods=["post"])
     def update_hash(self, request, pk=None):
         obj = self.get_object()
         obj.file_hash = utils.hash_file(obj.file)
         obj.save()
+
         return Response(obj.file_hash, status=status.HTTP_200_OK)
 
 
@@ -630,6 +696,15 @@ class SeasonViewSet(viewsets.ModelViewSet):
     queryset = models.Season.objects.all()
     serializer_class = serializers.SeasonSerializer
 
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        ratings.provision_season(serializer.instance)
+        lifecycle.schedule_season_transitions(serializer.instance)
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        lifecycle.schedule_season_transitions(serializer.instance)
+
 
 class MatchViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAdminUserOrReadOnly]
@@ -700,11 +775,16 @@ class MatchViewSet(viewsets.ModelViewSet):
         filter = {"ran": True}
 
         if params.get("current_season"):
-            current_season = models.Season.objects.current_season()
-            filter["season"] = current_season
+            filter["season_id"] = season_resolver.current_id()
 
         if hours_ago := params.get("hours_ago"):
-            filter["ran_at__gte"] = timezone.now() - timedelta(hours=int(hours_ago))
+            seconds_ago = int(hours_ago) * constants.ONE_HOUR
+
+            # Recent windows are served from the per minute counters
+            if "season_id" not in filter and seconds_ago <= constants.ONE_DAY:
+                return Response(match_counters.count_last(seconds_ago))
+
+            filter["ran_at__gte"] = timezone.now() - timedelta(seconds=seconds_ago)
 
         count = models.Match.objects.filter(**filter).count()
 
@@ -784,8 +864,140 @@ def plot_agent_elo(request, pk):
     return plots.plot_agent_elo(agent)
 
 
-@cache_page(constants.ONE_MINUTE)
 def plot_game_season_elo(request, game_pk, season_pk):
+    png = season_archive.elo_plot(season_pk, game_pk)
+    if png is not None:
+        return _archived_response(
+            request,
+            HttpResponse(png, content_type="image/png"),
+            season_archive.ARCHIVE_DATA_MAX_AGE,
+        )
+
+    return _plot_game_season_elo(request, game_pk, season_pk)
+
+
+@cache_page(constants.ONE_MINUTE)
+def _plot_game_season_elo(request, game_pk, season_pk):
     game = models.Game.objects.get(id=game_pk)
     season = models.Season.objects.get(id=season_pk)
     return plots.plot_game_season_elo(game, season)
+
+
+# Plot data
+#
+# Json versions of the plots above, so the charts can be rendered client side.
+# All of them accept `points`, the maximum number of points to return, and
+# `window`, the size of the trailing moving average.
+
+
+MAX_SERIES_POINTS = 2000
+
+
+def _parse_series_params(request, default_points, default_window):
+    try:
+        n_points = int(request.GET.get("points", default_points))
+        window = int(request.GET.get("window", default_window))
+    except ValueError:
+        return None, None
+
+    if not (0 < n_points <= MAX_SERIES_POINTS) or window < 1:
+        return None, None
+
+    return n_points, window
+
+
+def _invalid_series_params_response():
+    return JsonResponse(
+        {
+            "error": f"points must be between 1 and {MAX_SERIES_POINTS}, "
+            "and window must be a positive integer"
+        },
+        status=status.HTTP_400_BAD_REQUEST,
+    )
+
+
+@cache_page(constants.ONE_MINUTE - 1)
+def plot_matches_per_day_data(request):
+    n_points, window = _parse_series_params(request, 300, 15)
+    if n_points is None:
+        return _invalid_series_params_response()
+
+    x, y = timeseries.matches_per_minute()
+    data = timeseries.to_columnar(x, y, window=window, n_points=n_points)
+
+    return JsonResponse({"window": window, **data})
+
+
+@cache_page(constants.ONE_MINUTE)
+def plot_agent_elo_data(request, pk):
+    n_points, window = _parse_series_params(request, 300, 50)
+    if n_points is None:
+        return _invalid_series_params_response()
+
+    agent = models.Agent.objects.get(id=pk)
+    season = season_resolver.current()
+    x, y = timeseries.agent_elo(agent, season)
+    data = timeseries.to_columnar(x, y, window=window, n_points=n_points)
+
+    return JsonResponse(
+        {
+            "agent_id": agent.id,
+            "season_id": season.id if season else None,
+            "window": window,
+            **data,
+        }
+    )
+
+
+def plot_game_season_elo_data(request, game_pk, season_pk):
+    n_points, window = _parse_series_params(request, 100, 15)
+    if n_points is None:
+        return _invalid_series_params_response()
+
+    archived_series = season_archive.elo_series(season_pk, game_pk)
+    if archived_series is None:
+        return _plot_game_season_elo_data(request, game_pk, season_pk)
+
+    data = _game_season_elo_data(
+        game_pk, season_pk, archived_series, window=window, n_points=n_points
+    )
+    return _archived_response(
+        request, JsonResponse(data), season_archive.ARCHIVE_DATA_MAX_AGE
+    )
+
+
+@cache_page(constants.ONE_MINUTE)
+def _plot_game_season_elo_data(request, game_pk, season_pk):
+    n_points, window = _parse_series_params(request, 100, 15)
+
+    game = models.Game.objects.get(id=game_pk)
+    season = models.Season.objects.get(id=season_pk)
+    agent_series = [
+        ({"id": agent.id, "name": agent.name}, x, y)
+        for agent, x, y in timeseries.game_season_elo(game, season)
+    ]
+
+    return JsonResponse(
+        _game_season_elo_data(
+            game.id, season.id, agent_series, window=window, n_points=n_points
+        )
+    )
+
+
+def _game_season_elo_data(game_id, season_id, agent_series, *, window, n_points):
+    series = []
+    for agent, x, y in agent_series:
+        series.append(
+            {
+                "agent_id": agent["id"],
+                "agent_name": agent["name"],
+                **timeseries.to_columnar(x, y, window=window, n_points=n_points),
+            }
+        )
+
+    return {
+        "game_id": game_id,
+        "season_id": season_id,
+        "window": window,
+        "series": series,
+    }
@@ -91,6 +91,7 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "app.middleware.RatingsLoaderMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "debug_toolbar.middleware.DebugToolbarMiddleware",
@@ -231,6 +232,8 @@ INFLUXDB_USE_THREADING = config("INFLUXDB_USE_THREADING", default=False, cast=bo
 RANDOM_MATCH_ENABLED = os.environ.get("RANDOM_MATCH_ENABLED") == "true"
 RANDOM_MATCH_RATIO = float(os.environ.get("RANDOM_MATCH_RATIO", 0.5))
 MATCH_QUEUE_KEY = "match_queue"
+MATCH_COUNTER_KEY = "match_counter"
+LEADERBOARD_KEY = "leaderboard"
 
 
 DJANGO_CPROFILE_MIDDLEWARE_REQUIRE_STAFF = False
@@ -247,6 +250,46 @@ CELERY_WORKER_PREFETCH_MULTIPLIER = config(
 )
 CELERY_BROKER_URL = os.environ.get("CELERY_REDIS_URL")
 
+# Tasks are split in queues, so metrics and bulk jobs can't hold up the
+# heartbeat and tournament transitions. Each queue is meant to have its own
+# worker, e.g. `celery -A app worker -Q critical`, with the concurrency from
+# `CELERY_QUEUE_CONCURRENCY` unless `--concurrency` is given. Priorities go
+# from 0, the highest, to 9.
+CELERY_QUEUES = ["critical", "maintenance", "metrics", "bulk"]
+CELERY_QUEUE_CONCURRENCY = {
+    "critical": config("CELERY_CRITICAL_CONCURRENCY", 2, cast=int),
+    "maintenance": config("CELERY_MAINTENANCE_CONCURRENCY", 1, cast=int),
+    "metrics": config("CELERY_METRICS_CONCURRENCY", 2, cast=int),
+    "bulk": config("CELERY_BULK_CONCURRENCY", 1, cast=int),
+}
+CELERY_TASK_DEFAULT_QUEUE = "maintenance"
+CELERY_TASK_DEFAULT_PRIORITY = 5
+# Priorities within a queue come from `priority_steps`. Queues themselves are
+# consumed round robin, so a worker on several queues never starves one of
+# them. Tasks with an ETA further ahead than the visibility timeout get
+# redelivered every time it runs out, see `lifecycle.SCHEDULE_HORIZON`
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    "visibility_timeout": 60 * 60,
+    "priority_steps": list(range(10)),
+    "sep": ":",
+}
+CELERY_TASK_ROUTES = {
+    "app.tasks.heartbeat": {"queue": "critical", "priority": 0},
+    "app.tasks.update_season_state": {"queue": "critical", "priority": 0},
+    "app.tasks.update_tournament_state": {"queue": "critical", "priority": 1},
+    "app.tasks.automated_manager": {"queue": "maintenance", "priority": 2},
+    "app.tasks.regenerate_queue": {"queue": "maintenance", "priority": 3},
+    "app.tasks.reconcile_match_counters": {"queue": "maintenance", "priority": 4},
+    "app.tasks.refresh_site_stats": {"queue": "maintenance", "priority": 5},
+    "app.tasks.refresh_season_summaries": {"queue": "maintenance", "priority": 6},
+    "app.tasks.metrics_logger": {"queue": "metrics", "priority": 5},
+    "app.tasks.push_metric": {"queue": "metrics", "priority": 6},
+    "app.tasks._push_metric": {"queue": "metrics", "priority": 6},
+    "app.tasks.run_bulk_job": {"queue": "bulk", "priority": 8},
+    "app.tasks.create_trophies": {"queue": "bulk", "priority": 9},
+    "app.tasks.archive_seasons": {"queue": "bulk", "priority": 9},
+}
+
 # FIXME
 CORS_ALLOW_ALL_ORIGINS = True
 
@@ -256,7 +299,20 @@ REPLAY_JS_BUNDLE_URL = config("REPLAY_JS_BUNDLE_URL", default="")
 
 CELERY_HEARTBEAT_KEY = "celery_heartbeat"
 COLOSSEUM_HEARTBEAT_KEY = "colosseum_heartbeat"
+SITE_STATS_CACHE_KEY = "site_stats_snapshot"
+TASK_LOCK_KEY = "task_lock"
+LIFECYCLE_SCHEDULE_KEY = "lifecycle_schedule"
+BULK_JOB_KEY = "bulk_job"
+SEASON_ARCHIVE_CACHE_KEY = "season_archive"
+CURRENT_SEASON_VERSION_KEY = "current_season_version"
+
+# Keeps the current season in memory on each process, see `app.season_resolver`
+CURRENT_SEASON_CACHE_ENABLED = config(
+    "CURRENT_SEASON_CACHE_ENABLED", default=True, cast=bool
+)
 
 ENABLE_AUTOMATED_SEASONS = config("ENABLE_AUTOMATED_SEASONS", default=True, cast=bool)
+# How ratings of new seasons are seeded: reset, carry_over or regress
+SEASON_RATINGS_SEEDING = config("SEASON_RATINGS_SEEDING", default="reset")
 
 X_FRAME_OPTIONS = "ALLOW-FROM https://app.gather.town/"
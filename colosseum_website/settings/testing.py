@@ -1,3 +1,5 @@
+import tempfile
+
 from .base import *  # noqa
 
 
@@ -10,6 +12,13 @@ INFLUXDB_USE_CELERY = False
 INFLUXDB_USE_THREADING = True
 CELERY_TASK_ALWAYS_EAGER = True
 
+# Tests create and delete seasons inside transactions that never commit, so
+# the version would never get bumped
+CURRENT_SEASON_CACHE_ENABLED = False
+
+DEFAULT_FILE_STORAGE = "django.core.files.storage.FileSystemStorage"
+MEDIA_ROOT = tempfile.mkdtemp(prefix="colosseum_media_")
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,